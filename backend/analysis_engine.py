@@ -0,0 +1,187 @@
+import os
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from database import AsyncSessionLocal
+import models
+from chain import reality_query, consumption
+from vector_store import analyze_product, llm, ANALYSIS_PROMPT_VERSION
+from singleflight import SingleFlight
+from metrics import registry
+
+load_dotenv()
+
+# How long an analysis is served before it is regenerated
+ANALYSIS_MAX_AGE = timedelta(hours=float(os.getenv("ANALYSIS_MAX_AGE_HOURS", "24")))
+
+# Number of prompts a single analysis used to cost: one for the reality
+# check and one for the consumption advice, both with the same prompt.
+PROMPTS_PER_ANALYSIS = 2
+
+# The hit rate is fresh / all checks; the other results say why an analysis was regenerated
+freshness_checks = registry.counter(
+    "analysis_freshness_checks_total", "Stored analysis freshness checks by result", ("result",))
+
+
+def _latest_analysis_query(product_id):
+    return (
+        select(models.Analysis)
+        .where(models.Analysis.product_id == product_id)
+        .order_by(models.Analysis.created_at.desc())
+        .limit(1)
+    )
+
+
+def latest_analysis(db, product_id):
+    return db.scalars(_latest_analysis_query(product_id)).first()
+
+
+async def latest_analysis_async(db, product_id):
+    return (await db.scalars(_latest_analysis_query(product_id))).first()
+
+
+def analysis_version():
+    """(model, prompt version) that new analyses are generated with"""
+    return llm.model_name, ANALYSIS_PROMPT_VERSION
+
+
+def freshness(analysis, product=None) -> str:
+    """Why an analysis can or cannot be served: "fresh", "missing",
+    "expired", "outdated" (older model or prompts) or "product_updated"
+    """
+    if analysis is None:
+        return "missing"
+    if datetime.utcnow() - analysis.created_at >= ANALYSIS_MAX_AGE:
+        return "expired"
+    if (analysis.model_version, analysis.prompt_version) != analysis_version():
+        return "outdated"
+    if product is not None and product.updated_at is not None and product.updated_at > analysis.created_at:
+        return "product_updated"
+    return "fresh"
+
+
+def is_fresh(analysis, product=None) -> bool:
+    """An analysis is served from the database while it is younger than
+    ANALYSIS_MAX_AGE, was generated by the current model and prompts and,
+    when the product is given, is newer than its last update"""
+    result = freshness(analysis, product)
+    freshness_checks.inc(result=result)
+    return result == "fresh"
+
+
+def is_error(text) -> bool:
+    # analyze_product reports errors as text instead of raising
+    return text.startswith("Error analyzing product")
+
+
+class AnalysisFailed(Exception):
+    """The model reported an error instead of an analysis; nothing was stored"""
+
+
+async def build_analysis(product, name, text):
+    """An unsaved `Analysis` built from one generated analysis text"""
+    reality_result = await reality_query(
+        title=name,
+        ingredients=product.ingredients,
+        nutritional=product.nutritional_info,
+        additives="",
+        analysis=text
+    )
+    consumption_result = await consumption(
+        title=name,
+        ingredients=product.ingredients,
+        nutritional=product.nutritional_info,
+        additives="",
+        allergies="",
+        diseases="",
+        analysis=text
+    )
+
+    model_version, prompt_version = analysis_version()
+    return models.Analysis(
+        product_id=product.id,
+        reality_check=reality_result,
+        consumption_advice=consumption_result["consumption"],
+        health_implications=consumption_result["assessment"],
+        model_version=model_version,
+        prompt_version=prompt_version
+    )
+
+
+async def store_analysis_async(db, product, name, text):
+    """Build and persist an analysis through an `AsyncSession`"""
+    analysis = await build_analysis(product, name, text)
+    db.add(analysis)
+    await db.commit()
+    return analysis
+
+
+class AnalysisEngine:
+    """Generates product analyses with at most one LLM call per product.
+
+    The reality check and the consumption advice are built from the same
+    prompt, so it is generated once and shared between both fields.
+    Concurrent requests for the same EAN join the generation that is already
+    in flight instead of starting their own.
+    """
+
+    def __init__(self):
+        self._flights = SingleFlight()
+        self.requests = 0
+        self.generations = 0
+        self.failures = 0
+        self.coalesced = 0
+        self.llm_calls = 0
+        self.llm_calls_avoided = 0
+
+    async def analyze(self, product, name):
+        """Return a fresh `models.Analysis` for the product, generating it if
+        needed; raises AnalysisFailed if the model reports an error"""
+        self.requests += 1
+        if self._flights.in_flight(product.ean):
+            self.coalesced += 1
+            self.llm_calls_avoided += PROMPTS_PER_ANALYSIS
+
+        product_id = product.id
+        return await self._flights.do(
+            product.ean,
+            lambda: self._generate(product_id, name)
+        )
+
+    async def _generate(self, product_id, name):
+        # Uses its own session so a disconnecting leader cannot close the
+        # session the other waiters depend on.
+        async with AsyncSessionLocal() as db:
+            # Another flight may have finished between the caller's freshness
+            # check and this one starting.
+            product = await db.get(models.Product, product_id)
+            existing_analysis = await latest_analysis_async(db, product_id)
+            if is_fresh(existing_analysis, product):
+                self.llm_calls_avoided += PROMPTS_PER_ANALYSIS
+                return existing_analysis
+
+            text = await analyze_product(name, product.ingredients, route="products_analyze")
+            self.llm_calls += 1
+            if is_error(text):
+                # Stored, the error text would be served as a fresh analysis
+                self.failures += 1
+                raise AnalysisFailed(text)
+            self.generations += 1
+            self.llm_calls_avoided += PROMPTS_PER_ANALYSIS - 1
+            return await store_analysis_async(db, product, name, text)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "generations": self.generations,
+            "failures": self.failures,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._flights),
+            "llm_calls": self.llm_calls,
+            "llm_calls_avoided": self.llm_calls_avoided,
+        }
+
+
+analyzer = AnalysisEngine()
@@ -0,0 +1,304 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+from dotenv import load_dotenv
+from sqlalchemy import func, update
+
+from database import AsyncSessionLocal, batched
+import models
+from analysis_engine import is_fresh, is_error, store_analysis_async
+from ingredient_clusters import canonical_products
+from vector_store import analyze_product, analyze_products_batch
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+Item = models.AnalysisJobItem
+
+
+class AnalysisJobQueue:
+    """Background analysis of queued products, persisted in the database.
+
+    Jobs and their items live in `analysis_jobs` and `analysis_job_items`,
+    so the queue survives a restart: items a worker held when the server
+    stopped go back to pending on startup. A worker claims one product at a
+    time, or a pack of up to `pack_size` products with short ingredient
+    lists that share one multi-product prompt; products the reply leaves
+    out are retried with their own prompt. Every model call goes through
+    the shared LLM client, which enforces the global rate limit and token
+    budget.
+    """
+
+    def __init__(self, workers=2, pack_size=5, pack_max_chars=400, poll_interval=5.0):
+        self.workers = workers
+        self.pack_size = pack_size
+        self.pack_max_chars = pack_max_chars
+        self.poll_interval = poll_interval
+        self._tasks = []
+        self._wakeup = None
+        self._claim_lock = asyncio.Lock()
+        self.packed_prompts = 0
+        self.packed_products = 0
+        self.single_prompts = 0
+        self.split_failures = 0
+
+    def enqueue(self, db, eans):
+        """Create a job for the EANs; products with a fresh analysis are done at once.
+
+        Near-duplicates are queued as their canonical product, so a job
+        holding several pack sizes of one recipe analyzes it once.
+        """
+        eans = list(dict.fromkeys(eans))
+        products, latest = {}, {}
+        for batch in batched(eans):
+            found = db.query(models.Product).filter(models.Product.ean.in_(batch)).all()
+            canonical = canonical_products(db, found)
+            for product in found:
+                products[product.ean] = canonical[product.id]
+        product_ids = list({product.id for product in products.values()})
+        for batch in batched(product_ids):
+            newest = (
+                db.query(func.max(models.Analysis.id))
+                .filter(models.Analysis.product_id.in_(batch))
+                .group_by(models.Analysis.product_id)
+            )
+            for analysis in db.query(models.Analysis).filter(models.Analysis.id.in_(newest)):
+                latest[analysis.product_id] = analysis
+
+        job = models.AnalysisJob(total=len(eans), status="queued")
+        db.add(job)
+        db.flush()
+        items = []
+        for ean in eans:
+            product = products.get(ean)
+            if product is None:
+                items.append(Item(job_id=job.id, ean=ean, status="failed", error="Product not found"))
+            elif is_fresh(latest.get(product.id), product):
+                items.append(Item(job_id=job.id, ean=ean, product_id=product.id,
+                                  status="done", analysis_id=latest[product.id].id))
+            else:
+                items.append(Item(job_id=job.id, ean=ean, product_id=product.id, status="pending"))
+        db.add_all(items)
+        if not any(item.status == "pending" for item in items):
+            job.status = "completed"
+            job.started_at = job.finished_at = datetime.utcnow()
+        db.commit()
+        db.refresh(job)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def start(self):
+        """Requeue items interrupted by the last shutdown and start the workers"""
+        async with AsyncSessionLocal() as db:
+            requeued = (await db.execute(
+                update(Item).where(Item.status == "running").values(status="pending")
+            )).rowcount
+            await db.commit()
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted analysis job items")
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            claimed = await self._claim()
+            if not claimed:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._process(claimed)
+            except Exception as e:
+                logger.exception("Analysis job worker failed")
+                async with AsyncSessionLocal() as db:
+                    await db.run_sync(self._settle, [item_id for item_id, _, _ in claimed], error=str(e))
+                    await db.run_sync(self._complete_finished_jobs, {job_id for _, job_id, _ in claimed})
+
+    # The workers share the server's event loop, so every query goes through
+    # an AsyncSession; the synchronous helpers below run inside run_sync
+
+    async def _claim(self):
+        """Mark the next pending item, or a pack of short ones, as running"""
+        async with self._claim_lock:
+            async with AsyncSessionLocal() as db:
+                return await db.run_sync(self._claim_items)
+
+    def _claim_items(self, db):
+        first = db.query(Item).filter(Item.status == "pending").order_by(Item.id).first()
+        if first is None:
+            return []
+        candidates = [first]
+        product = db.get(models.Product, first.product_id)
+        if self.pack_size > 1 and len(product.ingredients or "") <= self.pack_max_chars:
+            candidates += (
+                db.query(Item)
+                .join(models.Product, models.Product.id == Item.product_id)
+                .filter(
+                    Item.status == "pending", Item.id != first.id,
+                    func.length(func.coalesce(models.Product.ingredients, "")) <= self.pack_max_chars
+                )
+                .order_by(Item.id)
+                .limit(self.pack_size - 1)
+                .all()
+            )
+        claimed = []
+        now = datetime.utcnow()
+        for item in candidates:
+            # Conditional, so two servers sharing the queue never claim the same item
+            if db.execute(
+                update(Item).where(Item.id == item.id, Item.status == "pending")
+                .values(status="running", updated_at=now)
+            ).rowcount:
+                claimed.append((item.id, item.job_id, item.product_id))
+        db.query(models.AnalysisJob).filter(
+            models.AnalysisJob.id.in_({job_id for _, job_id, _ in claimed}),
+            models.AnalysisJob.status == "queued"
+        ).update({"status": "running", "started_at": now}, synchronize_session=False)
+        db.commit()
+        return claimed
+
+    def _needing_analysis(self, db, items_by_product):
+        """Settle the items of products analyzed since they were queued; returns the other products"""
+        products = []
+        for product_id, item_ids in items_by_product.items():
+            existing = (
+                db.query(models.Analysis).filter(models.Analysis.product_id == product_id)
+                .order_by(models.Analysis.created_at.desc()).first()
+            )
+            product = db.get(models.Product, product_id)
+            if is_fresh(existing, product):
+                self._settle(db, item_ids, analysis_id=existing.id)
+            else:
+                products.append(product)
+        # No transaction stays open while the model calls run
+        db.commit()
+        return products
+
+    async def _process(self, claimed):
+        async with AsyncSessionLocal() as db:
+            # The same product can be queued by several jobs
+            items_by_product = {}
+            for item_id, _, product_id in claimed:
+                items_by_product.setdefault(product_id, []).append(item_id)
+            products = await db.run_sync(self._needing_analysis, items_by_product)
+
+            texts = [None] * len(products)
+            if len(products) > 1:
+                try:
+                    texts = await analyze_products_batch([(p.name, p.ingredients) for p in products])
+                    self.packed_prompts += 1
+                    self.packed_products += sum(text is not None for text in texts)
+                except Exception as e:
+                    logger.warning(f"Packed analysis of {len(products)} products failed, splitting: {e}")
+                self.split_failures += texts.count(None)
+
+            # Products without a section get a prompt of their own
+            missing = [i for i, text in enumerate(texts) if text is None]
+            singles = await asyncio.gather(*(
+                analyze_product(products[i].name, products[i].ingredients, route="batch_analyze")
+                for i in missing
+            ))
+            self.single_prompts += len(missing)
+            for i, text in zip(missing, singles):
+                texts[i] = text
+
+            for product, text in zip(products, texts):
+                if is_error(text):
+                    await db.run_sync(self._settle, items_by_product[product.id], error=text)
+                else:
+                    analysis = await store_analysis_async(db, product, product.name, text)
+                    await db.run_sync(self._settle, items_by_product[product.id], analysis_id=analysis.id)
+            await db.run_sync(self._complete_finished_jobs, {job_id for _, job_id, _ in claimed})
+
+    def _settle(self, db, item_ids, analysis_id=None, error=None):
+        db.execute(
+            update(Item).where(Item.id.in_(item_ids)).values(
+                status="failed" if error else "done", analysis_id=analysis_id,
+                error=error, updated_at=datetime.utcnow()
+            )
+        )
+        db.commit()
+
+    def _complete_finished_jobs(self, db, job_ids):
+        for job_id in job_ids:
+            remaining = db.query(func.count(Item.id)).filter(
+                Item.job_id == job_id, Item.status.in_(["pending", "running"])
+            ).scalar()
+            if not remaining:
+                db.query(models.AnalysisJob).filter(models.AnalysisJob.id == job_id).update(
+                    {"status": "completed", "finished_at": datetime.utcnow()}, synchronize_session=False
+                )
+        db.commit()
+
+    def status(self, db, job_id):
+        """Progress, throughput and failures of a job, or None if it does not exist"""
+        job = db.get(models.AnalysisJob, job_id)
+        if job is None:
+            return None
+        counts = dict(
+            db.query(Item.status, func.count(Item.id)).filter(Item.job_id == job_id).group_by(Item.status).all()
+        )
+        finished = counts.get("done", 0) + counts.get("failed", 0)
+        remaining = counts.get("pending", 0) + counts.get("running", 0)
+
+        elapsed = rate = eta = None
+        if job.started_at:
+            elapsed = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds()
+            # Items settled by the workers; ones already fresh at enqueue time do not count
+            processed = db.query(func.count(Item.id)).filter(
+                Item.job_id == job_id, Item.status.in_(["done", "failed"]), Item.updated_at >= job.started_at
+            ).scalar()
+            if elapsed > 0 and processed:
+                rate = processed / elapsed * 60
+                eta = remaining / rate * 60 if remaining else 0.0
+
+        failures = (
+            db.query(Item.ean, Item.error).filter(Item.job_id == job_id, Item.status == "failed")
+            .order_by(Item.id).limit(50).all()
+        )
+        return {
+            "id": job.id,
+            "status": job.status,
+            "total": job.total,
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "pending": counts.get("pending", 0),
+            "running": counts.get("running", 0),
+            "progress": finished / job.total if job.total else 1.0,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+            "elapsed_seconds": elapsed,
+            "items_per_minute": rate,
+            "eta_seconds": eta,
+            "failures": [{"ean": ean, "error": error} for ean, error in failures],
+        }
+
+    def stats(self):
+        return {
+            "workers": len(self._tasks),
+            "packed_prompts": self.packed_prompts,
+            "packed_products": self.packed_products,
+            "single_prompts": self.single_prompts,
+            "split_failures": self.split_failures,
+        }
+
+
+jobs = AnalysisJobQueue(
+    workers=int(os.getenv("ANALYSIS_WORKERS", "2")),
+    pack_size=int(os.getenv("ANALYSIS_PACK_SIZE", "5")),
+    pack_max_chars=int(os.getenv("ANALYSIS_PACK_MAX_CHARS", "400")),
+)
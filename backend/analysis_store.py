@@ -0,0 +1,218 @@
+import argparse
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import Text, and_, exists, func, inspect, or_, select, text, type_coerce, update
+from sqlalchemy.orm import aliased
+
+from database import SessionLocal, engine
+import models
+from analysis_engine import analysis_version, latest_analysis
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Superseded analyses are kept this long before compaction deletes them
+ANALYSIS_RETENTION_DAYS = float(os.getenv("ANALYSIS_RETENTION_DAYS", "30"))
+
+TEXT_COLUMNS = ("reality_check", "consumption_advice", "health_implications")
+_VERSION_COLUMNS = {"model_version": "VARCHAR(64)", "prompt_version": "VARCHAR(16)"}
+_BATCH = 500
+# Products sampled when timing latest-analysis lookups
+_LOOKUP_SAMPLE = 200
+
+
+def ensure_schema(engine):
+    """Bring an `analyses` table created before versioning up to date.
+
+    create_all() only adds missing tables, so the version columns and the
+    composite lookup index are added here when absent.
+    """
+    columns = {column["name"] for column in inspect(engine).get_columns("analyses")}
+    with engine.begin() as conn:
+        for name, column_type in _VERSION_COLUMNS.items():
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE analyses ADD COLUMN {name} {column_type}"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_analyses_product_created ON analyses (product_id, created_at)"
+        ))
+
+
+def _superseded():
+    """Analyses with a newer analysis of the same product"""
+    newer = aliased(models.Analysis)
+    return exists().where(and_(
+        newer.product_id == models.Analysis.product_id,
+        newer.created_at > models.Analysis.created_at,
+    ))
+
+
+def compact(db, retention_days=ANALYSIS_RETENTION_DAYS, dry_run=False):
+    """Delete superseded analyses older than the retention period.
+
+    The latest analysis of every product is always kept, however old.
+    Job items pointing at a deleted analysis keep their status and lose
+    the reference. Returns the number of analyses deleted.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    candidates = select(models.Analysis.id).where(models.Analysis.created_at < cutoff, _superseded())
+    if dry_run:
+        return db.scalar(select(func.count()).select_from(candidates.subquery()))
+
+    deleted = 0
+    while True:
+        # Small batches keep each write transaction, and SQLite's lock, short
+        ids = db.scalars(candidates.limit(_BATCH)).all()
+        if not ids:
+            break
+        db.execute(
+            update(models.AnalysisJobItem).where(models.AnalysisJobItem.analysis_id.in_(ids))
+            .values(analysis_id=None)
+        )
+        db.execute(models.Analysis.__table__.delete().where(models.Analysis.id.in_(ids)))
+        db.commit()
+        deleted += len(ids)
+        logger.info(f"Deleted {deleted} superseded analyses")
+    return deleted
+
+
+def _stored_compressed(column):
+    # Compared as plain text, so the prefix literal is not compressed itself
+    return type_coerce(column, Text).startswith(models.CompressedText.PREFIX, autoescape=True)
+
+
+def recompress(db):
+    """Rewrite analyses stored before compression so they are compressed too.
+
+    Returns the number of rows rewritten.
+    """
+    table = models.Analysis.__table__
+    min_length = table.c.reality_check.type.min_length
+    plain = [
+        and_(func.length(table.c[name]) >= min_length, ~_stored_compressed(table.c[name]))
+        for name in TEXT_COLUMNS
+    ]
+    rewritten, last_id = 0, 0
+    while True:
+        # Reading through the ORM decompresses, writing back compresses
+        rows = db.scalars(
+            select(models.Analysis).where(models.Analysis.id > last_id, or_(*plain))
+            .order_by(models.Analysis.id).limit(_BATCH)
+        ).all()
+        if not rows:
+            break
+        for analysis in rows:
+            db.execute(
+                update(models.Analysis).where(models.Analysis.id == analysis.id)
+                .values({name: getattr(analysis, name) for name in TEXT_COLUMNS})
+            )
+        last_id = rows[-1].id
+        db.commit()
+        db.expunge_all()
+        rewritten += len(rows)
+        logger.info(f"Recompressed {rewritten} analyses")
+    return rewritten
+
+
+def _table_bytes(db):
+    """On-disk size of the table and its indexes, where the database can tell"""
+    try:
+        if db.bind.dialect.name == "postgresql":
+            return db.scalar(text("SELECT pg_total_relation_size('analyses')"))
+        return db.scalar(text(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name = 'analyses' OR name LIKE 'ix_analyses%'"
+        ))
+    except Exception:
+        # SQLite builds without the dbstat virtual table
+        db.rollback()
+        return None
+
+
+def _lookup_plan(db, product_id):
+    statement = (
+        select(models.Analysis.id).where(models.Analysis.product_id == product_id)
+        .order_by(models.Analysis.created_at.desc()).limit(1)
+        .compile(db.bind, compile_kwargs={"literal_binds": True})
+    )
+    if db.bind.dialect.name == "sqlite":
+        return [row[-1] for row in db.execute(text(f"EXPLAIN QUERY PLAN {statement}"))]
+    return [row[0] for row in db.execute(text(f"EXPLAIN {statement}"))]
+
+
+def report(db):
+    """Row counts, stored size and latest-analysis lookup cost of the analyses table"""
+    table = models.Analysis.__table__
+    model_version, prompt_version = analysis_version()
+    rows = db.scalar(select(func.count(table.c.id)))
+    products = db.scalar(select(func.count(func.distinct(table.c.product_id))))
+    superseded = db.scalar(select(func.count(models.Analysis.id)).where(_superseded()))
+    outdated = db.scalar(select(func.count(table.c.id)).where(
+        table.c.model_version.is_distinct_from(model_version) | table.c.prompt_version.is_distinct_from(prompt_version)
+    ))
+    stored = {
+        name: db.scalar(select(func.coalesce(func.sum(func.length(table.c[name])), 0)))
+        for name in TEXT_COLUMNS
+    }
+    compressed = db.scalar(select(func.count(table.c.id)).where(_stored_compressed(table.c.reality_check)))
+
+    product_ids = db.scalars(select(table.c.product_id).distinct().limit(10 * _LOOKUP_SAMPLE)).all()
+    sample = random.sample(product_ids, min(_LOOKUP_SAMPLE, len(product_ids)))
+    start = time.perf_counter()
+    for product_id in sample:
+        latest_analysis(db, product_id)
+        db.expunge_all()
+    lookup_ms = (time.perf_counter() - start) * 1000 / len(sample) if sample else None
+
+    return {
+        "rows": rows,
+        "products": products,
+        "superseded": superseded,
+        "outdated_version": outdated,
+        "compressed_rows": compressed,
+        "stored_text_chars": stored,
+        "table_bytes": _table_bytes(db),
+        "latest_lookup_ms": round(lookup_ms, 3) if lookup_ms is not None else None,
+        "latest_lookup_plan": _lookup_plan(db, sample[0]) if sample else [],
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain the stored product analyses")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("report", help="Print storage and lookup costs")
+    compact_parser = commands.add_parser("compact", help="Delete superseded analyses past the retention period")
+    compact_parser.add_argument("--retention-days", type=float, default=ANALYSIS_RETENTION_DAYS)
+    compact_parser.add_argument("--dry-run", action="store_true", help="Only count what would be deleted")
+    compact_parser.add_argument("--recompress", action="store_true", help="Also compress rows stored uncompressed")
+    compact_parser.add_argument("--vacuum", action="store_true", help="Return freed space to the filesystem afterwards")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    ensure_schema(engine)
+    db = SessionLocal()
+    try:
+        before = report(db)
+        print(json.dumps({"before": before} if args.command == "compact" else before, indent=2, default=str))
+        if args.command == "compact":
+            deleted = compact(db, args.retention_days, args.dry_run)
+            print(f"{'Would delete' if args.dry_run else 'Deleted'} {deleted} superseded analyses")
+            if args.recompress and not args.dry_run:
+                print(f"Recompressed {recompress(db)} analyses")
+    finally:
+        db.close()
+    if args.command == "compact" and not args.dry_run:
+        if args.vacuum:
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("VACUUM"))
+        db = SessionLocal()
+        try:
+            print(json.dumps({"after": report(db)}, indent=2, default=str))
+        finally:
+            db.close()
@@ -1,12 +1,18 @@
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
 from models import User
+from metrics import LatencyHistogram
 import os
 from dotenv import load_dotenv
 
@@ -20,12 +26,108 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# bcrypt releases the GIL, so a thread pool keeps hashing off the event loop
+_hash_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("AUTH_HASH_WORKERS", "4")), thread_name_prefix="bcrypt"
+)
+hash_latency = LatencyHistogram()
+# Time spent resolving the bearer token to a user on every authenticated request
+auth_latency = LatencyHistogram()
+
+
+class PrincipalCache:
+    """Short-lived map from bearer tokens to the users they resolve to.
+
+    Users are kept detached from any session and merged into the request's
+    session without a query. Entries expire after `ttl` seconds, or earlier
+    when the token does, the least recently used are evicted past
+    `max_size`, and `invalidate()` drops every token of a user whose row
+    changed.
+    """
+
+    def __init__(self, ttl=60.0, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._tokens_by_subject = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token):
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, subject, user = entry
+        if time.monotonic() >= expires_at:
+            self._drop(token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return user
+
+    def put(self, token, subject, user, token_expires_at=None):
+        expires_at = time.monotonic() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, time.monotonic() + token_expires_at - time.time())
+        self._entries[token] = (expires_at, subject, user)
+        self._entries.move_to_end(token)
+        self._tokens_by_subject.setdefault(subject, set()).add(token)
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, subject):
+        for token in self._tokens_by_subject.pop(subject, ()):
+            self._entries.pop(token, None)
+
+    def _drop(self, token):
+        _, subject, _ = self._entries.pop(token)
+        tokens = self._tokens_by_subject.get(subject)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_subject[subject]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+principal_cache = PrincipalCache(
+    ttl=float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60")),
+    max_size=int(os.getenv("AUTH_CACHE_SIZE", "10000")),
+)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+async def _in_hash_pool(fn, *args):
+    start = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_pool, fn, *args)
+    finally:
+        hash_latency.observe(time.perf_counter() - start)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the hashing pool, for use from request handlers"""
+    return await _in_hash_pool(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash on the hashing pool, for use from request handlers"""
+    return await _in_hash_pool(get_password_hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -36,24 +138,40 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> User:
+    with auth_latency.time():
+        cached = principal_cache.get(token)
+        if cached is not None:
+            # Attach the cached user to this request's session without a SELECT
+            return await db.merge(cached, load=False)
+
+        credentials_exception = HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            email: str = payload.get("sub")
+            if email is None:
+                raise credentials_exception
+        except JWTError:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-        
-    user = db.query(User).filter(User.email == email).first()
-    if user is None:
-        raise credentials_exception
-    return user
+
+        user = await db.scalar(select(User).where(User.email == email))
+        if user is None:
+            raise credentials_exception
+        # The cache keeps the detached instance; the request works on a merged copy
+        db.expunge(user)
+        principal_cache.put(token, email, user, payload.get("exp"))
+        return await db.merge(user, load=False)
+
+def auth_stats():
+    return {
+        "principal_cache": principal_cache.stats(),
+        "resolve": auth_latency.summary(),
+        "password_hashing": hash_latency.summary(),
+    }
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
     return current_user 
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""Synthetic BigBasket catalog, shaped like the cleaned CSV import_data.py reads.
+
+Rows carry the scraper's columns (product_name, Ingredients, Nutritional,
+About, EAN, url) with realistic value sizes; Nutritional is the Python
+dict literal the BigBasket pages produce. A small share of rows repeat an
+EAN or have none, as in a real scrape. Output is deterministic per seed.
+
+    python -m benchmarks.catalog catalog.csv --products 20000
+"""
+import argparse
+import csv
+import random
+
+COLUMNS = ["product_name", "Ingredients", "Nutritional", "About", "EAN", "url"]
+
+BRANDS = ["Haldiram's", "Lay's", "Bingo", "Britannia", "Parle", "Too Yumm", "Amul", "Kellogg's",
+          "Tata Sampann", "Maggi", "Cadbury", "Sunfeast", "MTR", "Aashirvaad", "Kurkure"]
+PRODUCTS = ["Aloo Bhujia", "Masala Chips", "Salted Peanuts", "Cream Biscuits", "Multigrain Puffs",
+            "Moong Dal", "Corn Flakes", "Instant Noodles", "Dark Chocolate", "Oats", "Digestive Biscuits",
+            "Peanut Butter", "Mango Drink", "Paneer", "Atta", "Poha", "Khakhra", "Granola Bar"]
+INGREDIENTS = [
+    "Edible Vegetable Oil (Palmolein Oil)", "Potato", "Gram Flour", "Salt", "Sugar", "Spices and Condiments",
+    "Wheat Flour", "Milk Solids", "Flavour Enhancer (INS 627, INS 631)", "Acidity Regulator (INS 330)",
+    "Antioxidant (INS 319)", "Peanuts", "Rice Flour", "Corn Meal", "Emulsifier (INS 322)", "Cocoa Solids",
+    "Invert Syrup", "Raising Agent (INS 500(ii))", "Iodised Salt", "Whole Oats", "Colour (INS 150d)",
+    "Preservative (INS 211)", "Dextrose", "Maltodextrin", "Soy Lecithin", "Natural Flavours",
+]
+
+
+def product_row(number, rng):
+    """One catalog row for product `number`"""
+    brand = rng.choice(BRANDS)
+    name = f"{brand} {rng.choice(PRODUCTS)}"
+    nutritional = {
+        "Energy": f"{rng.randint(50, 600)} kcal",
+        "Protein": f"{rng.uniform(0, 25):.1f} g",
+        "Carbohydrate": f"{rng.uniform(0, 80):.1f} g",
+        "Sugar": f"{rng.uniform(0, 40):.1f} g",
+        "Total Fat": f"{rng.uniform(0, 40):.1f} g",
+        "Saturated Fat": f"{rng.uniform(0, 15):.1f} g",
+        "Sodium": f"{rng.randint(0, 1500)} mg",
+    }
+    return {
+        "product_name": name,
+        "Ingredients": ", ".join(rng.sample(INGREDIENTS, rng.randint(3, 12))),
+        "Nutritional": repr(nutritional),
+        "About": f"{name} from {brand}. " + "Made with care and packed fresh. " * rng.randint(1, 8),
+        "EAN": f"890{number:010d}",
+        "url": f"https://www.bigbasket.com/pd/{number}/",
+    }
+
+
+def generate(path, products, duplicate_rate=0.02, missing_ean_rate=0.01, seed=0):
+    """Write `products` distinct products to `path`; returns their EANs"""
+    rng = random.Random(seed)
+    eans = []
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        for number in range(1, products + 1):
+            row = product_row(number, rng)
+            eans.append(row["EAN"])
+            writer.writerow(row)
+            if rng.random() < duplicate_rate:
+                writer.writerow(dict(row, About=row["About"] + " Updated."))
+            if rng.random() < missing_ean_rate:
+                writer.writerow(dict(product_row(number, rng), EAN="Not Found"))
+    return eans
+
+
+def search_terms():
+    """Words that occur in generated product names, for search workloads"""
+    return sorted({word.replace("'s", "").lower() for name in BRANDS + PRODUCTS for word in name.split()})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic BigBasket-shaped catalog CSV")
+    parser.add_argument("path")
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--duplicate-rate", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    eans = generate(args.path, args.products, args.duplicate_rate, seed=args.seed)
+    print(f"Wrote {len(eans)} products to {args.path}")
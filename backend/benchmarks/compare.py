@@ -0,0 +1,75 @@
+"""Compare two benchmark result files and flag regressions.
+
+Metrics ending in _ms are better lower, metrics ending in _per_second
+better higher; other numbers (counts, configuration) are not compared.
+Exits with status 1 when any metric got worse by more than --threshold.
+
+    python -m benchmarks.compare results/load-abc123-....json results/load-def456-....json
+"""
+import argparse
+import sys
+
+from benchmarks.report import load_results
+
+
+def flatten(results, prefix=""):
+    """{"search": {"p95_ms": 3.1}} -> {"search.p95_ms": 3.1}"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def _direction(metric):
+    if metric.endswith("_ms"):
+        return -1
+    if metric.endswith("_per_second"):
+        return 1
+    return 0
+
+
+def compare(baseline, candidate, threshold=0.1):
+    """Rows of (metric, baseline, candidate, relative change, regressed) for comparable metrics"""
+    old, new = flatten(baseline["results"]), flatten(candidate["results"])
+    rows = []
+    for metric in sorted(old.keys() & new.keys()):
+        direction = _direction(metric)
+        if not direction or not old[metric]:
+            continue
+        change = (new[metric] - old[metric]) / old[metric]
+        rows.append((metric, old[metric], new[metric], change, direction * change < -threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression")
+    parser.add_argument("--all", action="store_true", help="Also list metrics within the threshold")
+    args = parser.parse_args()
+
+    baseline, candidate = load_results(args.baseline), load_results(args.candidate)
+    if baseline["benchmark"] != candidate["benchmark"]:
+        parser.error(f"Cannot compare a {baseline['benchmark']} run with a {candidate['benchmark']} run")
+    if baseline["config"] != candidate["config"]:
+        print("Warning: the runs used different configurations")
+    print(f"{baseline['benchmark']}: {baseline['commit']} -> {candidate['commit']}")
+
+    rows = compare(baseline, candidate, args.threshold)
+    for metric, old, new, change, regressed in rows:
+        improved = _direction(metric) * change > args.threshold
+        if args.all or regressed or improved:
+            label = "REGRESSION" if regressed else "improved" if improved else ""
+            print(f"{metric:<45} {old:>12.3f} {new:>12.3f} {change:>+8.1%}  {label}")
+    regressions = sum(row[4] for row in rows)
+    print(f"{len(rows)} metrics compared, {regressions} regressed by more than {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
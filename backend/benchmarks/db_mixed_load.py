@@ -0,0 +1,188 @@
+"""Mixed read/write load against the database layer.
+
+Runs the same workload twice against a fresh SQLite file (or DATABASE_URL
+with --url): once the way handlers used to query, with synchronous
+sessions on an engine without pragmas, and once through the async engine
+with WAL and the tuned pragmas. Reads look a product up by EAN together
+with its latest analysis, writes insert an analysis. Reports operations
+per second, latency percentiles and how long the event loop was blocked.
+
+On SQLite the synchronous layer completes more raw operations, since it
+never leaves the calling thread, but it holds the event loop for the whole
+run: no other request, LLM stream or Open Food Facts lookup makes progress
+meanwhile. The loop lag columns show that cost.
+
+    python -m benchmarks.db_mixed_load --products 5000 --concurrency 32 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.report import write_results
+from database import create_async_db_engine
+from analysis_engine import _latest_analysis_query
+import models
+from models import Base
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+
+def seed(url, products):
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add_all(
+            models.Product(name=f"Product {i}", ean=f"{i:013d}", ingredients="sugar, salt, ins 330")
+            for i in range(products)
+        )
+        db.commit()
+    engine.dispose()
+
+
+def _analysis(product_id):
+    return models.Analysis(
+        product_id=product_id, reality_check="benchmark",
+        consumption_advice="benchmark", health_implications="benchmark"
+    )
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+class SyncSessions:
+    """Synchronous sessions called from coroutines, as get_db used to hand out"""
+
+    name = "sync_session_default_pragmas"
+
+    def __init__(self, url):
+        self.engine = create_engine(url, connect_args={"check_same_thread": False})
+        self.Session = sessionmaker(bind=self.engine, autoflush=False)
+
+    async def read(self, ean):
+        with self.Session() as db:
+            product = db.scalar(select(models.Product).where(models.Product.ean == ean))
+            db.scalars(_latest_analysis_query(product.id)).first()
+
+    async def write(self, product_id):
+        with self.Session() as db:
+            db.add(_analysis(product_id))
+            db.commit()
+
+    async def close(self):
+        self.engine.dispose()
+
+
+class AsyncSessions:
+    """The API's async engine: aiosqlite/asyncpg with WAL and tuned pragmas"""
+
+    name = "async_session_wal"
+
+    def __init__(self, url):
+        self.engine = create_async_db_engine(url)
+        self.Session = async_sessionmaker(self.engine, autoflush=False, expire_on_commit=False)
+
+    async def read(self, ean):
+        async with self.Session() as db:
+            product = await db.scalar(select(models.Product).where(models.Product.ean == ean))
+            (await db.scalars(_latest_analysis_query(product.id))).first()
+
+    async def write(self, product_id):
+        async with self.Session() as db:
+            db.add(_analysis(product_id))
+            await db.commit()
+
+    async def close(self):
+        await self.engine.dispose()
+
+
+async def _loop_lag(stop, samples, interval=0.005):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def run(layer, products, concurrency, duration, write_ratio):
+    latencies = {"read": [], "write": []}
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client(seed_value):
+        nonlocal errors
+        rng = random.Random(seed_value)
+        while time.perf_counter() < deadline:
+            product_id = rng.randrange(products)
+            kind = "write" if rng.random() < write_ratio else "read"
+            start = time.perf_counter()
+            try:
+                if kind == "write":
+                    await layer.write(product_id + 1)
+                else:
+                    await layer.read(f"{product_id:013d}")
+            except Exception:
+                errors += 1
+                continue
+            latencies[kind].append(time.perf_counter() - start)
+
+    stop, lag = asyncio.Event(), []
+    ticker = asyncio.create_task(_loop_lag(stop, lag))
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    await layer.close()
+
+    everything = latencies["read"] + latencies["write"]
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        "layer": layer.name,
+        "operations": len(everything),
+        "errors": errors,
+        "ops_per_second": round(len(everything) / elapsed, 1),
+        **{
+            f"{kind}_{label}_ms": ms(_percentile(values, fraction))
+            for kind, values in (("read", latencies["read"]), ("write", latencies["write"]))
+            for label, fraction in (("p50", 0.5), ("p95", 0.95))
+        },
+        "loop_lag_mean_ms": ms(statistics.fmean(lag)) if lag else None,
+        "loop_lag_max_ms": ms(max(lag)) if lag else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sync and async database sessions under mixed load")
+    parser.add_argument("--url", help="Database to run against (default: a temporary SQLite file per layer)")
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per layer")
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/db_mixed_load-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    results = {}
+    for layer_class in (SyncSessions, AsyncSessions):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = args.url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+            if not args.url or layer_class is SyncSessions:
+                seed(url, args.products)
+            result = asyncio.run(run(layer_class(url), args.products, args.concurrency,
+                                     args.duration, args.write_ratio))
+        print(json.dumps(result))
+        results[result.pop("layer")] = result
+
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    print(f"Results written to {write_results('db_mixed_load', config, results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
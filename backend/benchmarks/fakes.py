@@ -0,0 +1,73 @@
+"""Offline stand-ins for Gemini and Open Food Facts, and the environment to use them.
+
+`offline_environment` must run before any backend module is imported, since
+database.py, vector_store.py and knowledge_index.py read their settings at
+import time.
+"""
+import os
+import random
+import time
+
+
+def offline_environment(workdir, llm_latency=0.0, database_url=None):
+    """Point the backend at a scratch database and the fake LLM"""
+    settings = {
+        "DATABASE_URL": database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_LATENCY": str(llm_latency),
+        "LLM_CACHE_PATH": os.path.join(workdir, "llm_cache.db"),
+        "KNOWLEDGE_INDEX_DIR": os.path.join(workdir, "knowledge_index"),
+        "SIMILAR_INDEX_DIR": os.path.join(workdir, "similar_index"),
+        "EMBEDDING_BACKEND": "local",
+        # No rate limits: the fakes have no quota to protect
+        "LLM_REQUESTS_PER_MINUTE": "0",
+        "LLM_TOKENS_PER_MINUTE": "0",
+    }
+    os.environ.update(settings)
+    return settings
+
+
+class FakeOpenFoodFacts:
+    """Replaces `product_resolver.fetch_remote`.
+
+    Sleeps `latency` seconds (it runs in a worker thread, like the real
+    client) and finds the product for a `hit_rate` share of EANs, decided
+    by the EAN so repeated lookups agree.
+    """
+
+    def __init__(self, latency=0.05, hit_rate=0.5):
+        self.latency = latency
+        self.hit_rate = hit_rate
+        self.calls = 0
+
+    def __call__(self, ean):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        rng = random.Random(ean)
+        if rng.random() >= self.hit_rate:
+            return {"status": 0, "status_verbose": "product not found"}
+        return {"status": 1, "product": {
+            "product_name": f"Imported product {ean[-4:]}",
+            "ingredients_text": "Sugar, Cocoa Butter, Milk Solids, Emulsifier (INS 322)",
+            "brands": "Open Food Facts",
+            "categories": "Snacks",
+            "image_url": "",
+            "nutriments": {"energy-kcal_100g": rng.randint(50, 600), "sugars_100g": rng.randint(0, 50),
+                           "proteins_100g": rng.randint(0, 20), "salt_100g": round(rng.random(), 2)},
+        }}
+
+
+def install(off_latency=0.05, off_hit_rate=0.5, llm_latency=None):
+    """Swap the live resolver's Open Food Facts client (and optionally the
+    fake LLM's latency) in an already imported backend"""
+    from llm_client import FakeBackend
+    from product_resolver import resolver
+    from vector_store import llm
+
+    off = FakeOpenFoodFacts(off_latency, off_hit_rate)
+    resolver.fetch = off
+    resolver.offline = False
+    if llm_latency is not None:
+        llm.backend = FakeBackend(latency=llm_latency)
+    return off
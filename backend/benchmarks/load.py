@@ -0,0 +1,219 @@
+"""Load driver for the product endpoints.
+
+Runs a weighted mix of GET /products/ (listing and search), GET
+/products/{ean} and POST /products/analyze from `--concurrency` clients for
+`--duration` seconds and reports p50/p95/p99 latency, requests per second
+and errors per endpoint.
+
+By default the app runs in this process against a scratch SQLite database
+seeded from a synthetic catalog, with the fake Gemini and Open Food Facts
+backends and their latencies set by the flags. The clients share the
+event loop with the app, so absolute numbers include the driver's own
+overhead; compare runs made the same way. With --url the driver targets
+a running server instead (start it with LLM_BACKEND=fake to stay offline).
+
+    python -m benchmarks.load --products 5000 --concurrency 32 --duration 20
+    python -m benchmarks.compare old.json new.json
+"""
+import argparse
+import asyncio
+import logging
+import random
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+
+from benchmarks import catalog, fakes
+from benchmarks.report import write_results
+from metrics import LatencyHistogram
+
+MIX = {"list": 0.3, "search": 0.2, "detail": 0.3, "analyze": 0.2}
+
+
+def parse_mix(value):
+    """Parse "list=3,detail=1" into endpoint weights"""
+    mix = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        endpoint, _, weight = item.partition("=")
+        if endpoint not in MIX:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint {endpoint!r}; choose from {', '.join(MIX)}")
+        mix[endpoint] = float(weight)
+    return mix
+
+
+class Workload:
+    """Builds the requests of each endpoint from the catalog's EANs.
+
+    Detail lookups ask for an EAN missing from the catalog `unknown_rate`
+    of the time, which goes through the Open Food Facts fallback. Analyses
+    draw from the first `analyze_pool` EANs, so after the first generation
+    of a product they mostly exercise the freshness check.
+    """
+
+    def __init__(self, eans, analyze_pool=200, unknown_rate=0.1):
+        self.eans = eans
+        self.analyze_eans = eans[:analyze_pool]
+        self.unknown_rate = unknown_rate
+        self.terms = catalog.search_terms()
+
+    def request(self, endpoint, rng):
+        if endpoint == "list":
+            return "GET", "/products/", {"params": {"limit": 20, "skip": rng.randrange(0, 500)}}
+        if endpoint == "search":
+            query = " ".join(rng.sample(self.terms, rng.choice((1, 2))))
+            return "GET", "/products/", {"params": {"search": query, "limit": 20}}
+        if endpoint == "detail":
+            if rng.random() < self.unknown_rate:
+                return "GET", f"/products/999{rng.randrange(10 ** 10):010d}", {}
+            return "GET", f"/products/{rng.choice(self.eans)}", {}
+        ean = rng.choice(self.analyze_eans)
+        return "POST", "/products/analyze", {"json": {"ean": ean, "name": f"Product {ean}"}}
+
+
+class EndpointStats:
+    def __init__(self):
+        # Every sample is kept: a run is bounded by --duration
+        self.latency = LatencyHistogram(window=None)
+        self.statuses = Counter()
+        self.errors = 0
+
+    def summary(self, elapsed):
+        return {
+            **self.latency.summary(),
+            "requests_per_second": round(self.latency.count / elapsed, 1) if elapsed else 0.0,
+            "errors": self.errors,
+            "statuses": {str(code): count for code, count in sorted(self.statuses.items())},
+        }
+
+
+async def drive(client, workload, mix, concurrency, duration, seed=0, record=True):
+    """Run the mix for `duration` seconds; returns per-endpoint stats and the elapsed time"""
+    stats = {endpoint: EndpointStats() for endpoint in mix}
+    endpoints, weights = list(mix), list(mix.values())
+    deadline = time.perf_counter() + duration
+
+    async def client_loop(number):
+        rng = random.Random(seed * 1000 + number)
+        while time.perf_counter() < deadline:
+            endpoint = rng.choices(endpoints, weights)[0]
+            method, path, options = workload.request(endpoint, rng)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, **options)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = None
+            if not record:
+                continue
+            entry = stats[endpoint]
+            entry.latency.observe(time.perf_counter() - started)
+            entry.statuses[status or "failed"] += 1
+            # 404s for unknown EANs are expected answers, not failures
+            if status is None or status >= 500:
+                entry.errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop(number) for number in range(concurrency)))
+    return stats, time.perf_counter() - started
+
+
+def _totals(stats, elapsed):
+    total = sum(entry.latency.count for entry in stats.values())
+    return {"requests": total, "requests_per_second": round(total / elapsed, 1) if elapsed else 0.0,
+            "errors": sum(entry.errors for entry in stats.values())}
+
+
+def seed_catalog(workdir, products):
+    """Import a synthetic catalog into the scratch database; returns its EANs"""
+    import import_data
+    path = f"{workdir}/catalog.csv"
+    eans = catalog.generate(path, products)
+    import_data.bulk_import(path, resume=False)
+    return eans
+
+
+async def discover_eans(client, pages=20):
+    """EANs of a running server's catalog, read through the listing endpoint"""
+    eans, cursor = [], None
+    for _ in range(pages):
+        response = await client.get("/products/", params={"limit": 100, **({"cursor": cursor} if cursor else {})})
+        response.raise_for_status()
+        eans.extend(product["ean"] for product in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    return eans
+
+
+async def run_in_process(args, workdir):
+    eans = seed_catalog(workdir, args.products)
+    import main
+    from analysis_engine import analyzer
+    from vector_store import llm
+    off = fakes.install(off_latency=args.off_latency, off_hit_rate=args.off_hit_rate)
+
+    workload = Workload(eans, args.analyze_pool, args.unknown_rate)
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60) as client:
+            if args.warmup:
+                await drive(client, workload, args.mix, args.concurrency, args.warmup, args.seed, record=False)
+            stats, elapsed = await drive(client, workload, args.mix, args.concurrency, args.duration, args.seed + 1)
+    server = {"llm": llm.stats(), "analysis": analyzer.stats(), "off_api_calls": off.calls}
+    return stats, elapsed, server
+
+
+async def run_remote(args):
+    async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+        workload = Workload(await discover_eans(client), args.analyze_pool, args.unknown_rate)
+        if not workload.eans:
+            raise SystemExit(f"No products found at {args.url}")
+        if args.warmup:
+            await drive(client, workload, args.mix, args.concurrency, args.warmup, args.seed, record=False)
+        stats, elapsed = await drive(client, workload, args.mix, args.concurrency, args.duration, args.seed + 1)
+    return stats, elapsed, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the product endpoints and report latency percentiles")
+    parser.add_argument("--url", help="Benchmark a running server instead of an in-process app")
+    parser.add_argument("--products", type=int, default=5000, help="Size of the synthetic catalog")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=15.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Unmeasured seconds before the run")
+    parser.add_argument("--mix", type=parse_mix, default=MIX, help='Endpoint weights, e.g. "list=3,search=1,detail=3,analyze=1"')
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds the fake Gemini takes per call")
+    parser.add_argument("--off-latency", type=float, default=0.2, help="Seconds the fake Open Food Facts API takes")
+    parser.add_argument("--off-hit-rate", type=float, default=0.5)
+    parser.add_argument("--unknown-rate", type=float, default=0.1, help="Share of detail lookups for EANs not in the catalog")
+    parser.add_argument("--analyze-pool", type=int, default=200, help="Distinct products the analyze requests draw from")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/load-<commit>-<time>.json)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.url:
+        stats, elapsed, server = asyncio.run(run_remote(args))
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            fakes.offline_environment(workdir, llm_latency=args.llm_latency)
+            stats, elapsed, server = asyncio.run(run_in_process(args, workdir))
+
+    results = {endpoint: entry.summary(elapsed) for endpoint, entry in stats.items()}
+    results["total"] = _totals(stats, elapsed)
+    for endpoint, summary in results.items():
+        if endpoint == "total":
+            continue
+        print(f"{endpoint:<8} {summary['requests_per_second']:>8.1f} req/s  p50 {summary['p50_ms']:>8.1f} ms  "
+              f"p95 {summary['p95_ms']:>8.1f} ms  p99 {summary['p99_ms']:>8.1f} ms  errors {summary['errors']}")
+    print(f"total    {results['total']['requests_per_second']:>8.1f} req/s")
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    if server:
+        results["server"] = server
+    print(f"Results written to {write_results('load', config, results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Micro-benchmarks for the data pipeline: importer, search and scraper parsing.
+
+Each benchmark runs offline against a scratch SQLite database seeded from
+the synthetic catalog, and the results go to a JSON file like the load
+driver's, so `python -m benchmarks.compare` can diff two commits.
+
+    python -m benchmarks.micro                      # every benchmark
+    python -m benchmarks.micro search parse --products 20000
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks import catalog, fakes
+from benchmarks.report import write_results
+from metrics import LatencyHistogram
+
+SCRAPER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "scraping_bigbasket")
+
+
+def _rate(count, seconds):
+    return round(count / seconds, 1) if seconds else 0.0
+
+
+def bench_import(workdir, products):
+    """Bulk CSV import, first into an empty table and then over the same rows again"""
+    import import_data
+    path = os.path.join(workdir, "import.csv")
+    catalog.generate(path, products, seed=1)
+    first = import_data.bulk_import(path, resume=False)
+    second = import_data.bulk_import(path, resume=False)
+    return {
+        "rows": first["rows_done"],
+        "insert_rows_per_second": first["rows_per_sec"],
+        "update_rows_per_second": second["rows_per_sec"],
+    }
+
+
+def bench_nutrition(workdir, products):
+    """Parsing the Nutritional column into per-100 g facts, as the ingest stage does"""
+    import import_data
+    import nutrition
+    rng = random.Random(2)
+    values = [catalog.product_row(number, rng)["Nutritional"] for number in range(products)]
+    started = time.perf_counter()
+    for value in values:
+        nutrition.parse_nutrients(import_data.parse_nutritional(value))
+    return {"rows": len(values), "rows_per_second": _rate(len(values), time.perf_counter() - started)}
+
+
+def _timed(operation, repeat):
+    histogram = LatencyHistogram(window=None)
+    for _ in range(repeat):
+        with histogram.time():
+            operation()
+    return histogram.summary()
+
+
+def bench_search(workdir, products, repeat=200):
+    """Search, listing and nutrient-filtered listing queries on the seeded catalog"""
+    import nutrition_index
+    import search_index
+    from database import SessionLocal
+
+    terms = catalog.search_terms()
+    rng = random.Random(3)
+    filters = [nutrition_index.parse_filter("sugar_g<5")]
+    order = nutrition_index.parse_sort("-protein_g")
+    with SessionLocal() as db:
+        _, deep_cursor = search_index.browse(db, 20, None, 5000 if products > 5100 else products // 2)
+        results = {
+            "search_one_term": _timed(lambda: search_index.search(db, rng.choice(terms), 20), repeat),
+            "search_two_terms": _timed(lambda: search_index.search(db, " ".join(rng.sample(terms, 2)), 20), repeat),
+            # A misspelling takes the typo-tolerant path
+            "search_typo": _timed(lambda: search_index.search(db, rng.choice(terms)[:-1] + "x", 20), repeat),
+            "browse_first_page": _timed(lambda: search_index.browse(db, 20), repeat),
+            "browse_deep_cursor": _timed(lambda: search_index.browse(db, 20, deep_cursor), repeat),
+            "browse_nutrient_filter": _timed(lambda: search_index.browse(db, 20, filters=filters), repeat),
+            "browse_nutrient_sort": _timed(lambda: search_index.browse(db, 20, sort=order), repeat),
+        }
+    return results
+
+
+def bench_parse(workdir, products, pages=300):
+    """Scraper parsers on product pages rendered from the scraper's fixtures"""
+    # Appended, so the scraper's main.py cannot shadow the backend's
+    sys.path.append(SCRAPER_DIR)
+    from fixture_server import FIXTURES, product_fields
+    from parse import parse_product, parse_product_bs4, parse_listing
+
+    with open(os.path.join(FIXTURES, "product.html"), encoding="utf-8") as f:
+        product_template = f.read()
+    with open(os.path.join(FIXTURES, "listing.html"), encoding="utf-8") as f:
+        listing_template = f.read()
+    with open(os.path.join(FIXTURES, "listing_item.html"), encoding="utf-8") as f:
+        item_template = f.read()
+    product_pages = [product_template.format(**product_fields(number)) for number in range(1, pages + 1)]
+    listing = listing_template.format(items="".join(item_template.format(**product_fields(n)) for n in range(1, 41)))
+
+    results = {}
+    for name, parser in (("selectolax", parse_product), ("bs4", parse_product_bs4)):
+        started = time.perf_counter()
+        for html in product_pages:
+            parser(html)
+        results[f"{name}_pages_per_second"] = _rate(len(product_pages), time.perf_counter() - started)
+    results["listing"] = _timed(lambda: parse_listing(listing), 200)
+    return results
+
+
+BENCHMARKS = {"import": bench_import, "nutrition": bench_nutrition, "search": bench_search, "parse": bench_parse}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the data pipeline micro-benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help=f"Any of {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--products", type=int, default=10000, help="Size of the synthetic catalog")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/micro-<commit>-<time>.json)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    names = args.benchmarks or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        fakes.offline_environment(workdir)
+        if "search" in names and "import" not in names:
+            # Search needs a catalog; the import benchmark seeds one itself
+            from benchmarks.load import seed_catalog
+            seed_catalog(workdir, args.products)
+        for name in BENCHMARKS:
+            if name in names:
+                started = time.perf_counter()
+                results[name] = BENCHMARKS[name](workdir, args.products)
+                print(f"{name:<10} {time.perf_counter() - started:>7.1f}s  {results[name]}")
+
+    config = {"benchmarks": names, "products": args.products}
+    print(f"Results written to {write_results('micro', config, results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
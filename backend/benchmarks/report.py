@@ -0,0 +1,48 @@
+"""JSON result files shared by the benchmarks.
+
+Every file records the benchmark, the commit it ran on, the machine and
+the configuration next to the results, so two files can be compared with
+`python -m benchmarks.compare`.
+"""
+import json
+import os
+import platform
+import subprocess
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def write_results(benchmark, config, results, output=None):
+    """Save results to `output`, or to results/<benchmark>-<commit>-<time>.json; returns the path"""
+    created_at = datetime.utcnow()
+    commit = git_commit()
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{benchmark}-{commit}-{created_at:%Y%m%dT%H%M%S}.json")
+    document = {
+        "benchmark": benchmark,
+        "commit": commit,
+        "created_at": created_at.isoformat(),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": config,
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(document, f, indent=2)
+    return output
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,245 @@
+import asyncio
+import os
+import re
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from sqlalchemy import select, func, and_
+
+from database import batched
+import models
+from models import product_ingredients
+from ingredients import parse_ingredients, is_additive, additive_code
+from nutrition import NUTRIENTS, parse_nutrients
+from analysis_engine import analyzer, is_fresh, AnalysisFailed
+from ingredient_clusters import canonical_products
+from vector_store import synthesize_comparison
+
+load_dotenv()
+
+# Products one comparison may include
+MAX_PRODUCTS = int(os.getenv("COMPARE_MAX_PRODUCTS", "30"))
+
+# Per-100 g nutrients a comparison weighs; -1 where less is better
+CRITERIA = (
+    ("sugar_g", -1), ("saturated_fat_g", -1), ("trans_fat_g", -1), ("sodium_mg", -1),
+    ("energy_kcal", -1), ("fiber_g", 1), ("protein_g", 1),
+)
+# Values within this fraction of the larger one are a tie
+TIE_MARGIN = 0.05
+
+_RATING = re.compile(r"health rating\D{0,20}?(\d+(?:\.\d+)?)\s*/\s*10", re.IGNORECASE)
+# Characters of each stored analysis quoted in the synthesis prompt
+EXCERPT_CHARS = 240
+
+
+def _facts(db, products):
+    """product id -> {nutrient: value per 100 g}, from the nutrition index where it has a row"""
+    facts = {}
+    ids = [product.id for product in products]
+    for batch in batched(ids):
+        rows = db.scalars(
+            select(models.NutritionFacts).where(models.NutritionFacts.product_id.in_(batch))
+        )
+        for row in rows:
+            values = {name: getattr(row, name) for name in NUTRIENTS}
+            facts[row.product_id] = {name: value for name, value in values.items() if value is not None}
+    for product in products:
+        if product.id not in facts:
+            facts[product.id] = parse_nutrients(product.nutritional_info)
+    return facts
+
+
+def _additives(db, products):
+    """product id -> additive codes in label order, from the ingredient index where it has the product"""
+    additives = {product.id: [] for product in products}
+    indexed = set()
+    ids = list(additives)
+    for batch in batched(ids):
+        rows = db.execute(
+            select(product_ingredients.c.product_id, models.Ingredient.name)
+            .join(models.Ingredient, models.Ingredient.id == product_ingredients.c.ingredient_id)
+            .where(product_ingredients.c.product_id.in_(batch))
+            .order_by(product_ingredients.c.product_id, product_ingredients.c.position)
+        ).all()
+        for product_id, term in rows:
+            indexed.add(product_id)
+            if is_additive(term):
+                additives[product_id].append(additive_code(term))
+    for product in products:
+        if product.id not in indexed:
+            additives[product.id] = [additive_code(t) for t in parse_ingredients(product.ingredients) if is_additive(t)]
+    return additives
+
+
+def load_profiles(db, eans):
+    """Products in request order with their profiles, additives and facts,
+    plus the EANs not found. A profile is the hashable tuple (ean,
+    criterion values, additive count) that rank() compares."""
+    found = {p.ean: p for p in db.scalars(select(models.Product).where(models.Product.ean.in_(eans)))}
+    products = [found[ean] for ean in eans if ean in found]
+    facts = _facts(db, products)
+    additives = _additives(db, products)
+    profiles = [
+        (product.ean, tuple(facts[product.id].get(name) for name, _ in CRITERIA), len(additives[product.id]))
+        for product in products
+    ]
+    return products, profiles, additives, facts, [ean for ean in eans if ean not in found]
+
+
+@lru_cache(maxsize=int(os.getenv("COMPARE_PAIR_CACHE_SIZE", "100000")))
+def _pair(first, second):
+    """Criteria won by each of two profiles, `first` sorting before `second`.
+
+    Profiles carry their values, so an updated product misses the cache
+    rather than reusing a stale result.
+    """
+    first_wins, second_wins = [], []
+    for (name, direction), a, b in zip(CRITERIA, first[1], second[1]):
+        if a is None or b is None or abs(a - b) <= TIE_MARGIN * max(abs(a), abs(b)):
+            continue
+        (first_wins if (a - b) * direction > 0 else second_wins).append(name)
+    if first[2] != second[2]:
+        (first_wins if first[2] < second[2] else second_wins).append("additives")
+    return tuple(first_wins), tuple(second_wins)
+
+
+def compare_pair(a, b):
+    """(criteria a wins, criteria b wins); cached in either order"""
+    if b < a:
+        b_wins, a_wins = _pair(b, a)
+        return a_wins, b_wins
+    return _pair(a, b)
+
+
+def rank(profiles):
+    """Round-robin ranking: each pair is decided by the criteria each side
+    wins, a win scores 1 and a draw 0.5. Ties keep the caller's order.
+
+    Returns [(position in `profiles`, points, criteria won over all pairs)]
+    best first. Only pairs involving a product not seen before cost any
+    work; the rest come from the pair cache.
+    """
+    points = [0.0] * len(profiles)
+    criteria_won = [0] * len(profiles)
+    for i in range(len(profiles)):
+        for j in range(i + 1, len(profiles)):
+            i_wins, j_wins = compare_pair(profiles[i], profiles[j])
+            criteria_won[i] += len(i_wins)
+            criteria_won[j] += len(j_wins)
+            if len(i_wins) == len(j_wins):
+                points[i] += 0.5
+                points[j] += 0.5
+            else:
+                points[i if len(i_wins) > len(j_wins) else j] += 1
+    order = sorted(range(len(profiles)), key=lambda i: (-points[i], -criteria_won[i], i))
+    return [(i, points[i], criteria_won[i]) for i in order]
+
+
+def _extremes(profiles):
+    """Per product, the criteria where it is the best and the worst on the shelf"""
+    best = [[] for _ in profiles]
+    worst = [[] for _ in profiles]
+    for column, (name, direction) in enumerate(CRITERIA):
+        known = [(p[1][column] * direction, i) for i, p in enumerate(profiles) if p[1][column] is not None]
+        if len(known) < 2 or min(known)[0] == max(known)[0]:
+            continue
+        top, bottom = max(known)[0], min(known)[0]
+        for value, i in known:
+            if value == top:
+                best[i].append(name)
+            elif value == bottom:
+                worst[i].append(name)
+    return best, worst
+
+
+def _latest_analyses(db, product_ids):
+    """product id -> its latest Analysis, in one query"""
+    latest = (
+        select(models.Analysis.product_id, func.max(models.Analysis.created_at).label("created_at"))
+        .where(models.Analysis.product_id.in_(product_ids))
+        .group_by(models.Analysis.product_id)
+        .subquery()
+    )
+    rows = db.scalars(select(models.Analysis).join(latest, and_(
+        models.Analysis.product_id == latest.c.product_id, models.Analysis.created_at == latest.c.created_at
+    )))
+    return {analysis.product_id: analysis for analysis in rows}
+
+
+def _health_rating(text):
+    match = _RATING.search(text or "")
+    return float(match.group(1)) if match else None
+
+
+def _summary_line(position, product, facts, additives, analysis):
+    values = ", ".join(f"{name} {facts[name]:g}" for name, _ in CRITERIA if name in facts) or "no nutrition facts"
+    line = f"{position}. {product.name}: {values}; additives: {', '.join(additives) or 'none'}"
+    if analysis is not None:
+        line += f"; analysis: {' '.join((analysis.reality_check or '').split())[:EXCERPT_CHARS]}"
+    return line
+
+
+async def compare(db, eans, synthesize=True, analyze_missing=True):
+    """Rank the products behind `eans` on their nutrition facts and additives.
+
+    Per-product analyses come from the analyses table and only products
+    without a fresh one are generated (when `analyze_missing`), so a shelf
+    costs one LLM call per new product. With `synthesize`, one short
+    prompt built from the ranked summaries explains the result; it is
+    cached per shelf like every other prompt. Near-duplicates on the shelf
+    share their canonical product's analysis. A product whose generation
+    fails keeps its stale analysis, if any, with analysis_fresh false.
+    """
+    eans = list(dict.fromkeys(eans))
+    products, profiles, additives, facts, not_found = await db.run_sync(load_profiles, eans)
+    ranking = rank(profiles)
+    best, worst = _extremes(profiles)
+
+    canonical = await db.run_sync(canonical_products, products)
+    targets = list({product.id: product for product in canonical.values()}.values())
+    analyses = await db.run_sync(_latest_analyses, [target.id for target in targets])
+    stale = {target.id for target in targets if not is_fresh(analyses.get(target.id), target)}
+    if analyze_missing and stale:
+        missing = [target for target in targets if target.id in stale]
+        generated = await asyncio.gather(
+            *(analyzer.analyze(target, target.name) for target in missing), return_exceptions=True
+        )
+        for target, analysis in zip(missing, generated):
+            if isinstance(analysis, AnalysisFailed):
+                # Keeps the stale analysis, if any, flagged as not fresh
+                continue
+            if isinstance(analysis, BaseException):
+                raise analysis
+            analyses[target.id] = analysis
+            stale.discard(target.id)
+
+    results, lines = [], []
+    for position, (i, points, criteria_won) in enumerate(ranking, 1):
+        product = products[i]
+        target = canonical[product.id]
+        analysis = analyses.get(target.id)
+        results.append({
+            "rank": position,
+            "ean": product.ean,
+            "name": product.name,
+            "brand": product.brand,
+            "points": points,
+            "criteria_won": criteria_won,
+            "best_in": best[i],
+            "worst_in": worst[i],
+            "nutrition_per_100g": facts[product.id],
+            "additives": additives[product.id],
+            "analysis_id": analysis.id if analysis is not None else None,
+            "analysis_fresh": analysis is not None and target.id not in stale,
+            "health_rating": _health_rating(analysis.reality_check) if analysis is not None else None,
+        })
+        lines.append(_summary_line(position, product, facts[product.id], additives[product.id], analysis))
+
+    summary = await synthesize_comparison(lines) if synthesize and len(products) > 1 else None
+    return {"products": results, "summary": summary, "not_found": not_found}
+
+
+def stats():
+    info = _pair.cache_info()
+    return {"pair_cache_hits": info.hits, "pair_cache_misses": info.misses, "pairs_cached": info.currsize}
@@ -1,23 +1,136 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
+import time
 from dotenv import load_dotenv
 
+from metrics import registry, record_span
+
 load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./labelinsight.db")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {}
-)
+# How long a SQLite writer waits for the lock before failing with "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_PRAGMAS = {
+    # Readers no longer block the writer, nor the writer the readers
+    "journal_mode": "WAL",
+    # Safe under WAL; fsyncs at checkpoints instead of on every commit
+    "synchronous": "NORMAL",
+    "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+    # 64 MB page cache per connection (negative values are in KiB)
+    "cache_size": -64000,
+    "temp_store": "MEMORY",
+    "mmap_size": 256 * 1024 * 1024,
+}
+
+# Async drivers for the synchronous URLs used by the CLIs
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def _is_sqlite(url):
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def _engine_options(url):
+    if _is_sqlite(url):
+        return {"connect_args": {"check_same_thread": False}}
+    # Postgres connection pool, sized per server process
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": True,
+    }
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+db_query_seconds = registry.histogram("db_query_seconds", "Duration of DB statements", ("statement",))
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info.pop("query_started")
+    # The statement's verb (SELECT, INSERT, ...) keeps the label set small
+    db_query_seconds.observe(elapsed, statement=statement.lstrip().split(None, 1)[0].upper())
+    record_span("db", elapsed)
+
+
+def _instrument(sync_engine):
+    """Time every statement into db_query_seconds and the request profile"""
+    event.listen(sync_engine, "before_cursor_execute", _before_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_execute)
+
+
+def create_db_engine(url):
+    """Synchronous engine, used by the import and maintenance CLIs"""
+    db_engine = create_engine(url, **_engine_options(url))
+    if _is_sqlite(url):
+        event.listen(db_engine, "connect", _set_sqlite_pragmas)
+    _instrument(db_engine)
+    return db_engine
+
+
+def create_async_db_engine(url):
+    """Engine for the same database through aiosqlite or asyncpg, used by the API"""
+    parsed = make_url(url)
+    driver = _ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver and parsed.drivername != driver:
+        parsed = parsed.set(drivername=driver)
+    db_engine = create_async_engine(parsed, **_engine_options(url))
+    if _is_sqlite(url):
+        event.listen(db_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    _instrument(db_engine.sync_engine)
+    return db_engine
+
+
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_db_engine(SQLALCHEMY_DATABASE_URL)
+# Objects stay usable after commit, since async code cannot lazy-load expired attributes
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
+# Values per IN (...) list: a tuple IN binds a parameter per element, and
+# even two per value stays under SQLite's default limit of 999
+IN_BATCH = 400
+
+def batched(values, size=IN_BATCH):
+    """Successive lists of at most `size` values, for chunked IN (...) queries"""
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def dialect_insert(table):
+    """INSERT for the configured dialect, which supports ON CONFLICT clauses"""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,68 @@
+import os
+import re
+import zlib
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class HashingEmbeddings:
+    """Deterministic, offline text embeddings.
+
+    Word unigrams and bigrams are hashed into a fixed number of signed
+    buckets and the vector is L2-normalised, so cosine similarity reduces to
+    a dot product. The same text always maps to the same vector on every
+    machine, which keeps index builds reproducible and tests offline.
+    Implements the `embed_documents` / `embed_query` interface of LangChain
+    embeddings so either backend can be used interchangeably.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.name = f"local-hashing-{dim}"
+
+    def _features(self, text):
+        words = re.findall(r"[^\W_]+", (text or "").casefold())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed_array(self, texts) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if digest & 0x80000000 else -1.0
+                vectors[row, digest % self.dim] += sign
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+    def embed_documents(self, texts):
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text):
+        return self.embed_array([text])[0].tolist()
+
+
+def embedding_name(embeddings) -> str:
+    return getattr(embeddings, "name", None) or getattr(embeddings, "model", type(embeddings).__name__)
+
+
+def embed_array(embeddings, texts) -> np.ndarray:
+    """Embed texts with any backend as a normalised float32 matrix"""
+    if hasattr(embeddings, "embed_array"):
+        return embeddings.embed_array(texts)
+    vectors = np.asarray(embeddings.embed_documents(list(texts)), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def create_embeddings(backend=None):
+    """Embeddings selected by EMBEDDING_BACKEND: "google" (default) or "local" """
+    backend = backend or os.getenv("EMBEDDING_BACKEND", "google")
+    if backend == "local":
+        return HashingEmbeddings(dim=int(os.getenv("LOCAL_EMBEDDING_DIM", "384")))
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(model="models/embedding-004")
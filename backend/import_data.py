@@ -1,21 +1,35 @@
 import pandas as pd
+import pyarrow.parquet as pq
+from sqlalchemy import or_, select
 from sqlalchemy.orm import Session
-from database import engine, SessionLocal
+from database import engine, SessionLocal, dialect_insert
 from models import Product, Base
+from metrics import StageReport
+import search_index
+import ingest
 import json
 import ast
+import argparse
 import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def import_data():
+DEFAULT_CSV = '../scraping_bigbasket/clean_data.csv'
+DEFAULT_CATEGORY = 'Snacks & Branded Foods'  # Default category from BigBasket scraping
+
+def import_data(csv_path=DEFAULT_CSV):
     # Create tables
     Base.metadata.create_all(bind=engine)
+    search_index.ensure_index(engine)
     
     # Read the CSV file from the scraping directory
-    df = pd.read_csv('../scraping_bigbasket/clean_data.csv')
+    df = pd.read_csv(csv_path)
     logger.info(f"Loaded {len(df)} products from CSV")
     
     # Process each row
@@ -26,27 +40,16 @@ def import_data():
             # Check if product already exists
             existing_product = db.query(Product).filter(Product.ean == row['EAN']).first()
             
-            # Parse nutritional info if it's a string
-            nutritional_info = row['Nutritional']
-            if isinstance(nutritional_info, str):
-                try:
-                    # Try to parse as JSON
-                    nutritional_info = json.loads(nutritional_info)
-                except json.JSONDecodeError:
-                    try:
-                        # Try to parse as Python literal
-                        nutritional_info = ast.literal_eval(nutritional_info)
-                    except:
-                        logger.warning(f"Could not parse nutritional info for {row['product_name']}, using empty dict")
-                        nutritional_info = {}
+            nutritional_info = stored_nutritional(parse_nutritional(row['Nutritional']))
             
             if existing_product:
                 # Update existing product
                 existing_product.name = row['product_name']
                 existing_product.ingredients = row['Ingredients']
-                existing_product.nutritional_info = json.dumps(nutritional_info)
+                existing_product.nutritional_info = nutritional_info
                 existing_product.about = row['About']
                 existing_product.category = 'Snacks & Branded Foods'
+                product = existing_product
                 logger.info(f"Updated product {row['product_name']} (EAN: {row['EAN']})")
             else:
                 # Create new product
@@ -54,13 +57,16 @@ def import_data():
                     name=row['product_name'],
                     ean=row['EAN'],
                     ingredients=row['Ingredients'],
-                    nutritional_info=json.dumps(nutritional_info),
+                    nutritional_info=nutritional_info,
                     about=row['About'],
                     category='Snacks & Branded Foods'  # Default category from BigBasket scraping
                 )
                 db.add(product)
                 logger.info(f"Added new product {row['product_name']} (EAN: {row['EAN']})")
             
+            db.flush()
+            ingest.process_products(db, [product.id])
+            
             # Commit changes for this product
             db.commit()
             
@@ -75,5 +81,279 @@ def import_data():
     
     logger.info("Import completed successfully")
 
+def parse_nutritional(value):
+    """Parse BigBasket's Nutritional column: JSON first, then a Python
+    literal. Free label text ("Energy - 512 kcal, ...") is kept as text,
+    which nutrition.parse_nutrients reads."""
+    if not isinstance(value, str):
+        return {}
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            return value.strip()
+
+
+def stored_nutritional(info):
+    """nutritional_info column value: parsed structures as JSON, label text as is"""
+    return info if isinstance(info, str) else json.dumps(info)
+
+
+def _clean(value):
+    return None if pd.isna(value) else value
+
+
+def _valid_ean(value):
+    return isinstance(value, str) and value.strip().isdigit()
+
+
+class ImportCheckpoint:
+    """Progress file that lets an interrupted bulk import resume after its last committed chunk"""
+
+    def __init__(self, csv_path):
+        self.path = csv_path + '.import-checkpoint.json'
+        stat = os.stat(csv_path)
+        self.source = {"path": os.path.abspath(csv_path), "size": stat.st_size, "mtime": stat.st_mtime}
+        self.state = {"chunks_done": 0, "rows_done": 0, "inserted": 0, "updated": 0, "rejected": 0}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            saved = json.load(f)
+        # A checkpoint only applies to the exact file it was written for
+        if saved.get("source") == self.source:
+            self.state = saved["state"]
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({"source": self.source, "state": self.state}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# Columns an import writes; updated_at only moves when one of them changes
+UPSERT_COLUMNS = ('name', 'ingredients', 'nutritional_info', 'about', 'category')
+
+
+def _upsert_statement():
+    stmt = dialect_insert(Product.__table__)
+    table = Product.__table__
+    return stmt.on_conflict_do_update(
+        index_elements=['ean'],
+        set_={column: stmt.excluded[column] for column in UPSERT_COLUMNS + ('updated_at',)},
+        # Unchanged rows are left alone, so re-importing a file does not
+        # make every stored analysis look older than its product
+        where=or_(*(table.c[column].is_distinct_from(stmt.excluded[column]) for column in UPSERT_COLUMNS))
+    )
+
+
+def _import_chunk(db, chunk, executor):
+    """Validate, parse and upsert one CSV chunk. Returns (inserted, updated,
+    rejected); rows identical to the stored product count as neither."""
+    chunk = chunk.astype(object)
+    chunk['EAN'] = chunk['EAN'].map(lambda ean: str(ean).strip() if not pd.isna(ean) else None)
+    valid = chunk['EAN'].map(_valid_ean)
+    rejected = int((~valid).sum())
+    chunk = chunk[valid]
+    # Later rows win when the same EAN appears twice in a chunk
+    duplicates = chunk.duplicated('EAN', keep='last')
+    rejected += int(duplicates.sum())
+    chunk = chunk[~duplicates]
+    if chunk.empty:
+        return 0, 0, rejected
+
+    nutritional = executor.map(parse_nutritional, chunk['Nutritional'].tolist(), chunksize=256)
+    now = datetime.utcnow()
+    rows = [
+        {
+            'name': _clean(name),
+            'ean': ean,
+            'ingredients': _clean(ingredients),
+            'nutritional_info': stored_nutritional(info),
+            'about': _clean(about),
+            'category': DEFAULT_CATEGORY,
+            'created_at': now,
+            'updated_at': now,
+        }
+        for name, ean, ingredients, about, info in zip(
+            chunk['product_name'], chunk['EAN'], chunk['Ingredients'], chunk['About'], nutritional
+        )
+    ]
+
+    eans = [row['ean'] for row in rows]
+    table = Product.__table__
+    existing = {
+        stored.ean: tuple(stored[1:])
+        for stored in db.execute(
+            select(table.c.ean, *(table.c[column] for column in UPSERT_COLUMNS)).where(table.c.ean.in_(eans))
+        )
+    }
+    # The same comparison as the statement's WHERE: new rows and rows with a changed column
+    written = [
+        row['ean'] for row in rows
+        if existing.get(row['ean']) != tuple(row[column] for column in UPSERT_COLUMNS)
+    ]
+    db.execute(_upsert_statement(), rows)
+    product_ids = db.execute(select(Product.id).where(Product.ean.in_(written))).scalars().all()
+    ingest.process_products(db, product_ids)
+    inserted = len(rows) - len(existing)
+    return inserted, len(written) - inserted, rejected
+
+
+def bulk_import(csv_path=DEFAULT_CSV, chunksize=2000, workers=None, resume=True):
+    """Stream a BigBasket CSV into the products table.
+
+    Each chunk is upserted with a single INSERT ... ON CONFLICT(ean) statement
+    and run through the ingest stages in its own transaction, and the chunk
+    count is checkpointed after every commit so a failed run resumes where
+    it stopped.
+    """
+    Base.metadata.create_all(bind=engine)
+    search_index.ensure_index(engine)
+
+    checkpoint = ImportCheckpoint(csv_path)
+    if resume:
+        checkpoint.load()
+    state = checkpoint.state
+    if state["rows_done"]:
+        logger.info(f"Resuming after {state['rows_done']} rows ({state['chunks_done']} chunks)")
+
+    started = time.perf_counter()
+    rows_this_run = 0
+    skip = state["rows_done"]
+    reader = pd.read_csv(csv_path, chunksize=chunksize, dtype={'EAN': str})
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk in reader:
+            # Skip what a previous run already committed; counted in records
+            # rather than lines so quoted multi-line fields cannot shift it
+            if skip >= len(chunk):
+                skip -= len(chunk)
+                continue
+            if skip:
+                chunk = chunk.iloc[skip:]
+                skip = 0
+            with SessionLocal() as db, db.begin():
+                inserted, updated, rejected = _import_chunk(db, chunk, executor)
+            state["chunks_done"] += 1
+            state["rows_done"] += len(chunk)
+            state["inserted"] += inserted
+            state["updated"] += updated
+            state["rejected"] += rejected
+            checkpoint.save()
+
+            rows_this_run += len(chunk)
+            elapsed = time.perf_counter() - started
+            logger.info(
+                f"Chunk {state['chunks_done']}: {state['rows_done']} rows, "
+                f"{rows_this_run / elapsed:.0f} rows/sec, inserted {state['inserted']}, "
+                f"updated {state['updated']}, rejected {state['rejected']}"
+            )
+
+    elapsed = time.perf_counter() - started
+    report = dict(state, seconds=round(elapsed, 2), rows_per_sec=round(rows_this_run / elapsed, 1) if elapsed else 0.0)
+    checkpoint.clear()
+    logger.info(f"Bulk import completed: {report}")
+    return report
+
+
+def snapshot_file(path, version=None):
+    """A snapshot file; for a snapshot directory, the given or latest version in its manifest"""
+    if not os.path.isdir(path):
+        return path
+    with open(os.path.join(path, 'manifest.json')) as f:
+        versions = json.load(f)["versions"]
+    if not versions:
+        raise FileNotFoundError(f"No snapshots in {path}")
+    entry = versions[-1] if version is None else next(v for v in versions if v["version"] == version)
+    return os.path.join(path, entry["file"])
+
+
+def snapshot_changes(old_path, new_path):
+    """EANs added or changed in the new snapshot, and EANs it no longer has.
+
+    Only the EAN and row_hash columns of either file are read.
+    """
+    old = pq.read_table(old_path, columns=['EAN', 'row_hash']).to_pandas()
+    new = pq.read_table(new_path, columns=['EAN', 'row_hash']).to_pandas()
+    merged = new.merge(old, on='EAN', how='left', suffixes=('', '_old'))
+    changed = merged.loc[merged['row_hash_old'].isna() | (merged['row_hash'] != merged['row_hash_old']), 'EAN']
+    removed = old.loc[~old['EAN'].isin(new['EAN']), 'EAN']
+    return set(changed), set(removed)
+
+
+def import_snapshot(path, since=None, chunksize=2000, workers=None):
+    """Load a cleaned catalog snapshot (see scraping_bigbasket/clean_data.py).
+
+    With `since`, an older snapshot, only rows added or changed after it are
+    upserted. Products missing from the newer snapshot are reported but
+    kept, since analyses and favorites may refer to them. Logs wall time
+    and peak memory per stage.
+    """
+    report = StageReport()
+    Base.metadata.create_all(bind=engine)
+    search_index.ensure_index(engine)
+
+    only = None
+    if since is not None:
+        with report.stage('diff'):
+            only, removed = snapshot_changes(since, path)
+        logger.info(f"{len(only)} products added or changed since {since}; {len(removed)} no longer listed")
+
+    totals = {"rows": 0, "inserted": 0, "updated": 0, "rejected": 0}
+    started = time.perf_counter()
+    batches = pq.ParquetFile(path).iter_batches(
+        batch_size=chunksize, columns=['EAN', 'product_name', 'Ingredients', 'Nutritional', 'About']
+    )
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            with report.stage('load'):
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                chunk = batch.to_pandas()
+                if only is not None:
+                    chunk = chunk[chunk['EAN'].isin(only)]
+            if chunk.empty:
+                continue
+            with report.stage('upsert'), SessionLocal() as db, db.begin():
+                inserted, updated, rejected = _import_chunk(db, chunk, executor)
+            totals["rows"] += len(chunk)
+            totals["inserted"] += inserted
+            totals["updated"] += updated
+            totals["rejected"] += rejected
+
+    elapsed = time.perf_counter() - started
+    summary = report.summary()
+    for name, stage in summary["stages"].items():
+        logger.info(f"Stage {name}: {stage['seconds']}s, peak {stage['peak_mb']} MB over {stage['calls']} calls")
+    logger.info(f"Snapshot import completed: {totals}, {elapsed:.2f}s, max RSS {summary['max_rss_mb']} MB")
+    return dict(totals, seconds=round(elapsed, 2), **summary)
+
+
 if __name__ == "__main__":
-    import_data() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Import the BigBasket catalog into the products table")
+    parser.add_argument("csv_path", nargs="?", default=DEFAULT_CSV)
+    parser.add_argument("--bulk", action="store_true", help="Chunked, batched upsert instead of one session per row")
+    parser.add_argument("--chunksize", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=None, help="Processes used to parse the Nutritional column")
+    parser.add_argument("--restart", action="store_true", help="Ignore any checkpoint and import from the first row")
+    parser.add_argument("--snapshot", help="Parquet snapshot, or snapshot directory for its latest version, to import instead of a CSV")
+    parser.add_argument("--since", help="Older snapshot (file, or version number within --snapshot's directory); import only what changed after it")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        since = None
+        if args.since:
+            since = snapshot_file(args.snapshot, int(args.since)) if args.since.isdigit() else snapshot_file(args.since)
+        import_snapshot(snapshot_file(args.snapshot), since, args.chunksize, args.workers)
+    elif args.bulk:
+        bulk_import(args.csv_path, args.chunksize, args.workers, resume=not args.restart)
+    else:
+        import_data(args.csv_path)
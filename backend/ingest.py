@@ -0,0 +1,64 @@
+import argparse
+import logging
+
+from sqlalchemy import select
+
+from database import SessionLocal, engine
+import models
+import ingredient_index
+import nutrition_index
+import ingredient_clusters
+import similar_products
+
+logger = logging.getLogger(__name__)
+
+# Derived-data stages run whenever products are inserted or updated, by the
+# CSV importers and by Open Food Facts inserts. Each stage is called as
+# stage(db, product_ids) inside the transaction that wrote the products.
+STAGES = [
+    ingredient_index.index_products,
+    nutrition_index.index_products,
+    ingredient_clusters.index_products,
+    similar_products.index_products,
+]
+
+
+def process_products(db, product_ids):
+    """Run every ingest stage for the given products; the caller commits"""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    for stage in STAGES:
+        stage(db, product_ids)
+
+
+def backfill(batch_size=2000):
+    """Run the ingest stages over the whole catalog, one transaction per batch"""
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        last_id, done = 0, 0
+        while True:
+            ids = db.execute(
+                select(models.Product.id).where(models.Product.id > last_id)
+                .order_by(models.Product.id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            process_products(db, ids)
+            db.commit()
+            last_id = ids[-1]
+            done += len(ids)
+            logger.info(f"Backfilled {done} products")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Derived product data: ingredient index, nutrition facts, near-duplicate clusters, product embeddings and other ingest stages")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--batch-size", type=int, default=2000)
+    args = parser.parse_args()
+
+    backfill(args.batch_size)
@@ -0,0 +1,259 @@
+import argparse
+import hashlib
+import logging
+import os
+import zlib
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, select, tuple_
+
+from database import SessionLocal, batched, engine
+import models
+from models import product_lsh_buckets
+from ingredients import parse_ingredients
+from metrics import registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 20 bands of 5 rows: pairs above ~0.55 Jaccard similarity usually share a
+# bucket, and a pair at 0.8 is missed about once in 2,500
+NUM_PERM = 100
+BANDS = 20
+ROWS = NUM_PERM // BANDS
+# Estimated Jaccard similarity of ingredient sets at which two products are variants
+CLUSTER_THRESHOLD = float(os.getenv("CLUSTER_THRESHOLD", "0.8"))
+# Shorter lists ("Salt", "100% Honey") say too little to call two products the same
+MIN_TERMS = 3
+
+_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.default_rng(20240611)
+# Random hash functions h(x) = (a * x + b) mod p; fixed, since signatures are stored
+_A = _rng.integers(1, 1 << 32, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 32, NUM_PERM, dtype=np.uint64)
+
+cluster_reuses = registry.counter(
+    "analysis_cluster_reuses_total", "Analyses served from a near-duplicate's canonical product")
+
+
+def signature(terms):
+    """MinHash signature of a set of ingredient terms, as uint32 values"""
+    hashes = np.array([zlib.crc32(term.encode("utf-8")) for term in set(terms)], dtype=np.uint64)
+    permuted = ((_A[:, None] * hashes[None, :]) % _PRIME + _B[:, None]) % _PRIME
+    return (permuted.min(axis=1) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+
+def buckets(sig):
+    """(band, bucket) keys of a signature; buckets are signed 64-bit for the BigInteger column"""
+    return [
+        (band, int.from_bytes(hashlib.blake2b(sig[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8).digest(),
+                              "little", signed=True))
+        for band in range(BANDS)
+    ]
+
+
+def similarity(sig, other):
+    """Estimated Jaccard similarity: the share of equal MinHash values"""
+    return float(np.mean(sig == other))
+
+
+def _same_brand(a, b):
+    # Identical recipes from different brands stay apart; BigBasket rows carry no brand
+    return not a or not b or " ".join(a.casefold().split()) == " ".join(b.casefold().split())
+
+
+def index_products(db, product_ids):
+    """Fingerprint the products and place each in a near-duplicate cluster.
+
+    Runs inside the caller's transaction. A product joins the cluster of
+    its most similar candidate above CLUSTER_THRESHOLD, or leads a new one.
+    Cluster leaders keep leading, so members never point at a product that
+    moved; members a changed leader no longer resembles are re-clustered.
+    """
+    product_ids = list(dict.fromkeys(product_ids))
+    fingerprints = models.ProductFingerprint.__table__
+    products = {}
+    for batch in batched(product_ids):
+        products.update((row.id, row) for row in db.execute(
+            select(models.Product.id, models.Product.ingredients, models.Product.brand)
+            .where(models.Product.id.in_(batch))
+        ))
+
+    # Leaders among these products, who keep their cluster whatever their new fingerprint
+    leaders = set()
+    for batch in batched(product_ids):
+        leaders.update(db.execute(
+            select(fingerprints.c.cluster_id)
+            .where(fingerprints.c.cluster_id.in_(batch), fingerprints.c.product_id.notin_(batch))
+            .distinct()
+        ).scalars())
+        db.execute(product_lsh_buckets.delete().where(product_lsh_buckets.c.product_id.in_(batch)))
+        db.execute(fingerprints.delete().where(fingerprints.c.product_id.in_(batch)))
+
+    signatures = {}
+    for product_id in sorted(products):
+        terms = parse_ingredients(products[product_id].ingredients)
+        if len(terms) >= MIN_TERMS:
+            signatures[product_id] = signature(terms)
+    keys = {product_id: buckets(sig) for product_id, sig in signatures.items()}
+
+    # Only canonical products are bucketed, so every candidate is a cluster
+    # leader and a product joins a cluster only if it resembles the product
+    # whose analysis it will share
+    candidates_by_bucket = {}
+    all_keys = list({key for product_keys in keys.values() for key in product_keys})
+    for batch in batched(all_keys):
+        for band, bucket, candidate in db.execute(
+            select(product_lsh_buckets.c.band, product_lsh_buckets.c.bucket, product_lsh_buckets.c.product_id)
+            .where(tuple_(product_lsh_buckets.c.band, product_lsh_buckets.c.bucket).in_(batch))
+        ):
+            candidates_by_bucket.setdefault((band, bucket), set()).add(candidate)
+    known = {}
+    candidate_ids = set().union(*candidates_by_bucket.values()) if candidates_by_bucket else set()
+    for batch in batched(candidate_ids):
+        for product_id, sig, brand in db.execute(
+            select(fingerprints.c.product_id, fingerprints.c.signature, models.Product.brand)
+            .join(models.Product, models.Product.id == fingerprints.c.product_id)
+            .where(fingerprints.c.product_id.in_(batch))
+        ):
+            known[product_id] = (np.frombuffer(sig, dtype=np.uint32), brand)
+
+    # In id order, so the oldest product of a new cluster becomes its canonical one
+    rows, bucket_rows = [], []
+    for product_id in sorted(signatures):
+        sig, brand = signatures[product_id], products[product_id].brand
+        cluster_id = product_id
+        if product_id not in leaders:
+            candidates = set().union(*(candidates_by_bucket.get(key, ()) for key in keys[product_id]))
+            best = max(
+                ((similarity(sig, known[c][0]), -c) for c in candidates
+                 if c in known and _same_brand(brand, known[c][1])),
+                default=(0.0, 0)
+            )
+            if best[0] >= CLUSTER_THRESHOLD:
+                cluster_id = -best[1]
+        rows.append({"product_id": product_id, "signature": sig.tobytes(), "cluster_id": cluster_id})
+        if cluster_id == product_id:
+            bucket_rows.extend({"band": band, "bucket": bucket, "product_id": product_id}
+                               for band, bucket in keys[product_id])
+            # Later products in this batch can join this one
+            known[product_id] = (sig, brand)
+            for key in keys[product_id]:
+                candidates_by_bucket.setdefault(key, set()).add(product_id)
+    if rows:
+        db.execute(fingerprints.insert(), rows)
+    if bucket_rows:
+        db.execute(product_lsh_buckets.insert(), bucket_rows)
+
+    # Members whose leader changed beyond recognition, or lost its fingerprint
+    orphans = []
+    for batch in batched(leaders):
+        for member_id, member_sig, leader_id in db.execute(
+            select(fingerprints.c.product_id, fingerprints.c.signature, fingerprints.c.cluster_id)
+            .where(fingerprints.c.cluster_id.in_(batch), fingerprints.c.product_id != fingerprints.c.cluster_id)
+        ):
+            leader_sig = signatures.get(leader_id)
+            if leader_sig is None or similarity(leader_sig, np.frombuffer(member_sig, dtype=np.uint32)) < CLUSTER_THRESHOLD:
+                orphans.append(member_id)
+    if orphans:
+        index_products(db, orphans)
+
+
+def canonical_products(db, products):
+    """product id -> the product whose analysis it shares: its cluster's
+    canonical product, or itself when it has no near-duplicates"""
+    canonical = {product.id: product for product in products}
+    clusters = {}
+    for batch in batched(canonical):
+        clusters.update(db.execute(
+            select(models.ProductFingerprint.product_id, models.ProductFingerprint.cluster_id)
+            .where(models.ProductFingerprint.product_id.in_(batch),
+                   models.ProductFingerprint.cluster_id != models.ProductFingerprint.product_id)
+        ).all())
+    for product_id, cluster_id in clusters.items():
+        canonical[product_id] = db.get(models.Product, cluster_id)
+    return canonical
+
+
+def canonical_product(db, product):
+    return canonical_products(db, [product])[product.id]
+
+
+def record_reuse(product, canonical):
+    """Count an analysis served to `product` from its canonical product"""
+    if canonical.id != product.id:
+        cluster_reuses.inc()
+
+
+def cluster_stats(db, top=10):
+    """Cluster counts and the analyses they save across the catalog"""
+    fingerprints = models.ProductFingerprint
+    sizes = (
+        select(fingerprints.cluster_id, func.count().label("size"))
+        .group_by(fingerprints.cluster_id)
+        .having(func.count() > 1)
+        .subquery()
+    )
+    clusters, clustered = db.execute(select(func.count(), func.coalesce(func.sum(sizes.c.size), 0))).one()
+    largest = db.execute(
+        select(models.Product.ean, models.Product.name, sizes.c.size)
+        .join(models.Product, models.Product.id == sizes.c.cluster_id)
+        .order_by(sizes.c.size.desc(), sizes.c.cluster_id)
+        .limit(top)
+    ).all()
+    products = db.scalar(select(func.count(models.Product.id)))
+    return {
+        "products": products,
+        "fingerprinted": db.scalar(select(func.count(fingerprints.product_id))),
+        "clusters": clusters,
+        "clustered_products": clustered,
+        # Every member but the canonical product reuses its analysis instead of getting its own
+        "analyses_saved": clustered - clusters,
+        "analyses_needed": products - (clustered - clusters),
+        "analyses_reused_since_start": int(cluster_reuses.values.get((), 0)),
+        "threshold": CLUSTER_THRESHOLD,
+        "largest": [{"canonical_ean": ean, "canonical_name": name, "size": size} for ean, name, size in largest],
+    }
+
+
+def rebuild(batch_size=2000):
+    """Recluster the whole catalog from scratch, one transaction per batch"""
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        db.execute(delete(product_lsh_buckets))
+        db.execute(delete(models.ProductFingerprint))
+        db.commit()
+        last_id, done = 0, 0
+        while True:
+            ids = db.execute(
+                select(models.Product.id).where(models.Product.id > last_id)
+                .order_by(models.Product.id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            index_products(db, ids)
+            db.commit()
+            last_id = ids[-1]
+            done += len(ids)
+            logger.info(f"Fingerprinted {done} products")
+        return cluster_stats(db)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Near-duplicate product clusters from MinHash ingredient fingerprints")
+    parser.add_argument("command", choices=["rebuild", "stats"])
+    parser.add_argument("--batch-size", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        print(rebuild(args.batch_size))
+    else:
+        models.Base.metadata.create_all(bind=engine)
+        with SessionLocal() as db:
+            print(cluster_stats(db))
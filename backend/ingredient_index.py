@@ -0,0 +1,146 @@
+from collections import Counter
+
+from sqlalchemy import select, exists, and_, bindparam
+
+from database import batched, dialect_insert
+import models
+from models import product_ingredients
+from ingredients import parse_ingredients, normalize_term, is_additive, additive_code
+
+
+def _ingredient_ids(db, names):
+    """{name: id} for every name, creating the ingredients that are new"""
+    ids = {}
+    for batch in batched(names):
+        ids.update(db.execute(
+            select(models.Ingredient.name, models.Ingredient.id).where(models.Ingredient.name.in_(batch))
+        ).all())
+    missing = [name for name in names if name not in ids]
+    if missing:
+        stmt = dialect_insert(models.Ingredient.__table__).on_conflict_do_nothing(index_elements=['name'])
+        db.execute(stmt, [{"name": name, "is_additive": is_additive(name), "product_count": 0} for name in missing])
+        for batch in batched(missing):
+            ids.update(db.execute(
+                select(models.Ingredient.name, models.Ingredient.id).where(models.Ingredient.name.in_(batch))
+            ).all())
+    return ids
+
+
+def index_products(db, product_ids):
+    """Re-parse the products' ingredient text into the inverted index.
+
+    Runs inside the caller's transaction. Per-ingredient product counts are
+    adjusted by the difference between the old and new rows, so additive
+    frequencies never need a full aggregation.
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    parsed = {}
+    for batch in batched(product_ids):
+        for product_id, text in db.execute(
+            select(models.Product.id, models.Product.ingredients).where(models.Product.id.in_(batch))
+        ):
+            parsed[product_id] = parse_ingredients(text)
+
+    ids = _ingredient_ids(db, {term for terms in parsed.values() for term in terms})
+    delta = Counter()
+    for batch in batched(product_ids):
+        old = db.execute(
+            select(product_ingredients.c.ingredient_id).where(product_ingredients.c.product_id.in_(batch))
+        ).scalars().all()
+        delta.subtract(old)
+        db.execute(product_ingredients.delete().where(product_ingredients.c.product_id.in_(batch)))
+
+    rows = [
+        {"product_id": product_id, "ingredient_id": ids[term], "position": position}
+        for product_id, terms in parsed.items()
+        for position, term in enumerate(terms)
+    ]
+    if rows:
+        db.execute(product_ingredients.insert(), rows)
+    delta.update(row["ingredient_id"] for row in rows)
+
+    changes = [{"ingredient_id": i, "change": change} for i, change in delta.items() if change]
+    if changes:
+        db.execute(
+            models.Ingredient.__table__.update()
+            .where(models.Ingredient.id == bindparam("ingredient_id"))
+            .values(product_count=models.Ingredient.product_count + bindparam("change")),
+            changes
+        )
+
+
+def _resolve_terms(db, terms):
+    """(id, product_count) rows for the known terms, and how many distinct terms were asked for"""
+    names = {normalize_term(term) for term in terms if term}
+    names.discard("")
+    if not names:
+        return [], 0
+    rows = db.execute(
+        select(models.Ingredient.id, models.Ingredient.product_count).where(models.Ingredient.name.in_(names))
+    ).all()
+    return rows, len(names)
+
+
+def products_matching(db, contains=(), excludes=(), limit=20, after_id=0):
+    """Products listing every ingredient in `contains` and none in `excludes`.
+
+    The scan is driven by the rarest required ingredient through the
+    (ingredient_id, product_id) index and walks product ids in order, so it
+    stops as soon as a page is full. Returns (products, last product id).
+    """
+    found, wanted = _resolve_terms(db, contains)
+    if len(found) < wanted:
+        # An ingredient nobody lists cannot be contained
+        return [], None
+    required = [ingredient_id for ingredient_id, _ in sorted(found, key=lambda row: row[1])]
+    excluded = [ingredient_id for ingredient_id, _ in _resolve_terms(db, excludes)[0]]
+
+    if required:
+        driver = product_ingredients.alias("driver")
+        product_id = driver.c.product_id
+        query = select(product_id).where(driver.c.ingredient_id == required[0])
+    else:
+        product_id = models.Product.id
+        query = select(product_id)
+    query = query.where(product_id > after_id)
+
+    for ingredient_id in required[1:]:
+        other = product_ingredients.alias()
+        query = query.where(exists().where(and_(
+            other.c.product_id == product_id, other.c.ingredient_id == ingredient_id
+        )))
+    if excluded:
+        other = product_ingredients.alias()
+        query = query.where(~exists().where(and_(
+            other.c.product_id == product_id, other.c.ingredient_id.in_(excluded)
+        )))
+
+    ids = db.execute(query.order_by(product_id).limit(limit)).scalars().all()
+    if not ids:
+        return [], None
+    products = {p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(ids))}
+    return [products[i] for i in ids if i in products], (ids[-1] if ids and len(ids) == limit else None)
+
+
+def additive_frequency(db, limit=50):
+    """Most common additives across the catalog, from the maintained counts"""
+    rows = db.execute(
+        select(models.Ingredient.name, models.Ingredient.product_count)
+        .where(models.Ingredient.is_additive, models.Ingredient.product_count > 0)
+        .order_by(models.Ingredient.product_count.desc())
+        .limit(limit)
+    ).all()
+    return [{"code": additive_code(name), "products": count} for name, count in rows]
+
+
+def product_additives(db, product_id):
+    """Additive codes listed on one product, in label order"""
+    rows = db.execute(
+        select(models.Ingredient.name)
+        .join(product_ingredients, product_ingredients.c.ingredient_id == models.Ingredient.id)
+        .where(product_ingredients.c.product_id == product_id, models.Ingredient.is_additive)
+        .order_by(product_ingredients.c.position)
+    ).scalars().all()
+    return [additive_code(name) for name in rows]
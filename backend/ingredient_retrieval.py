@@ -0,0 +1,181 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from ingredients import parse_ingredients
+from knowledge_index import knowledge
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Passages retrieved per ingredient term
+PASSAGES_PER_TERM = 3
+# Ingredient terms considered per product; labels rarely list more
+MAX_TERMS = 30
+MAX_CONTEXT_PASSAGES = 6
+MAX_PASSAGE_CHARS = 600
+
+
+class IngredientRetriever:
+    """Regulation passages retrieved per ingredient term instead of per product.
+
+    Products share most of their ingredients, so passages are cached per
+    normalized term: in a bounded in-memory LRU, backed by a SQLite table
+    that survives restarts and can be filled ahead of time for the whole
+    catalog vocabulary. Cached entries are tied to the knowledge index
+    version and are refreshed after the index is rebuilt.
+    """
+
+    def __init__(self, index, max_terms=5000, k=PASSAGES_PER_TERM):
+        self.index = index
+        self.max_terms = max_terms
+        self.k = k
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._store = None
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.retrieved = 0
+        self.evictions = 0
+
+    def _open_store(self):
+        if self._store is None:
+            os.makedirs(self.index.path, exist_ok=True)
+            self._store = sqlite3.connect(
+                os.path.join(self.index.path, "term_passages.sqlite"), check_same_thread=False
+            )
+            self._store.execute(
+                "CREATE TABLE IF NOT EXISTS term_passages ("
+                " term TEXT PRIMARY KEY, index_version TEXT, passages TEXT NOT NULL)"
+            )
+        return self._store
+
+    def _remember(self, term, passages):
+        self._memory[term] = passages
+        self._memory.move_to_end(term)
+        while len(self._memory) > self.max_terms:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def passages_for_terms(self, terms):
+        """{term: [(score, source, page, text), ...]} for every term"""
+        if not self.index.loaded:
+            return {term: [] for term in terms}
+        version = self.index.version
+        found, missing = {}, []
+        with self._lock:
+            for term in terms:
+                if term in self._memory:
+                    self._memory.move_to_end(term)
+                    found[term] = self._memory[term]
+                    self.memory_hits += 1
+                else:
+                    missing.append(term)
+
+            store = self._open_store()
+            still_missing = []
+            for term in missing:
+                row = store.execute(
+                    "SELECT passages FROM term_passages WHERE term = ? AND index_version IS ?",
+                    (term, version)
+                ).fetchone()
+                if row:
+                    passages = [tuple(p) for p in json.loads(row[0])]
+                    found[term] = passages
+                    self._remember(term, passages)
+                    self.store_hits += 1
+                else:
+                    still_missing.append(term)
+
+        if still_missing:
+            retrieved = self.index.search_many(still_missing, self.k)
+            with self._lock:
+                store = self._open_store()
+                for term, passages in zip(still_missing, retrieved):
+                    found[term] = passages
+                    self._remember(term, passages)
+                    store.execute(
+                        "INSERT OR REPLACE INTO term_passages VALUES (?, ?, ?)",
+                        (term, version, json.dumps(passages))
+                    )
+                store.commit()
+                self.retrieved += len(still_missing)
+        return found
+
+    def context_for(self, ingredients_text) -> str:
+        """Regulatory context for a product, assembled from per-term passages"""
+        terms = parse_ingredients(ingredients_text)[:MAX_TERMS]
+        if not terms or not self.index.loaded:
+            return ""
+        by_term = self.passages_for_terms(terms)
+        ranked = sorted(
+            (passage for passages in by_term.values() for passage in passages),
+            key=lambda passage: passage[0], reverse=True
+        )
+        lines, seen = [], set()
+        for score, source, page, text in ranked:
+            if text in seen:
+                continue
+            seen.add(text)
+            where = f"{source}, p. {page}" if page else source
+            lines.append(f"- ({where}) {' '.join(text.split())[:MAX_PASSAGE_CHARS]}")
+            if len(lines) >= MAX_CONTEXT_PASSAGES:
+                break
+        return "\n".join(lines)
+
+    def precompute(self, vocabulary, batch_size=256):
+        """Retrieve and persist passages for every term in `vocabulary`"""
+        vocabulary = sorted(vocabulary)
+        for start in range(0, len(vocabulary), batch_size):
+            self.passages_for_terms(vocabulary[start:start + batch_size])
+            logger.info(f"Precomputed {min(start + batch_size, len(vocabulary))}/{len(vocabulary)} terms")
+
+    def stats(self):
+        lookups = self.memory_hits + self.store_hits + self.retrieved
+        return {
+            "cached_terms": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "store_hits": self.store_hits,
+            "retrieved": self.retrieved,
+            "hit_rate": (self.memory_hits + self.store_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+retriever = IngredientRetriever(knowledge, max_terms=int(os.getenv("RETRIEVAL_CACHE_TERMS", "5000")))
+
+
+def catalog_vocabulary():
+    """Every normalized ingredient term used in the products table"""
+    from database import SessionLocal
+    import models
+
+    db = SessionLocal()
+    try:
+        vocabulary = set()
+        rows = db.query(models.Product.ingredients).execution_options(yield_per=1000)
+        for (ingredients,) in rows:
+            vocabulary.update(parse_ingredients(ingredients)[:MAX_TERMS])
+        return vocabulary
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Ingredient-level regulation retrieval")
+    parser.add_argument("command", choices=["precompute"])
+    args = parser.parse_args()
+
+    if not knowledge.load():
+        raise SystemExit("Knowledge index not built yet; run `python knowledge_index.py update` first")
+    vocabulary = catalog_vocabulary()
+    logger.info(f"Catalog vocabulary: {len(vocabulary)} terms")
+    retriever.precompute(vocabulary)
@@ -0,0 +1,91 @@
+import re
+
+# "Ingredients:", "Contains:" and similar label prefixes
+_PREFIX = re.compile(r"^\s*(ingredients?|contains?|made from)\s*[:\-]\s*", re.IGNORECASE)
+# Percentages and quantities such as "(12%)", "12.5 %", "2g"
+_QUANTITY = re.compile(r"\(?\s*\d+(?:[.,]\d+)?\s*(?:%|(?:g|mg|ml)\b)\s*\)?", re.IGNORECASE)
+_SEPARATORS = ",;"
+# Sub-numbered INS codes such as "503(ii)", which must not be read as a bracketed list
+_SUBNUMBERED_CODE = re.compile(r"(\d{3,4})\s*\(\s*(i{1,3}|iv|vi{0,3}|ix|x)\s*\)", re.IGNORECASE)
+# "E621", "INS 322", "ins-330", a bare "330", "150d", "503ii"
+_ADDITIVE_CODE = re.compile(r"(?:e|ins)?\s*-?\s*(\d{3,4})\s*([a-z]{0,4})")
+_ROMAN = {"i", "ii", "iii", "iv", "v", "vi", "vii", "viii", "ix", "x"}
+# Codes listed with "&" or "and", as in "Flavour Enhancer (627 & 631)"
+_CODE_LIST_SEPARATOR = re.compile(r"&|\band\b", re.IGNORECASE)
+
+
+def split_top_level(text):
+    """Split on commas and semicolons that are not inside brackets"""
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth = max(0, depth - 1)
+        if char in _SEPARATORS and depth == 0:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    return parts
+
+
+def normalize_term(term) -> str:
+    term = _QUANTITY.sub(" ", term)
+    term = re.sub(r"[^\w\s&'-]", " ", term.casefold())
+    term = " ".join(term.split()).strip(" -'&")
+    code = _ADDITIVE_CODE.fullmatch(term)
+    if code:
+        number, suffix = code.groups()
+        if suffix in _ROMAN:
+            return f"ins {number}({suffix})"
+        if len(suffix) <= 1:
+            return f"ins {number}{suffix}"
+    return term
+
+
+def _normalize_part(part):
+    """Normalized terms of one list entry: several when it lists additive codes with "&" or "and" """
+    pieces = _CODE_LIST_SEPARATOR.split(part)
+    if len(pieces) > 1:
+        codes = [normalize_term(piece) for piece in pieces]
+        if all(is_additive(code) for code in codes):
+            return codes
+    return [normalize_term(part)]
+
+
+def parse_ingredients(text):
+    """Normalized ingredient terms from a free-text ingredient list.
+
+    Bracketed sub-ingredients are returned alongside their parent, so
+    "Emulsifier (Soy Lecithin, INS 322)" yields "emulsifier", "soy lecithin"
+    and "ins 322". E numbers, INS numbers and bare additive codes are all
+    written as "ins <code>", and "627 & 631" yields both codes. Order
+    follows the label; duplicates are dropped.
+    """
+    if not text or not isinstance(text, str):
+        return []
+    text = _PREFIX.sub("", text.strip().rstrip("."))
+    text = _SUBNUMBERED_CODE.sub(r"\1\2", text)
+    terms = []
+    pending = split_top_level(text)
+    while pending:
+        part = pending.pop(0)
+        match = re.match(r"^([^(\[]*)[(\[](.*)[)\]]\s*$", part.strip())
+        if match:
+            pending[0:0] = [match.group(1)] + split_top_level(match.group(2))
+            continue
+        for term in _normalize_part(part):
+            if term and not term.isdigit() and len(term) > 1 and term not in terms:
+                terms.append(term)
+    return terms
+
+
+def is_additive(term) -> bool:
+    return term.startswith("ins ")
+
+
+def additive_code(term) -> str:
+    """Display form of a normalized additive term: "ins 503(ii)" -> "INS 503(ii)" """
+    return "INS " + term[4:]
@@ -0,0 +1,302 @@
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+import requests
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+
+from embeddings import create_embeddings, embed_array, embedding_name
+from link import links
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.faiss"
+STORE_FILE = "chunks.sqlite"
+EMBED_BATCH_SIZE = 64
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _read_pdf_pages(path):
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    return [(number, page.extract_text() or "") for number, page in enumerate(reader.pages, 1)]
+
+
+def _fetch_url(url):
+    html_doc = requests.get(url, timeout=30)
+    soup = BeautifulSoup(html_doc.text, 'html.parser')
+    return soup.get_text()
+
+
+class KnowledgeIndex:
+    """FAISS index over the FSSAI regulation corpus, persisted on disk.
+
+    The directory holds the FAISS index and a SQLite store with the chunk
+    texts plus a content hash for every PDF, page and URL that was indexed.
+    `update()` re-embeds only pages whose text changed and drops chunks of
+    pages that disappeared. The server opens the index read-only through a
+    memory map, so startup does not embed anything.
+    """
+
+    def __init__(self, path, embeddings=None, workers=4):
+        self.path = path
+        self._embeddings = embeddings
+        self.workers = workers
+        self.index = None
+        self._store = None
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            self._embeddings = create_embeddings()
+        return self._embeddings
+
+    @property
+    def loaded(self) -> bool:
+        return self.index is not None
+
+    def _open_store(self):
+        if self._store is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._store = sqlite3.connect(os.path.join(self.path, STORE_FILE), check_same_thread=False)
+            self._store.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, sha256 TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS units (
+                    key TEXT PRIMARY KEY, source TEXT NOT NULL, sha256 TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id INTEGER PRIMARY KEY, unit TEXT NOT NULL, source TEXT NOT NULL,
+                    page INTEGER, text TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_chunks_unit ON chunks (unit);
+            """)
+        return self._store
+
+    def _meta(self, key):
+        row = self._open_store().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def load(self) -> bool:
+        """Memory-map a previously built index read-only; False if none exists
+        or it was built with another embedder"""
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return False
+        embedder = self._meta("embedder")
+        try:
+            current = embedding_name(self.embeddings)
+        except Exception as e:
+            # Missing package or credentials: serve without regulations rather than fail startup
+            logger.warning(f"Cannot create embeddings for the knowledge index: {e}")
+            return False
+        if embedder != current:
+            # Queries would be embedded into a different vector space than the index
+            logger.warning(f"Knowledge index was built with {embedder}; run `python knowledge_index.py rebuild`")
+            return False
+        self.index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        return True
+
+    def _load_for_update(self, dim, embedder):
+        index_path = os.path.join(self.path, INDEX_FILE)
+        store = self._open_store()
+        if os.path.exists(index_path) and self._meta("embedder") == embedder:
+            return faiss.read_index(index_path)
+        # First build, or the embedding backend changed: start from scratch
+        store.executescript("DELETE FROM files; DELETE FROM units; DELETE FROM chunks;")
+        store.execute("INSERT OR REPLACE INTO meta VALUES ('embedder', ?)", (embedder,))
+        store.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (str(dim),))
+        store.commit()
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+    def _collect_units(self, directory, urls):
+        """PDF names present in `directory`, and (source, file hash, units) for
+        every PDF whose bytes changed and every URL that could be fetched,
+        where each unit is (key, source, page, text)"""
+        store = self._open_store()
+        seen_files = set()
+        changed = []
+        for name in sorted(os.listdir(directory)):
+            if not name.lower().endswith(".pdf"):
+                continue
+            path = os.path.join(directory, name)
+            seen_files.add(name)
+            with open(path, "rb") as f:
+                file_hash = _sha256(f.read())
+            stored = store.execute("SELECT sha256 FROM files WHERE path = ?", (name,)).fetchone()
+            if stored and stored[0] == file_hash:
+                continue
+            pages = _read_pdf_pages(path)
+            changed.append((name, file_hash, [(f"{name}#page={n}", name, n, text) for n, text in pages]))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            fetched = list(pool.map(lambda url: (url, self._try_fetch(url)), urls))
+        for url, text in fetched:
+            if text is not None:
+                changed.append((url, None, [(url, url, None, text)]))
+        return seen_files, changed
+
+    def _try_fetch(self, url):
+        try:
+            return _fetch_url(url)
+        except requests.RequestException as e:
+            # Keep whatever was indexed for this URL last time
+            logger.warning(f"Could not fetch {url}: {e}")
+            return None
+
+    def _embed(self, texts):
+        batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+        if not batches:
+            return np.zeros((0, 0), dtype=np.float32)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return np.vstack(list(pool.map(lambda batch: embed_array(self.embeddings, batch), batches)))
+
+    def update(self, directory, urls=()):
+        """Bring the index in line with the PDFs in `directory` and `urls`"""
+        # Build-time dependencies; the server only reads the index
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        embedder = embedding_name(self.embeddings)
+        dim = embed_array(self.embeddings, ["dimension probe"]).shape[1]
+        index = self._load_for_update(dim, embedder)
+        store = self._open_store()
+        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+        seen_files, changed = self._collect_units(directory, urls)
+
+        stale_units = []
+        new_chunks = []
+        for source, file_hash, units in changed:
+            current_keys = set()
+            for key, unit_source, page, text in units:
+                current_keys.add(key)
+                unit_hash = _sha256(text.encode("utf-8"))
+                stored = store.execute("SELECT sha256 FROM units WHERE key = ?", (key,)).fetchone()
+                if stored and stored[0] == unit_hash:
+                    continue
+                stale_units.append(key)
+                store.execute("INSERT OR REPLACE INTO units VALUES (?, ?, ?)", (key, unit_source, unit_hash))
+                new_chunks.extend((key, unit_source, page, chunk) for chunk in splitter.split_text(text))
+            # Pages that no longer exist in a changed PDF
+            for (key,) in store.execute("SELECT key FROM units WHERE source = ?", (source,)).fetchall():
+                if key not in current_keys:
+                    stale_units.append(key)
+                    store.execute("DELETE FROM units WHERE key = ?", (key,))
+            if file_hash is not None:
+                store.execute("INSERT OR REPLACE INTO files VALUES (?, ?)", (source, file_hash))
+
+        # PDFs removed from the directory
+        for (name,) in store.execute("SELECT path FROM files").fetchall():
+            if name not in seen_files:
+                for (key,) in store.execute("SELECT key FROM units WHERE source = ?", (name,)).fetchall():
+                    stale_units.append(key)
+                store.execute("DELETE FROM units WHERE source = ?", (name,))
+                store.execute("DELETE FROM files WHERE path = ?", (name,))
+
+        # URLs no longer listed; a URL's only unit is keyed by the URL itself
+        listed = set(urls)
+        for (key,) in store.execute("SELECT key FROM units WHERE key = source").fetchall():
+            if key not in listed:
+                stale_units.append(key)
+                store.execute("DELETE FROM units WHERE key = ?", (key,))
+
+        removed = 0
+        for key in stale_units:
+            ids = [row[0] for row in store.execute("SELECT id FROM chunks WHERE unit = ?", (key,))]
+            if ids:
+                index.remove_ids(np.asarray(ids, dtype=np.int64))
+                store.execute("DELETE FROM chunks WHERE unit = ?", (key,))
+                removed += len(ids)
+
+        if new_chunks:
+            vectors = self._embed([chunk for _, _, _, chunk in new_chunks])
+            ids = []
+            for key, source, page, chunk in new_chunks:
+                cursor = store.execute(
+                    "INSERT INTO chunks (unit, source, page, text) VALUES (?, ?, ?, ?)",
+                    (key, source, page, chunk)
+                )
+                ids.append(cursor.lastrowid)
+            index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+
+        # Written before the store commits: after a crash in between, the next
+        # update re-embeds those pages, and the orphaned vectors point at chunk
+        # rows that no longer exist, which search skips
+        index_path = os.path.join(self.path, INDEX_FILE)
+        faiss.write_index(index, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+        if new_chunks or removed:
+            store.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (uuid.uuid4().hex,))
+        store.commit()
+        self.index = index
+
+        report = {"added_chunks": len(new_chunks), "removed_chunks": removed, "total_chunks": int(index.ntotal)}
+        logger.info(f"Knowledge index updated: {report}")
+        return report
+
+    def search(self, query, k=4):
+        """Top-k regulation passages for a query as (score, source, page, text) tuples"""
+        return self.search_many([query], k)[0]
+
+    def search_many(self, queries, k=4):
+        """Top-k passages for each query, embedding and searching them as one batch"""
+        if not self.loaded or self.index.ntotal == 0 or not queries:
+            return [[] for _ in queries]
+        scores, ids = self.index.search(embed_array(self.embeddings, list(queries)), k)
+        results = []
+        for row_scores, row_ids in zip(scores, ids):
+            passages = []
+            for score, chunk_id in zip(row_scores, row_ids):
+                if chunk_id < 0:
+                    continue
+                row = self._store.execute(
+                    "SELECT source, page, text FROM chunks WHERE id = ?", (int(chunk_id),)
+                ).fetchone()
+                if row:
+                    passages.append((float(score), *row))
+            results.append(passages)
+        return results
+
+    @property
+    def version(self):
+        """Changes on every update, so caches derived from the index can tell they are stale"""
+        return self._meta("version") if self._store is not None else None
+
+    def stats(self):
+        if not self.loaded:
+            return {"loaded": False}
+        return {
+            "loaded": True,
+            "chunks": int(self.index.ntotal),
+            "embedder": self._meta("embedder"),
+            "files": self._store.execute("SELECT COUNT(*) FROM files").fetchone()[0],
+        }
+
+
+knowledge = KnowledgeIndex(os.getenv("KNOWLEDGE_INDEX_DIR", "./knowledge_index"))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build or update the regulation knowledge index")
+    parser.add_argument("command", choices=["update", "rebuild"])
+    parser.add_argument("--directory", default="data")
+    parser.add_argument("--no-links", action="store_true", help="Index only the PDFs")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        for name in (INDEX_FILE, STORE_FILE):
+            if os.path.exists(os.path.join(knowledge.path, name)):
+                os.remove(os.path.join(knowledge.path, name))
+    knowledge.update(args.directory, [] if args.no_links else links)
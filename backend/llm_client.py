@@ -0,0 +1,361 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import random
+import re
+import time
+from dotenv import load_dotenv
+
+from metrics import registry, record_span, SIZE_BUCKETS
+
+load_dotenv()
+
+llm_request_seconds = registry.histogram(
+    "llm_request_seconds", "Duration of each LLM call attempt", ("route", "outcome"))
+llm_prompt_chars = registry.histogram(
+    "llm_prompt_chars", "Prompt size of each LLM call attempt", ("route",), SIZE_BUCKETS)
+llm_response_chars = registry.histogram(
+    "llm_response_chars", "Size of each successful LLM reply", ("route",), SIZE_BUCKETS)
+llm_errors = registry.counter("llm_errors_total", "Failed LLM call attempts", ("route", "kind"))
+
+
+class GeminiBackend:
+    """Calls Gemini through the SDK's native async API"""
+
+    def __init__(self, model):
+        self.model = model
+        self.name = model.model_name
+
+    async def generate(self, prompt: str) -> str:
+        response = await self.model.generate_content_async(prompt)
+        return response.text
+
+    async def stream(self, prompt: str):
+        response = await self.model.generate_content_async(prompt, stream=True)
+        try:
+            async for chunk in response:
+                if chunk.parts:
+                    yield chunk.text
+        finally:
+            # Ends the upstream call when the consumer stops reading early
+            call = getattr(response, "_iterator", None)
+            if hasattr(call, "cancel"):
+                call.cancel()
+
+
+class FakeBackend:
+    """Offline stand-in for Gemini, used for load tests and local development.
+
+    Replies are deterministic for a given prompt so caching layers behave the
+    same way they would against the real model.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    async def generate(self, prompt: str) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._text(prompt)
+
+    async def stream(self, prompt: str):
+        # The same reply as generate(), a few words at a time over the same latency
+        words = self._text(prompt).split(" ")
+        pieces = [" ".join(words[i:i + 4]) for i in range(0, len(words), 4)]
+        for number, piece in enumerate(pieces):
+            if self.latency:
+                await asyncio.sleep(self.latency / len(pieces))
+            yield piece if number == len(pieces) - 1 else piece + " "
+
+    def _text(self, prompt):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        if "=== PRODUCT <number> ===" in prompt:
+            # Multi-product prompts get one section per product, like Gemini's
+            numbers = re.findall(r"^\s*Product (\d+):", prompt, re.MULTILINE)
+            return "\n".join(
+                f"=== PRODUCT {n} ===\n" + self._reply(f"{digest}:{n}") for n in numbers
+            )
+        return self._reply(digest)
+
+    @staticmethod
+    def _reply(digest):
+        return (
+            "1. Description: offline analysis generated by the fake LLM backend.\n"
+            "2. Key nutritional highlights: not evaluated.\n"
+            "3. Potential allergens or concerns: not evaluated.\n"
+            f"4. Overall health rating: {int(digest[:2], 16) % 10 + 1}/10\n"
+            f"[fake:{digest[:12]}]"
+        )
+
+
+def is_rate_limited(exc: Exception) -> bool:
+    """True for quota errors worth retrying (HTTP 429 / RESOURCE_EXHAUSTED)"""
+    if getattr(exc, "code", None) == 429:
+        return True
+    return type(exc).__name__ in ("ResourceExhausted", "TooManyRequests")
+
+
+def parse_route_limits(value: str) -> dict:
+    """Parse "analyze=4,compare=2" into {"analyze": 4, "compare": 2}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        route, _, limit = item.partition("=")
+        limits[route.strip()] = int(limit)
+    return limits
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough prompt size in tokens; Gemini averages about four characters per token"""
+    return max(1, len(text) // 4)
+
+
+class RateLimiter:
+    """Token buckets for requests per minute and prompt tokens per minute.
+
+    A limit of 0 disables that bucket. Each bucket holds up to one minute of
+    allowance, so short bursts are allowed while the average stays under
+    the quota.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.limits = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self._available = {name: float(limit) for name, limit in self.limits.items()}
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waited_seconds = 0.0
+        self.tokens_used = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        for name, limit in self.limits.items():
+            if limit:
+                self._available[name] = min(limit, self._available[name] + elapsed * limit / 60)
+
+    async def acquire(self, tokens=1):
+        wanted = {"requests": 1, "tokens": tokens}
+        for name, limit in self.limits.items():
+            if limit:
+                # A prompt larger than the whole bucket waits for a full one
+                wanted[name] = min(wanted[name], limit)
+        # Held while waiting, so callers are served in arrival order
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = max(
+                    ((wanted[name] - self._available[name]) * 60 / limit
+                     for name, limit in self.limits.items() if limit),
+                    default=0.0
+                )
+                if wait <= 0:
+                    break
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+            for name, limit in self.limits.items():
+                if limit:
+                    self._available[name] -= wanted[name]
+            self.tokens_used += tokens
+
+
+class LLMClient:
+    """Async, concurrency-limited front end for an LLM backend.
+
+    Every call holds a slot of the global limit and of its route's limit, is
+    bounded by a timeout, and is retried with exponential backoff when the
+    backend reports a rate limit. Every attempt also draws from the shared
+    request and token budget, so the model quota holds across all routes.
+    """
+
+    def __init__(self, backend, max_concurrency=8, route_limits=None,
+                 timeout=60.0, max_retries=3, backoff=1.0, rate_limiter=None):
+        self.backend = backend
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._route_limits = route_limits or {}
+        self._routes = {}
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.in_flight = 0
+        self.streams = 0
+        self.streams_abandoned = 0
+
+    @property
+    def model_name(self) -> str:
+        return self.backend.name
+
+    def _route(self, route):
+        if route not in self._routes:
+            limit = self._route_limits.get(route)
+            self._routes[route] = asyncio.Semaphore(limit) if limit else None
+        return self._routes[route]
+
+    async def generate(self, prompt: str, route: str = "default") -> str:
+        route_limit = self._route(route)
+        if route_limit is not None:
+            async with route_limit:
+                return await self._generate(prompt, route)
+        return await self._generate(prompt, route)
+
+    async def _generate(self, prompt, route):
+        async with self._global:
+            self.in_flight += 1
+            try:
+                return await self._call_with_retries(prompt, route)
+            finally:
+                self.in_flight -= 1
+
+    async def _call_with_retries(self, prompt, route):
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire(estimate_tokens(prompt))
+            self.calls += 1
+            started = time.perf_counter()
+            try:
+                text = await asyncio.wait_for(self.backend.generate(prompt), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self.errors += 1
+                self._observe(route, prompt, started, "timeout")
+                raise
+            except Exception as e:
+                self.errors += 1
+                self._observe(route, prompt, started, "rate_limited" if is_rate_limited(e) else "error")
+                if not is_rate_limited(e) or attempt >= self.max_retries:
+                    raise
+                await self._backoff(attempt)
+                attempt += 1
+            else:
+                self._observe(route, prompt, started, "ok", text)
+                return text
+
+    @staticmethod
+    def _observe(route, prompt, started, outcome, text=None):
+        """Record one call attempt in the LLM metrics and the request profile"""
+        elapsed = time.perf_counter() - started
+        llm_request_seconds.observe(elapsed, route=route, outcome=outcome)
+        llm_prompt_chars.observe(len(prompt), route=route)
+        if text is not None:
+            llm_response_chars.observe(len(text), route=route)
+        else:
+            llm_errors.inc(route=route, kind=outcome)
+        record_span("llm", elapsed)
+
+    async def _backoff(self, attempt):
+        self.retries += 1
+        delay = self.backoff * (2 ** attempt)
+        await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+    async def stream(self, prompt: str, route: str = "default"):
+        """Yield the reply in chunks as the backend produces them.
+
+        Takes the same slots and budget as `generate`. The timeout applies
+        to every wait for a chunk, and rate limits are retried only until
+        the first chunk arrives. Closing the generator early, as happens
+        when a client disconnects, closes the backend stream with it.
+        """
+        async with contextlib.AsyncExitStack() as slots:
+            route_limit = self._route(route)
+            if route_limit is not None:
+                await slots.enter_async_context(route_limit)
+            await slots.enter_async_context(self._global)
+            self.in_flight += 1
+            self.streams += 1
+            chunks = None
+            finished = False
+            received = []
+            try:
+                attempt = 0
+                while True:
+                    await self.rate_limiter.acquire(estimate_tokens(prompt))
+                    self.calls += 1
+                    chunks = self.backend.stream(prompt)
+                    started = time.perf_counter()
+                    try:
+                        chunk = await asyncio.wait_for(anext(chunks), self.timeout)
+                        break
+                    except StopAsyncIteration:
+                        finished = True
+                        self._observe(route, prompt, started, "ok", "")
+                        return
+                    except asyncio.TimeoutError:
+                        self.timeouts += 1
+                        self.errors += 1
+                        self._observe(route, prompt, started, "timeout")
+                        raise
+                    except Exception as e:
+                        self.errors += 1
+                        self._observe(route, prompt, started, "rate_limited" if is_rate_limited(e) else "error")
+                        await chunks.aclose()
+                        if not is_rate_limited(e) or attempt >= self.max_retries:
+                            raise
+                        await self._backoff(attempt)
+                        attempt += 1
+
+                while True:
+                    received.append(chunk)
+                    yield chunk
+                    try:
+                        chunk = await asyncio.wait_for(anext(chunks), self.timeout)
+                    except StopAsyncIteration:
+                        finished = True
+                        # Timed from the request to the last chunk
+                        self._observe(route, prompt, started, "ok", "".join(received))
+                        return
+                    except asyncio.TimeoutError:
+                        self.timeouts += 1
+                        self.errors += 1
+                        self._observe(route, prompt, started, "timeout")
+                        raise
+            finally:
+                self.in_flight -= 1
+                if not finished:
+                    self.streams_abandoned += 1
+                if chunks is not None:
+                    await chunks.aclose()
+
+    def stats(self):
+        return {
+            "backend": self.backend.name,
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "in_flight": self.in_flight,
+            "streams": self.streams,
+            "streams_abandoned": self.streams_abandoned,
+            "prompt_tokens": self.rate_limiter.tokens_used,
+            "rate_limit_wait_seconds": round(self.rate_limiter.waited_seconds, 3),
+        }
+
+
+def create_client(model=None) -> LLMClient:
+    """Build the client from the LLM_* environment settings.
+
+    LLM_BACKEND=fake swaps Gemini for the offline backend, so the server can
+    be load-tested without network access or an API key.
+    """
+    if os.getenv("LLM_BACKEND", "gemini") == "fake":
+        backend = FakeBackend(latency=float(os.getenv("FAKE_LLM_LATENCY", "0")))
+    else:
+        backend = GeminiBackend(model)
+    return LLMClient(
+        backend,
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        route_limits=parse_route_limits(os.getenv("LLM_ROUTE_LIMITS", "")),
+        timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+        backoff=float(os.getenv("LLM_RETRY_BACKOFF", "1.0")),
+        rate_limiter=RateLimiter(
+            requests_per_minute=int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+            tokens_per_minute=int(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+        ),
+    )
@@ -1,7 +1,9 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Body
+from fastapi import FastAPI, Depends, HTTPException, status, Body, Response, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta, datetime
 import os
 from dotenv import load_dotenv
@@ -9,15 +11,33 @@ from typing import List, Optional, Dict
 import json
 from pydantic import BaseModel
 
-from database import get_db, engine
+from database import get_async_db, engine, AsyncSessionLocal
 import models, auth
 from models import Base
 from chain import reality_query, compare, consumption
-from vector_store import analyze_product, compare_products
-import openfoodfacts
+import vector_store
+from vector_store import compare_products, explain_screening, stream_analysis, stream_comparison, llm
+from response_cache import response_cache
+from analysis_engine import analyzer, latest_analysis_async, is_fresh, store_analysis_async, AnalysisFailed
+from analysis_jobs import jobs
+import search_index
+import analysis_store
+import ingredient_index
+import nutrition_index
+from product_resolver import resolver, LookupUnavailable
+from knowledge_index import knowledge
+from ingredient_retrieval import retriever
+import screening
+import comparison
+import ingredient_clusters
+from similar_products import similar
+from sse import sse_response, single_chunk
+from metrics import registry, InstrumentationMiddleware
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
+search_index.ensure_index(engine)
+analysis_store.ensure_schema(engine)
 
 app = FastAPI()
 
@@ -28,21 +48,47 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
+# Outermost, so it times the whole request; send `X-Profile: 1` for a Server-Timing breakdown
+app.add_middleware(InstrumentationMiddleware)
+
+registry.gauge("llm_in_flight", "LLM calls currently running", lambda: llm.in_flight)
+registry.gauge("analysis_generations_in_flight", "Product analyses being generated", lambda: analyzer.stats()["in_flight"])
 
 # Initialize vector store
 @app.on_event("startup")
 async def startup_event():
+    # Memory-maps the prebuilt regulation index; build it with `python knowledge_index.py update`
+    if knowledge.load():
+        print(f"Knowledge index loaded ({knowledge.index.ntotal} chunks)")
+    else:
+        print("Knowledge index not built yet; run `python knowledge_index.py update`")
+    # Opens the similar-products index and adds products imported since it was saved, without embedding
+    async with AsyncSessionLocal() as session:
+        if await session.run_sync(similar.load):
+            print(f"Similar-products index loaded ({similar.index.ntotal} vectors)")
+        else:
+            print("Similar-products index is empty; run `python similar_products.py update`")
+    # Resumes any batch analysis jobs left over from the last run
+    await jobs.start()
     print("Gemini AI is ready")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await jobs.stop()
+    if similar.dirty:
+        similar.save()
+
 # Auth endpoints
 @app.post("/token")
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+    user = await db.scalar(select(models.User).where(models.User.email == form_data.username))
+    # bcrypt runs on a worker pool so a burst of logins cannot stall the event loop
+    if not user or not await auth.verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -60,119 +106,281 @@ async def create_user(
     email: str = Body(...),
     password: str = Body(...),
     full_name: str = Body(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    db_user = db.query(models.User).filter(models.User.email == email).first()
+    db_user = await db.scalar(select(models.User).where(models.User.email == email))
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = auth.get_password_hash(password)
+    hashed_password = await auth.get_password_hash_async(password)
     db_user = models.User(
         email=email,
         hashed_password=hashed_password,
         full_name=full_name
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
     return {"email": db_user.email, "full_name": db_user.full_name}
 
 # Product endpoints
 @app.get("/products/")
 async def get_products(
+    response: Response,
     skip: int = 0,
     limit: int = 10,
     search: Optional[str] = None,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    nutrient: Optional[List[str]] = Query(None),
+    sort: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    query = db.query(models.Product).filter(models.Product.ean.isnot(None)).filter(models.Product.ean != '')
-    if search:
-        query = query.filter(models.Product.name.ilike(f"%{search}%"))
-    return query.offset(skip).limit(limit).all()
+    # Pages are addressed by the opaque cursor returned in X-Next-Cursor;
+    # `skip` is still honoured for clients that page by offset.
+    # `nutrient` filters are per 100 g, e.g. ?nutrient=sugar_g<5&nutrient=protein_g>10,
+    # and `sort` orders a listing by a nutrient, e.g. ?sort=-protein_g for highest first.
+    try:
+        filters = [nutrition_index.parse_filter(expression) for expression in nutrient or []]
+        order = nutrition_index.parse_sort(sort) if sort else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if search and order:
+        raise HTTPException(status_code=400, detail="Search results are ordered by relevance; sort applies to listings")
+    # The search helpers are synchronous; run_sync runs them on this session's connection.
+    try:
+        if search:
+            products, next_cursor = await db.run_sync(search_index.search, search, limit, cursor, skip, filters)
+        else:
+            products, next_cursor = await db.run_sync(search_index.browse, limit, cursor, skip, filters, order)
+    except (ValueError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return products
 
 @app.get("/products/{ean}")
 async def get_product(
     ean: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # First check our database
-    product = db.query(models.Product).filter(models.Product.ean == ean).first()
-    
-    if not product:
-        # Try to fetch from Open Food Facts
-        off_product = openfoodfacts.products.get_product(ean)
-        if off_product and off_product.get('status') == 1:
-            product_data = off_product['product']
-            # Clean the image URL by trimming whitespace
-            image_url = product_data.get('image_url', '').strip() if product_data.get('image_url') else ''
-            product = models.Product(
-                name=product_data.get('product_name', ''),
-                ean=ean,
-                ingredients=product_data.get('ingredients_text', ''),
-                nutritional_info=json.dumps(product_data.get('nutriments', {})),
-                brand=product_data.get('brands', ''),
-                category=product_data.get('categories', ''),
-                image_url=image_url
-            )
-            db.add(product)
-            db.commit()
-            db.refresh(product)
-        else:
-            raise HTTPException(status_code=404, detail="Product not found")
+    # Our database first, then the local Open Food Facts mirror, then the API
+    try:
+        product = await resolver.resolve(db, ean)
+    except LookupUnavailable as e:
+        raise HTTPException(status_code=504 if e.timeout else 503, detail=str(e))
+    if product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
     
     return product
 
+@app.get("/products/{ean}/additives")
+async def get_product_additives(
+    ean: str,
+    db: AsyncSession = Depends(get_async_db)
+):
+    product = await db.scalar(select(models.Product).where(models.Product.ean == ean))
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return {"ean": ean, "additives": await db.run_sync(ingredient_index.product_additives, product.id)}
+
+@app.get("/products/{ean}/similar")
+async def get_similar_products(
+    ean: str,
+    k: int = 10,
+    rerank: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # `rerank=nutrition` orders the closest matches healthiest first
+    if not 1 <= k <= 50:
+        raise HTTPException(status_code=400, detail="k must be between 1 and 50")
+    if rerank not in (None, "nutrition"):
+        raise HTTPException(status_code=400, detail="rerank must be 'nutrition'")
+    product = await db.scalar(select(models.Product).where(models.Product.ean == ean))
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    # Picks up products imported since the last request
+    await similar.refresh(AsyncSessionLocal)
+    return {"ean": ean, "similar": await db.run_sync(similar.similar, product, k, rerank)}
+
+# Ingredient index endpoints
+@app.get("/ingredients/products")
+async def get_products_by_ingredients(
+    response: Response,
+    contains: List[str] = Query([]),
+    excludes: List[str] = Query([]),
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    if not contains and not excludes:
+        raise HTTPException(status_code=400, detail="Give at least one ingredient to contain or exclude")
+    # decode_cursor raises ValueError for anything but an {"id": int} position
+    try:
+        after_id = search_index.decode_cursor(cursor)["id"] if cursor else 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    products, last_id = await db.run_sync(ingredient_index.products_matching, contains, excludes, limit, after_id)
+    if last_id:
+        response.headers["X-Next-Cursor"] = search_index.encode_cursor(id=last_id)
+    return products
+
+@app.get("/additives/frequency")
+async def get_additive_frequency(
+    limit: int = 50,
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await db.run_sync(ingredient_index.additive_frequency, limit)
+
 @app.post("/products/analyze")
 async def analyze_product(
     ean: str = Body(...),
     name: str = Body(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    product = db.query(models.Product).filter(models.Product.ean == ean).first()
+    product = await db.scalar(select(models.Product).where(models.Product.ean == ean))
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Check if analysis exists and is recent (less than 24 hours old)
-    existing_analysis = (
-        db.query(models.Analysis)
-        .filter(models.Analysis.product_id == product.id)
-        .order_by(models.Analysis.created_at.desc())
-        .first()
-    )
-    
-    if existing_analysis and (datetime.utcnow() - existing_analysis.created_at).days < 1:
+    # Near-duplicates (pack sizes, flavours with the same recipe) share their canonical product's analysis
+    target = await db.run_sync(ingredient_clusters.canonical_product, product)
+    if target.id != product.id:
+        name = target.name
+
+    # Check if analysis exists, is recent and postdates the product's last update
+    existing_analysis = await latest_analysis_async(db, target.id)
+    if is_fresh(existing_analysis, target):
+        ingredient_clusters.record_reuse(product, target)
         return existing_analysis
     
-    # Perform new analysis
-    reality_result = reality_query(
-        title=name,  # Use the provided name
-        ingredients=product.ingredients,
-        nutritional=product.nutritional_info,
-        additives=""  # Extract from ingredients if needed
-    )
-    
-    # Since we don't have user preferences, use empty strings for allergies and health conditions
-    consumption_result = consumption(
-        title=name,
-        ingredients=product.ingredients,
-        nutritional=product.nutritional_info,
-        additives="",
-        allergies="",
-        diseases=""
-    )
-    
-    analysis = models.Analysis(
-        product_id=product.id,
-        reality_check=reality_result,
-        consumption_advice=consumption_result["consumption"],
-        health_implications=consumption_result["assessment"]
-    )
-    
-    db.add(analysis)
-    db.commit()
-    db.refresh(analysis)
-    
-    return analysis
+    # Generate a new analysis, sharing any generation already in flight for this EAN
+    try:
+        return await analyzer.analyze(target, name)
+    except AnalysisFailed as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+async def _analysis_stream(name, ingredients, **kwargs):
+    try:
+        return await stream_analysis(name, ingredients, **kwargs)
+    except Exception as e:
+        # Regulation retrieval failed before the stream started, so this can still be a 502
+        raise HTTPException(status_code=502, detail=f"Error analyzing product: {e}")
+
+@app.post("/products/analyze/stream")
+async def analyze_product_stream(
+    request: Request,
+    ean: str = Body(...),
+    name: str = Body(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    product = await db.scalar(select(models.Product).where(models.Product.ean == ean))
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    target = await db.run_sync(ingredient_clusters.canonical_product, product)
+    if target.id != product.id:
+        name = target.name
+
+    existing_analysis = await latest_analysis_async(db, target.id)
+    if is_fresh(existing_analysis, target):
+        ingredient_clusters.record_reuse(product, target)
+        analysis_id = existing_analysis.id
+        async def stored(text):
+            return {"analysis_id": analysis_id, "cached": True}
+        return sse_response(request, single_chunk(existing_analysis.reality_check), stored)
+
+    product_id = target.id
+    async def persist(text):
+        # The request's session may already be closed once streaming ends
+        async with AsyncSessionLocal() as session:
+            product = await session.get(models.Product, product_id)
+            analysis = await store_analysis_async(session, product, name, text)
+            return {"analysis_id": analysis.id, "cached": False}
+    chunks = await _analysis_stream(name, target.ingredients, route="products_analyze")
+    return sse_response(request, chunks, persist)
+
+@app.post("/products/compare")
+async def compare_products_by_ean(
+    eans: List[str] = Body(...),
+    synthesize: bool = Body(True),
+    analyze_missing: bool = Body(True),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Ranked on nutrition facts and additives without the LLM; stored analyses
+    # are reused and only products without a fresh one are analyzed
+    eans = list(dict.fromkeys(eans))
+    if len(eans) < 2:
+        raise HTTPException(status_code=400, detail="Give at least two EANs to compare")
+    if len(eans) > comparison.MAX_PRODUCTS:
+        raise HTTPException(status_code=400, detail=f"Compare at most {comparison.MAX_PRODUCTS} products at once")
+    return await comparison.compare(db, eans, synthesize, analyze_missing)
+
+@app.post("/products/analyze/batch")
+async def analyze_products_batch(
+    eans: List[str] = Body(..., embed=True),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if not eans:
+        raise HTTPException(status_code=400, detail="Give at least one EAN")
+    job = await db.run_sync(jobs.enqueue, eans)
+    return {"job_id": job.id, "status": job.status, "total": job.total}
+
+@app.get("/products/analyze/batch/{job_id}")
+async def get_analysis_job(
+    job_id: int,
+    db: AsyncSession = Depends(get_async_db)
+):
+    status = await db.run_sync(jobs.status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats/analysis")
+async def analysis_stats():
+    return analyzer.stats()
+
+@app.get("/stats/jobs")
+async def job_stats():
+    return jobs.stats()
+
+@app.get("/stats/auth")
+async def auth_stats():
+    return auth.auth_stats()
+
+@app.get("/stats/llm")
+async def llm_stats():
+    return llm.stats()
+
+@app.get("/stats/cache")
+async def cache_stats():
+    return response_cache.stats()
+
+@app.get("/stats/knowledge")
+async def knowledge_stats():
+    return knowledge.stats()
+
+@app.get("/stats/retrieval")
+async def retrieval_stats():
+    return retriever.stats()
+
+@app.get("/stats/compare")
+async def compare_stats():
+    return comparison.stats()
+
+@app.get("/stats/clusters")
+async def cluster_stats(db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(ingredient_clusters.cluster_stats)
+
+@app.get("/stats/similar")
+async def similar_stats():
+    return similar.stats()
+
+@app.get("/stats/lookup")
+async def lookup_stats():
+    return resolver.stats()
 
 # User preference endpoints
 @app.put("/users/me/preferences")
@@ -180,33 +388,80 @@ async def update_preferences(
     allergies: List[str] = Body(...),
     health_conditions: List[str] = Body(...),
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     current_user.allergies = json.dumps(allergies)
     current_user.health_conditions = json.dumps(health_conditions)
-    db.commit()
+    await db.commit()
+    auth.principal_cache.invalidate(current_user.email)
     return {"message": "Preferences updated successfully"}
 
 @app.post("/users/me/favorites/{ean}")
 async def add_to_favorites(
     ean: str,
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    product = db.query(models.Product).filter(models.Product.ean == ean).first()
+    product = await db.scalar(select(models.Product).where(models.Product.ean == ean))
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    current_user.favorites.append(product)
-    db.commit()
+    await db.execute(models.user_favorites.insert().values(user_id=current_user.id, product_id=product.id))
+    await db.commit()
     return {"message": "Product added to favorites"}
 
+async def favorite_products(db, user):
+    # Loaded explicitly: an AsyncSession cannot lazy-load user.favorites
+    return (await db.scalars(
+        select(models.Product)
+        .join(models.user_favorites, models.user_favorites.c.product_id == models.Product.id)
+        .where(models.user_favorites.c.user_id == user.id)
+    )).all()
+
 @app.get("/users/me/favorites")
 async def get_favorites(
     current_user: models.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await favorite_products(db, current_user)
+
+# Personalized screening endpoints; rule-based, so no LLM call per product
+@app.post("/users/me/screen")
+async def screen_products(
+    eans: List[str] = Body(..., embed=True),
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    found = {p.ean: p for p in await db.scalars(select(models.Product).where(models.Product.ean.in_(eans)))}
+    products = [found[ean] for ean in dict.fromkeys(eans) if ean in found]
+    result = await db.run_sync(screening.screen_for_user, current_user, products)
+    result["not_found"] = [ean for ean in eans if ean not in found]
+    return result
+
+@app.get("/users/me/favorites/screening")
+async def screen_favorites(
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    products = await favorite_products(db, current_user)
+    return await db.run_sync(screening.screen_for_user, current_user, products)
+
+@app.post("/users/me/screen/{ean}/explain")
+async def explain_product_screening(
+    ean: str,
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    return current_user.favorites
+    product = await db.scalar(select(models.Product).where(models.Product.ean == ean))
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    result = await db.run_sync(screening.screen_for_user, current_user, [product])
+    screened = result["products"][0]
+    explanation = await explain_screening(
+        product.name, product.ingredients,
+        result["allergies"], result["health_conditions"], screened["flags"]
+    )
+    return {"screening": screened, "explanation": explanation}
 
 class Product(BaseModel):
     name: str
@@ -219,7 +474,8 @@ class ProductComparison(BaseModel):
 @app.post("/analyze")
 async def analyze_product_endpoint(product: Product):
     try:
-        result = analyze_product(product.name, product.ingredients)
+        # The /products/analyze handler shadows the vector_store import of the same name
+        result = await vector_store.analyze_product(product.name, product.ingredients)
         return {"analysis": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -227,7 +483,7 @@ async def analyze_product_endpoint(product: Product):
 @app.post("/compare")
 async def compare_products_endpoint(comparison: ProductComparison):
     try:
-        result = compare_products(
+        result = await compare_products(
             {"name": comparison.product1.name, "ingredients": comparison.product1.ingredients},
             {"name": comparison.product2.name, "ingredients": comparison.product2.ingredients}
         )
@@ -235,6 +491,17 @@ async def compare_products_endpoint(comparison: ProductComparison):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/analyze/stream")
+async def analyze_product_stream_endpoint(request: Request, product: Product):
+    return sse_response(request, await _analysis_stream(product.name, product.ingredients))
+
+@app.post("/compare/stream")
+async def compare_products_stream_endpoint(request: Request, comparison: ProductComparison):
+    return sse_response(request, stream_comparison(
+        {"name": comparison.product1.name, "ingredients": comparison.product1.ingredients},
+        {"name": comparison.product2.name, "ingredients": comparison.product2.ingredients}
+    ))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,306 @@
+import resource
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+class LatencyHistogram:
+    """Latency samples for one operation, summarised as percentiles.
+
+    Only the most recent `window` samples are kept, so the percentiles track
+    current behaviour and memory stays bounded.
+    """
+
+    def __init__(self, window=2048):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def time(self):
+        return _Timer(self)
+
+    def percentile(self, q: float) -> float:
+        return _pick(sorted(self._samples), q)
+
+    def summary(self):
+        ordered = sorted(self._samples)
+
+        def pick(q):
+            return _pick(ordered, q)
+
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(pick(50) * 1000, 3),
+            "p95_ms": round(pick(95) * 1000, 3),
+            "p99_ms": round(pick(99) * 1000, 3),
+        }
+
+
+def _pick(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class StageReport:
+    """Wall time and peak traced memory of each stage of a batch job.
+
+    A stage entered many times (once per chunk) adds up its time and keeps
+    its largest peak. Peaks come from tracemalloc, which sees pandas/numpy
+    buffers; the process RSS high-water mark is reported alongside.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            entry = self.stages.setdefault(name, {"seconds": 0.0, "peak_mb": 0.0, "calls": 0})
+            entry["seconds"] += time.perf_counter() - started
+            entry["peak_mb"] = max(entry["peak_mb"], peak / 2 ** 20)
+            entry["calls"] += 1
+
+    def summary(self):
+        return {
+            "stages": {
+                name: {"seconds": round(e["seconds"], 3), "peak_mb": round(e["peak_mb"], 1), "calls": e["calls"]}
+                for name, e in self.stages.items()
+            },
+            # ru_maxrss is in KiB on Linux
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+
+# Upper bounds of the Prometheus histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[n] for n in self.label_names)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# TYPE {self.name} counter"
+        for key, value in self.values.items():
+            yield f"{self.name}{_labels(self.label_names, key)} {_number(value)}"
+
+
+class Gauge:
+    """A value read from `read` at scrape time"""
+
+    def __init__(self, name, help, read):
+        self.name, self.help, self.read = name, help, read
+
+    def render(self):
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {_number(self.read())}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense.
+
+    Unlike `LatencyHistogram` it keeps no samples, only one counter per
+    bucket, so it is cheap enough to observe on every request and can be
+    aggregated across server processes.
+    """
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels[n] for n in self.label_names)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        yield f"# TYPE {self.name} histogram"
+        names = self.label_names + ("le",)
+        for key, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_labels(names, key + (_number(bound),))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.label_names, key)} {count}"
+
+
+class Registry:
+    """Every metric of the process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, read):
+        return self._add(Gauge(name, help, read))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# The request being handled; set by InstrumentationMiddleware
+_current_profile = ContextVar("request_profile", default=None)
+
+
+class RequestProfile:
+    """Where the time of one request went: DB queries, LLM calls, lookups.
+
+    Lives in a context variable, so it follows the request into tasks,
+    worker threads and `run_sync` greenlets without being passed around.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+
+    def add(self, name, seconds):
+        span = self.spans.setdefault(name, [0, 0.0])
+        span[0] += 1
+        span[1] += seconds
+
+    def count(self, name):
+        return self.spans.get(name, (0, 0.0))[0]
+
+    def seconds(self, name):
+        return self.spans.get(name, (0, 0.0))[1]
+
+    def server_timing(self):
+        """The profile as a Server-Timing header value (durations in ms)"""
+        total = time.perf_counter() - self.started
+        entries = [
+            f'{name};dur={seconds * 1000:.2f};desc="{count} calls"'
+            for name, (count, seconds) in self.spans.items()
+        ]
+        return ", ".join(entries + [f"total;dur={total * 1000:.2f}"])
+
+
+def record_span(name, seconds):
+    """Add time spent in `name` to the current request's profile, if any"""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.add(name, seconds)
+
+
+http_request_seconds = registry.histogram(
+    "http_request_seconds", "Time to the response headers, per route", ("method", "route", "status"))
+http_request_db_queries = registry.histogram(
+    "http_request_db_queries", "DB queries run per request", ("route",), COUNT_BUCKETS)
+http_request_db_seconds = registry.histogram(
+    "http_request_db_seconds", "Time spent in DB queries per request", ("route",))
+
+
+class InstrumentationMiddleware:
+    """ASGI middleware timing every HTTP request by route template.
+
+    A request sent with `X-Profile: 1` gets its timing breakdown back in a
+    `Server-Timing` response header. Streaming responses are timed up to
+    their headers.
+    """
+
+    def __init__(self, app, header=b"x-profile"):
+        self.app = app
+        self.header = header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        wants_profile = dict(scope.get("headers") or ()).get(self.header, b"") not in (b"", b"0")
+        status, elapsed = [500], [None]
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                elapsed[0] = time.perf_counter() - profile.started
+                if wants_profile:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", profile.server_timing().encode("latin-1")))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_profile.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            if elapsed[0] is None:
+                elapsed[0] = time.perf_counter() - profile.started
+            http_request_seconds.observe(elapsed[0], method=scope["method"], route=route, status=status[0])
+            http_request_db_queries.observe(profile.count("db"), route=route)
+            http_request_db_seconds.observe(profile.seconds("db"), route=route)
@@ -1,6 +1,9 @@
+import base64
+import zlib
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, String, Text, Float, ForeignKey, Table, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Float, ForeignKey, Table, DateTime, Boolean, Index, LargeBinary
 from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
 
 Base = declarative_base()
@@ -22,6 +25,36 @@ class Details(BaseModel):
     Allergies: list[str]
     Diseases: list[str]
 
+class CompressedText(TypeDecorator):
+    """Text stored zlib-compressed once it is long enough for that to pay off.
+
+    Compressed values are base64 behind a marker prefix, so the column stays
+    a plain text column on every dialect and rows written before compression
+    read back unchanged.
+    """
+    impl = Text
+    cache_ok = True
+    PREFIX = "zlib:"
+
+    def __init__(self, min_length=256, level=6):
+        super().__init__()
+        self.min_length = min_length
+        self.level = level
+
+    def process_bind_param(self, value, dialect):
+        if value is None or (len(value) < self.min_length and not value.startswith(self.PREFIX)):
+            return value
+        packed = self.PREFIX + base64.b64encode(zlib.compress(value.encode(), self.level)).decode("ascii")
+        # Text that does not compress is kept as is, unless it would read back as compressed
+        if len(packed) >= len(value) and not value.startswith(self.PREFIX):
+            return value
+        return packed
+
+    def process_result_value(self, value, dialect):
+        if value is None or not value.startswith(self.PREFIX):
+            return value
+        return zlib.decompress(base64.b64decode(value[len(self.PREFIX):])).decode()
+
 class User(Base):
     __tablename__ = "users"
     
@@ -54,12 +87,138 @@ class Analysis(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
-    reality_check = Column(Text)
-    consumption_advice = Column(Text)
-    health_implications = Column(Text)
+    reality_check = Column(CompressedText())
+    consumption_advice = Column(CompressedText())
+    health_implications = Column(CompressedText())
+    # Model and analysis prompt that produced the text; a change to either makes the row stale
+    model_version = Column(String(64), nullable=True)
+    prompt_version = Column(String(16), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     product = relationship("Product", backref="analyses")
 
+    # Latest-analysis lookups filter on the product and order by creation time
+    __table_args__ = (Index("ix_analyses_product_created", "product_id", "created_at"),)
+
+class AnalysisJob(Base):
+    """A batch of products queued for background analysis"""
+    __tablename__ = "analysis_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # queued, running or completed
+    status = Column(String(16), default="queued")
+    total = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    items = relationship("AnalysisJobItem", backref="job")
+
+class AnalysisJobItem(Base):
+    """One product of an analysis job; the queue the workers claim from"""
+    __tablename__ = "analysis_job_items"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("analysis_jobs.id"))
+    ean = Column(String(32))
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=True)
+    # pending, running, done or failed
+    status = Column(String(16), default="pending")
+    analysis_id = Column(Integer, ForeignKey("analyses.id"), nullable=True)
+    error = Column(Text, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_analysis_job_items_job_status", "job_id", "status"),
+        Index("ix_analysis_job_items_status", "status", "id"),
+    )
+
+class OffLookupMiss(Base):
+    """EANs Open Food Facts did not know, so scans do not re-query them until the entry expires"""
+    __tablename__ = "off_lookup_misses"
+
+    ean = Column(String(32), primary_key=True)
+    checked_at = Column(DateTime, default=datetime.utcnow)
+
+class OffMirrorProduct(Base):
+    """Local copy of an Open Food Facts dump, consulted before the network"""
+    __tablename__ = "off_mirror_products"
+
+    ean = Column(String(32), primary_key=True)
+    product_name = Column(Text)
+    ingredients_text = Column(Text)
+    nutriments = Column(Text)
+    brands = Column(Text)
+    categories = Column(Text)
+    image_url = Column(String(512), nullable=True)
+    imported_at = Column(DateTime, default=datetime.utcnow)
+
+class Ingredient(Base):
+    """A normalized ingredient term; additives are stored as "ins <code>" """
+    __tablename__ = "ingredients"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(255), unique=True, index=True)
+    is_additive = Column(Boolean, default=False)
+    # Number of products listing this ingredient, maintained by the ingredient index
+    product_count = Column(Integer, default=0)
+
+    __table_args__ = (Index("ix_ingredients_additive_count", "is_additive", "product_count"),)
+
+class NutritionFacts(Base):
+    """Per-100 g nutrient values parsed from a product's nutritional_info, for range queries"""
+    __tablename__ = "nutrition_facts"
+
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    energy_kcal = Column(Float, nullable=True, index=True)
+    fat_g = Column(Float, nullable=True, index=True)
+    saturated_fat_g = Column(Float, nullable=True, index=True)
+    trans_fat_g = Column(Float, nullable=True, index=True)
+    carbs_g = Column(Float, nullable=True, index=True)
+    sugar_g = Column(Float, nullable=True, index=True)
+    fiber_g = Column(Float, nullable=True, index=True)
+    protein_g = Column(Float, nullable=True, index=True)
+    sodium_mg = Column(Float, nullable=True, index=True)
+
+class ProductFingerprint(Base):
+    """MinHash signature of a product's ingredient list and the near-duplicate cluster it belongs to"""
+    __tablename__ = "product_fingerprints"
+
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    signature = Column(LargeBinary)
+    # Product id of the cluster's canonical product, whose analysis the cluster shares
+    cluster_id = Column(Integer, index=True)
+
+# LSH buckets of the clusters' canonical products: sharing a (band, bucket) makes a product a candidate member
+product_lsh_buckets = Table(
+    "product_lsh_buckets",
+    Base.metadata,
+    Column("band", Integer, primary_key=True),
+    Column("bucket", BigInteger, primary_key=True),
+    Column("product_id", Integer, ForeignKey("products.id"), primary_key=True),
+    Index("ix_product_lsh_buckets_product", "product_id")
+)
+
+class ProductVector(Base):
+    """Embedding of a product's name, category and ingredients for the similar-products index"""
+    __tablename__ = "product_vectors"
+    # Ids are the FAISS labels, so a deleted row's id must never come back
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), unique=True, index=True)
+    # Hash of the embedded text and the embedder, so unchanged products are not re-embedded
+    text_hash = Column(String(32))
+    embedding = Column(LargeBinary)
+
+# Inverted index from ingredients to the products that list them
+product_ingredients = Table(
+    "product_ingredients",
+    Base.metadata,
+    Column("product_id", Integer, ForeignKey("products.id"), primary_key=True),
+    Column("ingredient_id", Integer, ForeignKey("ingredients.id"), primary_key=True),
+    Column("position", Integer),
+    Index("ix_product_ingredients_ingredient_product", "ingredient_id", "product_id")
+)
+
 # Association table for user favorites
 user_favorites = Table(
     "user_favorites",
@@ -0,0 +1,139 @@
+import json
+import re
+
+# Canonical nutrients, all per 100 g: energy in kcal, sodium in mg, the rest in g
+NUTRIENTS = (
+    "energy_kcal", "fat_g", "saturated_fat_g", "trans_fat_g", "carbs_g",
+    "sugar_g", "fiber_g", "protein_g", "sodium_mg",
+)
+
+# Label names, checked in order: "saturated fat" must win over "fat"
+_NAMES = [
+    ("saturated", "saturated_fat_g"),
+    ("trans", "trans_fat_g"),
+    ("sugar", "sugar_g"),
+    ("fibre", "fiber_g"),
+    ("fiber", "fiber_g"),
+    ("protein", "protein_g"),
+    ("carbohydrate", "carbs_g"),
+    ("carbs", "carbs_g"),
+    ("sodium", "sodium_mg"),
+    ("salt", "salt"),
+    ("energy", "energy_kcal"),
+    ("calorie", "energy_kcal"),
+    ("kcal", "energy_kcal"),
+    ("fat", "fat_g"),
+]
+
+# Open Food Facts "nutriments" keys, whose values are per 100 g in g (energy in kcal/kJ)
+_OFF_KEYS = {
+    "energy-kcal_100g": ("energy_kcal", "kcal"),
+    "energy_100g": ("energy_kcal", "kj"),
+    "fat_100g": ("fat_g", "g"),
+    "saturated-fat_100g": ("saturated_fat_g", "g"),
+    "trans-fat_100g": ("trans_fat_g", "g"),
+    "carbohydrates_100g": ("carbs_g", "g"),
+    "sugars_100g": ("sugar_g", "g"),
+    "fiber_100g": ("fiber_g", "g"),
+    "proteins_100g": ("protein_g", "g"),
+    "sodium_100g": ("sodium_mg", "g"),
+    "salt_100g": ("salt", "g"),
+}
+
+_TEXT_ENTRY = re.compile(
+    r"([a-z][a-z \-/()]*?)\s*[:\-=]?\s*(\d+(?:[.,]\d+)?)\s*(kcal|kj|mcg|µg|mg|g)?\b", re.IGNORECASE
+)
+_VALUE = re.compile(r"(\d+(?:[.,]\d+)?)\s*(kcal|kj|mcg|µg|mg|g)?\b", re.IGNORECASE)
+
+
+def _canonical(name):
+    name = name.casefold()
+    if "added" in name or "serving" in name or "%" in name:
+        return None
+    for fragment, nutrient in _NAMES:
+        if fragment in name:
+            return nutrient
+    return None
+
+
+def _convert(nutrient, value, unit):
+    """Express a value in the canonical unit for the nutrient"""
+    unit = (unit or "").casefold()
+    if nutrient == "energy_kcal":
+        return value / 4.184 if unit == "kj" else value
+    if nutrient == "sodium_mg":
+        return {"g": value * 1000, "mcg": value / 1000, "µg": value / 1000}.get(unit, value)
+    # Grams, with a bare number taken as grams
+    return {"mg": value / 1000, "mcg": value / 1e6, "µg": value / 1e6}.get(unit, value)
+
+
+def _number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value), None
+    match = _VALUE.search(str(value))
+    if not match:
+        return None, None
+    return float(match.group(1).replace(",", ".")), match.group(2)
+
+
+def parse_nutrients(nutritional_info):
+    """Per-100 g nutrient values from a stored nutritional_info value.
+
+    Accepts Open Food Facts `nutriments`, BigBasket label dicts such as
+    {"Sugar": "5 g"} and free label text such as "Energy - 512 kcal,
+    Sodium - 210 mg", as a dict or as the JSON text stored on the product.
+    Salt is converted to sodium. Nutrients that cannot be read are left out.
+    """
+    data = nutritional_info
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except json.JSONDecodeError:
+            pass
+
+    values = {}
+    if isinstance(data, dict):
+        off = {key: data[key] for key in _OFF_KEYS if key in data}
+        if off:
+            for key, raw in off.items():
+                nutrient, unit = _OFF_KEYS[key]
+                number, _ = _number(raw)
+                if number is not None and not (nutrient in values and key == "energy_100g"):
+                    values[nutrient] = number if nutrient == "salt" else _convert(nutrient, number, unit)
+        else:
+            for key, raw in data.items():
+                nutrient = _canonical(str(key))
+                number, unit = _number(raw)
+                if nutrient and number is not None and nutrient not in values:
+                    values[nutrient] = number if nutrient == "salt" else _convert(nutrient, number, unit)
+    elif isinstance(data, str):
+        for name, number, unit in _TEXT_ENTRY.findall(data):
+            nutrient = _canonical(name)
+            if nutrient and nutrient not in values:
+                number = float(number.replace(",", "."))
+                values[nutrient] = number if nutrient == "salt" else _convert(nutrient, number, unit)
+
+    salt = values.pop("salt", None)
+    if salt is not None and "sodium_mg" not in values:
+        # Salt is 40% sodium by weight
+        values["sodium_mg"] = salt * 400
+    return {nutrient: round(value, 3) for nutrient, value in values.items() if value >= 0}
+
+
+# Nutri-Score style points per 100 g: (nutrient, value per point, most points)
+_NEGATIVE_POINTS = (("energy_kcal", 80, 10), ("sugar_g", 4.5, 10), ("saturated_fat_g", 1, 10), ("sodium_mg", 90, 10))
+_POSITIVE_POINTS = (("fiber_g", 0.9, 5), ("protein_g", 1.6, 5))
+
+
+def nutrition_score(values):
+    """Nutri-Score style score of per-100 g values, lower is healthier:
+    points for energy, sugar, saturated fat and sodium minus points for
+    fibre and protein. None without energy and sugar; other missing
+    nutrients score no points."""
+    if values.get("energy_kcal") is None or values.get("sugar_g") is None:
+        return None
+
+    def points(table):
+        return sum(min(limit, int((values.get(name) or 0) / step)) for name, step, limit in table)
+
+    return points(_NEGATIVE_POINTS) - points(_POSITIVE_POINTS)
@@ -0,0 +1,82 @@
+import operator
+import re
+
+from sqlalchemy import select
+
+from database import batched
+import models
+from nutrition import NUTRIENTS, parse_nutrients
+
+# Nutrients may be named with or without their unit: "sugar" or "sugar_g"
+NUTRIENT_NAMES = {
+    **{nutrient: nutrient for nutrient in NUTRIENTS},
+    **{nutrient.rsplit("_", 1)[0]: nutrient for nutrient in NUTRIENTS},
+}
+
+_OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "=": operator.eq,
+}
+_FILTER = re.compile(r"^\s*([a-z_]+)\s*(<=|>=|<|>|=)\s*(\d+(?:\.\d+)?)\s*$", re.IGNORECASE)
+
+
+def index_products(db, product_ids):
+    """Re-parse the products' nutritional_info into nutrition_facts.
+
+    Runs inside the caller's transaction. Products without any readable
+    nutrient get no row, so they never match a nutrient filter.
+    """
+    table = models.NutritionFacts.__table__
+    for batch in batched(product_ids):
+        rows = []
+        for product_id, nutritional_info in db.execute(
+            select(models.Product.id, models.Product.nutritional_info).where(models.Product.id.in_(batch))
+        ):
+            values = parse_nutrients(nutritional_info)
+            if values:
+                rows.append({"product_id": product_id, **{nutrient: values.get(nutrient) for nutrient in NUTRIENTS}})
+        db.execute(table.delete().where(table.c.product_id.in_(batch)))
+        if rows:
+            db.execute(table.insert(), rows)
+
+
+def _nutrient(name):
+    nutrient = NUTRIENT_NAMES.get(name.casefold())
+    if nutrient is None:
+        raise ValueError(f"Unknown nutrient '{name}'; expected one of {', '.join(NUTRIENTS)}")
+    return nutrient
+
+
+def parse_filter(expression):
+    """`"sugar_g<5"` -> ("sugar_g", "<", 5.0); values are per 100 g in the nutrient's unit"""
+    match = _FILTER.match(expression)
+    if not match:
+        raise ValueError(f"Invalid nutrient filter '{expression}'; expected e.g. sugar_g<5")
+    name, op, value = match.groups()
+    return _nutrient(name), op, float(value)
+
+
+def parse_sort(expression):
+    """`"-protein_g"` -> ("protein_g", True): a nutrient, descending when prefixed with '-'"""
+    descending = expression.startswith("-")
+    return _nutrient(expression.lstrip("+-")), descending
+
+
+def filter_clauses(filters):
+    """SQLAlchemy conditions on `models.NutritionFacts` for parsed filters"""
+    return [_OPERATORS[op](getattr(models.NutritionFacts, nutrient), value) for nutrient, op, value in filters]
+
+
+def filter_sql(filters, column="products.id"):
+    """The same conditions as an SQL fragment restricting `column`, with its bound parameters"""
+    if not filters:
+        return "", {}
+    conditions, params = [], {}
+    for i, (nutrient, op, value) in enumerate(filters):
+        # Names and operators come from NUTRIENTS and _OPERATORS, never from the request
+        conditions.append(f"{nutrient} {op} :nutrient_{i}")
+        params[f"nutrient_{i}"] = value
+    return f"AND {column} IN (SELECT product_id FROM nutrition_facts WHERE {' AND '.join(conditions)})", params
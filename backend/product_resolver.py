@@ -0,0 +1,266 @@
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import openfoodfacts
+import pandas as pd
+import requests
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from database import AsyncSessionLocal, engine, dialect_insert
+import models
+import ingest
+from metrics import LatencyHistogram, registry, record_span
+from singleflight import SingleFlight
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MIRROR_BATCH_SIZE = 5000
+MIRROR_FIELDS = ("product_name", "ingredients_text", "brands", "categories", "image_url")
+
+off_lookup_seconds = registry.histogram(
+    "off_lookup_seconds", "Open Food Facts API lookups by outcome", ("outcome",))
+
+
+class LookupUnavailable(Exception):
+    """Open Food Facts could not be asked: it timed out (`timeout`) or the request failed"""
+
+    def __init__(self, message, timeout=False):
+        super().__init__(message)
+        self.timeout = timeout
+
+
+def product_from_off(ean, product_data):
+    """Build a catalog Product from an Open Food Facts product record"""
+    # Clean the image URL by trimming whitespace
+    image_url = product_data.get('image_url', '').strip() if product_data.get('image_url') else ''
+    nutriments = product_data.get('nutriments', {})
+    return models.Product(
+        name=product_data.get('product_name', ''),
+        ean=ean,
+        ingredients=product_data.get('ingredients_text', ''),
+        nutritional_info=nutriments if isinstance(nutriments, str) else json.dumps(nutriments),
+        brand=product_data.get('brands', ''),
+        category=product_data.get('categories', ''),
+        image_url=image_url
+    )
+
+
+def fetch_remote(ean):
+    """Blocking Open Food Facts API lookup; runs in a worker thread"""
+    return openfoodfacts.products.get_product(ean)
+
+
+class ProductResolver:
+    """Resolves a barcode to a catalog product.
+
+    Lookups try the products table, then the local Open Food Facts mirror,
+    then the Open Food Facts API. Unknown EANs are remembered for
+    `negative_ttl`, and concurrent lookups for the same EAN share one
+    resolution.
+    """
+
+    def __init__(self, fetch=fetch_remote, negative_ttl=timedelta(hours=24),
+                 timeout=10.0, offline=False):
+        self.fetch = fetch
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.offline = offline
+        self._flights = SingleFlight()
+        self.latency = {source: LatencyHistogram() for source in ("local", "mirror", "remote", "miss")}
+        self.negative_hits = 0
+
+    async def resolve(self, db, ean):
+        """The product for `ean`, or None; `db` is the request's AsyncSession.
+
+        Raises LookupUnavailable when the API had to be asked and did not
+        answer; nothing is remembered, so the next lookup asks again.
+        """
+        start = time.perf_counter()
+        product = await db.scalar(select(models.Product).where(models.Product.ean == ean))
+        if product:
+            self.latency["local"].observe(time.perf_counter() - start)
+            return product
+
+        try:
+            source, product_id = await self._flights.do(ean, lambda: self._resolve_missing(ean))
+        except asyncio.TimeoutError:
+            raise LookupUnavailable("Open Food Facts did not respond in time", timeout=True)
+        except requests.RequestException as e:
+            raise LookupUnavailable(f"Open Food Facts is unreachable: {e}")
+        self.latency[source].observe(time.perf_counter() - start)
+        if product_id is None:
+            return None
+        return await db.get(models.Product, product_id)
+
+    async def _resolve_missing(self, ean):
+        # Uses its own session, shared by every caller waiting on this EAN
+        async with AsyncSessionLocal() as db:
+            mirrored = await db.get(models.OffMirrorProduct, ean)
+            if mirrored:
+                return "mirror", await self._insert(db, product_from_off(ean, {
+                    'product_name': mirrored.product_name,
+                    'ingredients_text': mirrored.ingredients_text,
+                    'nutriments': mirrored.nutriments or '{}',
+                    'brands': mirrored.brands,
+                    'categories': mirrored.categories,
+                    'image_url': mirrored.image_url,
+                }))
+
+            miss = await db.get(models.OffLookupMiss, ean)
+            if miss and datetime.utcnow() - miss.checked_at < self.negative_ttl:
+                self.negative_hits += 1
+                return "miss", None
+            if self.offline:
+                return "miss", None
+
+            off_product = await self._fetch(ean)
+            if off_product and off_product.get('status') == 1:
+                if miss:
+                    await db.delete(miss)
+                return "remote", await self._insert(db, product_from_off(ean, off_product['product']))
+
+            if miss:
+                miss.checked_at = datetime.utcnow()
+            else:
+                db.add(models.OffLookupMiss(ean=ean))
+            await db.commit()
+            return "remote", None
+
+    async def _fetch(self, ean):
+        """The Open Food Facts API record for `ean`, timed into off_lookup_seconds"""
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            off_product = await asyncio.wait_for(asyncio.to_thread(self.fetch, ean), self.timeout)
+            outcome = "found" if off_product and off_product.get('status') == 1 else "not_found"
+            return off_product
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise
+        except requests.RequestException:
+            outcome = "unreachable"
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            off_lookup_seconds.observe(elapsed, outcome=outcome)
+            record_span("off", elapsed)
+
+    async def _insert(self, db, product):
+        db.add(product)
+        try:
+            await db.flush()
+            # The ingest stages are synchronous; run_sync gives them this session's connection
+            await db.run_sync(ingest.process_products, [product.id])
+            await db.commit()
+        except IntegrityError:
+            # Another worker inserted the same EAN first
+            await db.rollback()
+            return await db.scalar(select(models.Product.id).where(models.Product.ean == product.ean))
+        return product.id
+
+    def stats(self):
+        return {
+            "latency": {source: histogram.summary() for source, histogram in self.latency.items()},
+            "negative_hits": self.negative_hits,
+            "coalesced": self._flights.shared,
+        }
+
+
+def _open(path):
+    return gzip.open(path, 'rt', encoding='utf-8') if path.endswith('.gz') else open(path, encoding='utf-8')
+
+
+def _iter_jsonl(path):
+    with _open(path) as f:
+        batch = []
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            batch.append({
+                'ean': str(record.get('code', '')).strip(),
+                'nutriments': json.dumps(record.get('nutriments') or {}),
+                **{field: record.get(field) for field in MIRROR_FIELDS},
+            })
+            if len(batch) >= MIRROR_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def _iter_csv(path):
+    # The Open Food Facts CSV export is tab-separated, unquoted, with one
+    # "<nutrient>_100g" column per nutriment
+    reader = pd.read_csv(
+        path, sep='\t', dtype=str, chunksize=MIRROR_BATCH_SIZE, quoting=csv.QUOTE_NONE,
+        on_bad_lines='skip', usecols=lambda c: c == 'code' or c in MIRROR_FIELDS or c.endswith('_100g')
+    )
+    for chunk in reader:
+        nutrient_columns = [c for c in chunk.columns if c.endswith('_100g')]
+        batch = []
+        for record in chunk.to_dict('records'):
+            batch.append({
+                'ean': str(record.get('code') or '').strip(),
+                'nutriments': json.dumps({
+                    c: value for c in nutrient_columns
+                    for value in (pd.to_numeric(record[c], errors='coerce'),) if not pd.isna(value)
+                }),
+                **{field: None if pd.isna(record.get(field)) else record.get(field) for field in MIRROR_FIELDS},
+            })
+        yield batch
+
+
+def load_mirror(path):
+    """Load an Open Food Facts JSONL or CSV dump (optionally gzipped) into the mirror table"""
+    models.Base.metadata.create_all(bind=engine)
+    stmt = dialect_insert(models.OffMirrorProduct.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['ean'],
+        set_={column: stmt.excluded[column] for column in ('nutriments', 'imported_at') + MIRROR_FIELDS}
+    )
+
+    batches = _iter_jsonl(path) if '.jsonl' in path or '.json' in path else _iter_csv(path)
+    loaded = 0
+    for batch in batches:
+        now = datetime.utcnow()
+        # One row per EAN; Postgres rejects a batch that upserts the same key twice
+        rows = list({row['ean']: dict(row, imported_at=now) for row in batch if row['ean'].isdigit()}.values())
+        if not rows:
+            continue
+        with engine.begin() as conn:
+            conn.execute(stmt, rows)
+        loaded += len(rows)
+        logger.info(f"Loaded {loaded} mirror products")
+    logger.info(f"Mirror load completed: {loaded} products")
+    return loaded
+
+
+resolver = ProductResolver(
+    negative_ttl=timedelta(hours=float(os.getenv("OFF_NEGATIVE_TTL_HOURS", "24"))),
+    timeout=float(os.getenv("OFF_TIMEOUT", "10")),
+    offline=os.getenv("OFF_OFFLINE", "") == "1",
+)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Manage the local Open Food Facts mirror")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    load = subparsers.add_parser("load-mirror", help="Load a JSONL or CSV dump, optionally .gz")
+    load.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "load-mirror":
+        load_mirror(args.path)
@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def normalize(value) -> str:
+    """Normalize a prompt input so cosmetic differences share a cache entry"""
+    return " ".join(str(value or "").split()).casefold()
+
+
+def cache_key(model_name, template, *inputs) -> str:
+    """Content address for a prompt: model, prompt template and normalized inputs"""
+    material = json.dumps([model_name, template, [normalize(value) for value in inputs]])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Persistent LLM response cache in a SQLite file.
+
+    Entries expire after `ttl` seconds and the least recently used ones are
+    evicted once the stored responses exceed `max_bytes`. Each entry records
+    how long the original generation took, so hits can be reported as model
+    latency saved.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, ttl=24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " generation_seconds REAL NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_responses_accessed_at ON responses (accessed_at)")
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.saved_seconds = 0.0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, size, generation_seconds, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            response, size, generation_seconds, created_at = row
+            if now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            self.saved_seconds += generation_seconds
+            return response
+
+    def put(self, key, response, generation_seconds=0.0):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, response, size, generation_seconds, now, now)
+            )
+            self._bytes += size - (old[0] if old else 0)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    # For async callers: the SQLite calls run in a worker thread, off the event loop
+
+    async def aget(self, key):
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key, response, generation_seconds=0.0):
+        await asyncio.to_thread(self.put, key, response, generation_seconds)
+
+    def _evict(self):
+        # Drop least recently used entries until the cache is back under 90% of its budget
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        for key, size in rows:
+            if self._bytes <= target:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "llm_calls_saved": self.hits,
+            "llm_seconds_saved": round(self.saved_seconds, 3),
+        }
+
+
+response_cache = ResponseCache(
+    os.getenv("LLM_CACHE_PATH", "./llm_cache.db"),
+    max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "64")) * 1024 * 1024),
+    ttl=float(os.getenv("LLM_CACHE_TTL_HOURS", "24")) * 3600,
+)
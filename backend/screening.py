@@ -0,0 +1,299 @@
+import json
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from database import batched
+import models
+from models import product_ingredients
+from ingredients import parse_ingredients, is_additive, additive_code
+from nutrition import NUTRIENTS, parse_nutrients
+
+# Allergen -> words that reveal it in an ingredient term, and terms that
+# contain those words without containing the allergen
+ALLERGENS = {
+    "milk": {
+        "words": ["milk", "milk solids", "whey", "casein", "caseinate", "lactose", "butter", "butter oil",
+                  "ghee", "cream", "cheese", "curd", "yoghurt", "yogurt", "paneer", "khoya", "buttermilk"],
+        "exclude": ["cocoa butter", "peanut butter", "shea butter", "coconut milk", "coconut cream",
+                    "almond milk", "soy milk", "soya milk", "oat milk", "cream of tartar"],
+    },
+    "gluten": {
+        "words": ["wheat", "maida", "atta", "semolina", "sooji", "suji", "rava", "barley", "rye", "malt",
+                  "malt extract", "gluten", "spelt", "seitan", "couscous", "bulgur", "triticale"],
+    },
+    "peanut": {"words": ["peanut", "groundnut"]},
+    "tree nuts": {
+        "words": ["almond", "badam", "cashew", "kaju", "walnut", "akhrot", "pistachio", "pista", "hazelnut",
+                  "pecan", "macadamia", "brazil nut", "pine nut", "chilgoza", "tree nut"],
+    },
+    "soy": {"words": ["soy", "soya", "soybean", "soyabean", "tofu", "edamame"]},
+    "egg": {"words": ["egg", "egg white", "egg yolk", "albumin", "ovalbumin", "mayonnaise"]},
+    "fish": {"words": ["fish", "anchovy", "tuna", "salmon", "sardine", "mackerel", "cod", "fish sauce"]},
+    "shellfish": {"words": ["shrimp", "prawn", "crab", "lobster", "crayfish", "shellfish"]},
+    "sesame": {"words": ["sesame", "til", "gingelly", "tahini"]},
+    "mustard": {"words": ["mustard"]},
+    "celery": {"words": ["celery"]},
+    "lupin": {"words": ["lupin", "lupine"]},
+    "sulphites": {
+        "words": ["sulphite", "sulfite", "metabisulphite", "metabisulfite", "sulphur dioxide", "sulfur dioxide"],
+        "additives": [f"ins {code}" for code in range(220, 229)],
+    },
+}
+
+# Ways users write an allergy, mapped to the allergens above
+ALLERGY_ALIASES = {
+    "dairy": ["milk"], "lactose": ["milk"], "lactose intolerance": ["milk"], "casein": ["milk"],
+    "wheat": ["gluten"], "celiac": ["gluten"], "coeliac": ["gluten"], "celiac disease": ["gluten"],
+    "coeliac disease": ["gluten"], "gluten intolerance": ["gluten"],
+    "peanuts": ["peanut"], "groundnut": ["peanut"],
+    "nuts": ["peanut", "tree nuts"], "nut": ["peanut", "tree nuts"], "tree nut": ["tree nuts"],
+    "soya": ["soy"], "soybean": ["soy"], "eggs": ["egg"], "seafood": ["fish", "shellfish"],
+    "crustaceans": ["shellfish"], "sulfites": ["sulphites"], "sulphite": ["sulphites"],
+}
+
+# Per 100 g thresholds from the UK front-of-pack traffic lights (medium, high)
+SUGAR = ("sugar_g", 5.0, 22.5, "sugar")
+FAT = ("fat_g", 3.0, 17.5, "fat")
+SATURATED_FAT = ("saturated_fat_g", 1.5, 5.0, "saturated fat")
+SODIUM = ("sodium_mg", 120.0, 600.0, "sodium")
+
+# Health condition -> nutrient limits, and ingredient words or additives to watch, with a severity
+CONDITIONS = {
+    "diabetes": {
+        "aliases": ["diabetic", "type 1 diabetes", "type 2 diabetes", "prediabetes", "blood sugar"],
+        "nutrients": [SUGAR],
+        "words": [("moderate", ["sugar", "glucose", "glucose syrup", "liquid glucose", "dextrose",
+                                "corn syrup", "invert sugar", "maltodextrin", "jaggery", "fructose", "honey"])],
+    },
+    "hypertension": {
+        "aliases": ["high blood pressure", "blood pressure", "bp"],
+        "nutrients": [SODIUM],
+        "words": [("moderate", ["monosodium glutamate"])],
+        "additives": [("moderate", ["ins 621"])],
+    },
+    "heart disease": {
+        "aliases": ["cholesterol", "high cholesterol", "cardiovascular disease", "heart"],
+        "nutrients": [SATURATED_FAT, ("trans_fat_g", 0.1, 0.5, "trans fat"), SODIUM],
+        "words": [("high", ["hydrogenated", "partially hydrogenated", "vanaspati", "interesterified"]),
+                  ("moderate", ["palm oil", "palmolein", "palm kernel oil"])],
+    },
+    "obesity": {
+        "aliases": ["overweight", "weight loss", "weight management"],
+        "nutrients": [("energy_kcal", 250.0, 400.0, "energy"), SUGAR, FAT],
+    },
+    "kidney disease": {
+        "aliases": ["ckd", "chronic kidney disease", "renal disease", "kidney"],
+        "nutrients": [SODIUM],
+        "additives": [("high", ["ins 338", "ins 339", "ins 340", "ins 341", "ins 343",
+                                "ins 450", "ins 451", "ins 452"])],
+    },
+    "phenylketonuria": {
+        "aliases": ["pku"],
+        "words": [("avoid", ["aspartame"])],
+        "additives": [("avoid", ["ins 951", "ins 962"])],
+    },
+}
+
+_CONDITION_NAMES = {
+    alias: name for name, rule in CONDITIONS.items() for alias in [name, *rule.get("aliases", [])]
+}
+
+SEVERITY_SCORE = {"avoid": 100, "high": 10, "moderate": 3}
+_VERDICTS = [("avoid", "avoid"), ("high", "limit"), ("moderate", "caution")]
+
+
+def _preferences(value):
+    """User preference lists are stored as JSON text"""
+    try:
+        items = json.loads(value) if value else []
+    except json.JSONDecodeError:
+        items = [value]
+    return [" ".join(str(item).casefold().split()) for item in items if str(item).strip()]
+
+
+def _words_pattern(words):
+    return r"\b(?:" + "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True)) + r")(?:e?s)?\b"
+
+
+class TermRule:
+    """Flags ingredient terms containing any of `words` or equal to one of `additives`"""
+
+    def __init__(self, kind, name, severity, words=(), additives=(), exclude=()):
+        self.kind = kind
+        self.name = name
+        self.severity = severity
+        self.pattern = _words_pattern(words) if words else None
+        self.exclude = _words_pattern(exclude) if exclude else None
+        self.additives = list(additives)
+
+    def match(self, vocabulary):
+        """Boolean array over a Series of distinct ingredient terms"""
+        hits = np.zeros(len(vocabulary), dtype=bool)
+        if self.pattern:
+            hits |= vocabulary.str.contains(self.pattern, regex=True).to_numpy()
+        if self.exclude:
+            # A term like "cocoa butter" still counts when it also names the allergen elsewhere
+            excluded = vocabulary.str.replace(self.exclude, " ", regex=True)
+            hits &= excluded.str.contains(self.pattern, regex=True).to_numpy()
+        if self.additives:
+            hits |= vocabulary.isin(self.additives).to_numpy()
+        return hits
+
+
+@lru_cache(maxsize=1024)
+def compile_profile(allergies, conditions):
+    """Screening rules for one combination of allergies and conditions.
+
+    Cached, since many users share the same few preferences. Returns
+    (term rules, nutrient rules, unrecognized preferences); nutrient rules are
+    (condition, nutrient, moderate limit, high limit, label) tuples.
+    """
+    allergens, unrecognized = [], []
+    custom = []
+    named_conditions = []
+    for allergy in allergies:
+        if allergy in ALLERGENS:
+            allergens.append(allergy)
+        elif allergy in ALLERGY_ALIASES:
+            allergens.extend(ALLERGY_ALIASES[allergy])
+        else:
+            # Anything else is matched literally, so "kiwi" still flags kiwi
+            custom.append(allergy)
+    for condition in conditions:
+        if condition in _CONDITION_NAMES:
+            named_conditions.append(_CONDITION_NAMES[condition])
+        elif condition in ALLERGY_ALIASES or condition in ALLERGENS:
+            allergens.extend(ALLERGY_ALIASES.get(condition, [condition]))
+        else:
+            unrecognized.append(condition)
+
+    term_rules = []
+    for allergen in dict.fromkeys(allergens):
+        rule = ALLERGENS[allergen]
+        term_rules.append(TermRule(
+            "allergen", allergen, "avoid", rule["words"], rule.get("additives", ()), rule.get("exclude", ())
+        ))
+    for allergy in dict.fromkeys(custom):
+        term_rules.append(TermRule("allergen", allergy, "avoid", words=[allergy]))
+
+    nutrient_rules = []
+    for condition in dict.fromkeys(named_conditions):
+        rule = CONDITIONS[condition]
+        for severity, words in rule.get("words", []):
+            term_rules.append(TermRule("condition", condition, severity, words=words))
+        for severity, additives in rule.get("additives", []):
+            term_rules.append(TermRule("condition", condition, severity, additives=additives))
+        for nutrient, moderate, high, label in rule.get("nutrients", []):
+            nutrient_rules.append((condition, nutrient, moderate, high, label))
+    return term_rules, nutrient_rules, unrecognized
+
+
+def _product_terms(db, products):
+    """DataFrame of (row, term): each product's position in `products` and its ingredient terms"""
+    position = {product.id: row for row, product in enumerate(products)}
+    rows = []
+    ids = list(position)
+    for batch in batched(ids):
+        rows.extend(db.execute(
+            select(product_ingredients.c.product_id, models.Ingredient.name)
+            .join(models.Ingredient, models.Ingredient.id == product_ingredients.c.ingredient_id)
+            .where(product_ingredients.c.product_id.in_(batch))
+            .order_by(product_ingredients.c.product_id, product_ingredients.c.position)
+        ).all())
+    frame = pd.DataFrame(rows, columns=["product_id", "term"])
+    frame["row"] = frame["product_id"].map(position)
+
+    # Products the ingredient index has not seen yet are parsed here
+    indexed = set(frame["product_id"])
+    extra = [
+        (row, term)
+        for row, product in enumerate(products) if product.id not in indexed
+        for term in parse_ingredients(product.ingredients)
+    ]
+    if extra:
+        frame = pd.concat([frame[["row", "term"]], pd.DataFrame(extra, columns=["row", "term"])])
+    return frame[["row", "term"]].reset_index(drop=True)
+
+
+def _nutrient_matrix(products):
+    """products x NUTRIENTS array of per-100 g values, NaN where unknown"""
+    matrix = np.full((len(products), len(NUTRIENTS)), np.nan)
+    for row, product in enumerate(products):
+        for nutrient, value in parse_nutrients(product.nutritional_info).items():
+            matrix[row, NUTRIENTS.index(nutrient)] = value
+    return matrix
+
+
+def screen_products(db, products, allergies, conditions):
+    """Screen products against a user's allergies and health conditions.
+
+    Every rule is evaluated once over the distinct ingredient terms of the
+    whole list and once over its nutrient matrix, so a page of products
+    costs a handful of array operations rather than a pass per product.
+    Returns (results ranked safest first, unrecognized preferences); each
+    result carries a verdict, a score and the flags that produced it.
+    """
+    term_rules, nutrient_rules, unrecognized = compile_profile(tuple(allergies), tuple(conditions))
+    flags = [[] for _ in products]
+    scores = np.zeros(len(products))
+
+    terms = _product_terms(db, products) if term_rules and products else None
+    if terms is not None and len(terms):
+        codes, vocabulary = pd.factorize(terms["term"])
+        vocabulary = pd.Series(vocabulary, dtype=object)
+        term_hits = np.column_stack([rule.match(vocabulary) for rule in term_rules])[codes]
+        for column, rule in enumerate(term_rules):
+            # First matching term per product, in label order
+            matched = terms[term_hits[:, column]].drop_duplicates("row")
+            scores[matched["row"].to_numpy()] += SEVERITY_SCORE[rule.severity]
+            for row, term in zip(matched["row"], matched["term"]):
+                flags[row].append({
+                    "type": rule.kind, "name": rule.name, "severity": rule.severity,
+                    "reason": f"contains {additive_code(term) if is_additive(term) else term}",
+                })
+
+    if nutrient_rules and products:
+        nutrients = _nutrient_matrix(products)
+        for condition, nutrient, moderate, high, label in nutrient_rules:
+            values = nutrients[:, NUTRIENTS.index(nutrient)]
+            with np.errstate(invalid="ignore"):
+                levels = np.where(values >= high, 2, np.where(values >= moderate, 1, 0))
+            scores += np.where(levels == 2, SEVERITY_SCORE["high"], 0)
+            scores += np.where(levels == 1, SEVERITY_SCORE["moderate"], 0)
+            unit = "kcal" if nutrient == "energy_kcal" else nutrient.rsplit("_", 1)[1]
+            for row in np.flatnonzero(levels):
+                flags[row].append({
+                    "type": "condition", "name": condition,
+                    "severity": "high" if levels[row] == 2 else "moderate",
+                    "reason": f"{label} {values[row]:g} {unit} per 100 g",
+                })
+
+    results = []
+    for row, product in enumerate(products):
+        severities = {flag["severity"] for flag in flags[row]}
+        verdict = next((verdict for severity, verdict in _VERDICTS if severity in severities), "ok")
+        results.append({
+            "ean": product.ean, "name": product.name, "brand": product.brand,
+            "image_url": product.image_url, "verdict": verdict,
+            "score": int(scores[row]), "flags": flags[row],
+        })
+    # Stable, so equally safe products keep the caller's order
+    order = np.argsort(scores, kind="stable")
+    return [results[row] for row in order], unrecognized
+
+
+def screen_for_user(db, user, products):
+    """Screening response for a user's stored preferences"""
+    allergies = _preferences(user.allergies)
+    conditions = _preferences(user.health_conditions)
+    results, unrecognized = screen_products(db, products, allergies, conditions)
+    return {
+        "allergies": allergies,
+        "health_conditions": conditions,
+        "unrecognized": unrecognized,
+        "products": results,
+    }
@@ -0,0 +1,288 @@
+import base64
+import json
+import re
+from sqlalchemy import text
+
+import models
+import nutrition_index
+
+# Relative weight of a match in each indexed column (name, brand, category, ingredients)
+COLUMN_WEIGHTS = (10.0, 5.0, 2.0, 1.0)
+# Spelling alternatives considered per query term
+MAX_TYPO_CANDIDATES = 5
+
+_SQLITE_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, brand, category, ingredients,
+        content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts_vocab USING fts5vocab(products_fts, 'row')",
+    # External-content triggers keep the index in step with every write to
+    # products: the CSV importer, Open Food Facts inserts and manual edits.
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, brand, category, ingredients)
+        VALUES (new.id, new.name, new.brand, new.category, new.ingredients);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, brand, category, ingredients)
+        VALUES ('delete', old.id, old.name, old.brand, old.category, old.ingredients);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, brand, category, ingredients)
+        VALUES ('delete', old.id, old.name, old.brand, old.category, old.ingredients);
+        INSERT INTO products_fts(rowid, name, brand, category, ingredients)
+        VALUES (new.id, new.name, new.brand, new.category, new.ingredients);
+    END
+    """,
+]
+
+_POSTGRES_DDL = [
+    """
+    ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(brand, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(category, '')), 'C') ||
+        setweight(to_tsvector('simple', coalesce(ingredients, '')), 'D')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_products_search_vector ON products USING GIN (search_vector)",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING GIN (name gin_trgm_ops)",
+]
+
+
+def ensure_index(engine):
+    """Create the full-text index for the engine's dialect, building it on first use"""
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'")
+            ).first()
+            for statement in _SQLITE_DDL:
+                conn.execute(text(statement))
+            if not exists:
+                conn.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+        elif engine.dialect.name == "postgresql":
+            for statement in _POSTGRES_DDL:
+                conn.execute(text(statement))
+
+
+def rebuild_index(engine):
+    """Rebuild the SQLite index from scratch (Postgres keeps a generated column)"""
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+
+
+def encode_cursor(**position) -> str:
+    raw = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, keys=("id",)) -> dict:
+    """The position encoded by encode_cursor; ValueError unless every one
+    of `keys` holds a number and the id an integer"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    # Valid base64 JSON can still be a number, a list or an object with other keys
+    if not isinstance(position, dict) or not isinstance(position.get("id"), int) \
+            or not all(isinstance(position.get(key), (int, float)) for key in keys):
+        raise ValueError("Invalid cursor")
+    return position
+
+
+def tokenize(query: str):
+    return [term for term in re.findall(r"[^\W_]+", query.casefold()) if term]
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance, giving up early once it exceeds `limit`"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _typo_candidates(db, term):
+    """Indexed terms within one or two edits of `term` that share its first letter"""
+    if len(term) < 4:
+        return []
+    known = db.execute(
+        text("SELECT 1 FROM products_fts_vocab WHERE term >= :term AND term < :upper LIMIT 1"),
+        {"term": term, "upper": term + "\uffff"}
+    ).first()
+    if known:
+        return []
+    limit = 1 if len(term) < 8 else 2
+    rows = db.execute(
+        text("SELECT term, doc FROM products_fts_vocab WHERE term >= :lower AND term < :upper"),
+        {"lower": term[0], "upper": term[0] + "\uffff"}
+    ).fetchall()
+    scored = sorted(
+        (distance, -doc, candidate)
+        for candidate, doc in rows
+        for distance in (edit_distance(term, candidate, limit),)
+        if distance <= limit
+    )
+    return [candidate for _, _, candidate in scored[:MAX_TYPO_CANDIDATES]]
+
+
+def _fts_query(db, terms):
+    groups = []
+    for term in terms:
+        options = [f'"{term}"*'] + [f'"{candidate}"' for candidate in _typo_candidates(db, term)]
+        groups.append(options[0] if len(options) == 1 else "(" + " OR ".join(options) + ")")
+    return " AND ".join(groups)
+
+
+def _load(db, ids):
+    products = {p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(ids))}
+    return [products[i] for i in ids if i in products]
+
+
+def _search_sqlite(db, terms, limit, after, offset, filters):
+    weights = ", ".join(str(w) for w in COLUMN_WEIGHTS)
+    params = {"match": _fts_query(db, terms), "limit": limit, "offset": offset}
+    nutrient_filter, nutrient_params = nutrition_index.filter_sql(filters)
+    params.update(nutrient_params)
+    keyset = ""
+    if after:
+        keyset = "AND (score > :score OR (score = :score AND id > :id))"
+        params.update(score=after["score"], id=after["id"])
+    rows = db.execute(text(f"""
+        SELECT id, score FROM (
+            SELECT products.id AS id, bm25(products_fts, {weights}) AS score
+            FROM products_fts JOIN products ON products.id = products_fts.rowid
+            WHERE products_fts MATCH :match
+              AND products.ean IS NOT NULL AND products.ean != ''
+              {nutrient_filter}
+        )
+        WHERE 1 = 1 {keyset}
+        ORDER BY score, id
+        LIMIT :limit OFFSET :offset
+    """), params).fetchall()
+    return rows
+
+
+def _search_postgres(db, terms, limit, after, offset, filters):
+    # ts_rank is "higher is better"; negate it so both dialects page ascending
+    params = {
+        "tsquery": " & ".join(f"{term}:*" for term in terms),
+        "raw": " ".join(terms),
+        "limit": limit,
+        "offset": offset,
+    }
+    nutrient_filter, nutrient_params = nutrition_index.filter_sql(filters, column="id")
+    params.update(nutrient_params)
+    keyset = ""
+    if after:
+        keyset = "AND (score > :score OR (score = :score AND id > :id))"
+        params.update(score=after["score"], id=after["id"])
+    rows = db.execute(text(f"""
+        SELECT id, score FROM (
+            SELECT id,
+                   -(ts_rank_cd(search_vector, to_tsquery('simple', :tsquery))
+                     + word_similarity(:raw, name)) AS score
+            FROM products
+            WHERE (search_vector @@ to_tsquery('simple', :tsquery) OR :raw <% name)
+              AND ean IS NOT NULL AND ean != ''
+              {nutrient_filter}
+        ) ranked
+        WHERE 1 = 1 {keyset}
+        ORDER BY score, id
+        LIMIT :limit OFFSET :offset
+    """), params).fetchall()
+    return rows
+
+
+def search(db, query, limit=10, cursor=None, offset=0, filters=()):
+    """Ranked full-text search over name, brand, category and ingredients.
+
+    Terms are prefix-matched and, when a term is not in the index at all,
+    expanded with close spellings. `filters` are parsed nutrient filters
+    (see nutrition_index.parse_filter) every result must satisfy. Returns
+    `(products, next_cursor)`; pass the cursor back to fetch the following
+    page. `offset` is only applied without a cursor, for clients that still
+    page by offset.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return browse(db, limit, cursor, offset, filters)
+    after = decode_cursor(cursor, ("score", "id")) if cursor else None
+    offset = 0 if cursor else offset
+    if db.get_bind().dialect.name == "postgresql":
+        rows = _search_postgres(db, terms, limit, after, offset, filters)
+    else:
+        rows = _search_sqlite(db, terms, limit, after, offset, filters)
+    next_cursor = None
+    # rows is empty for limit=0
+    if rows and len(rows) == limit:
+        next_cursor = encode_cursor(score=rows[-1].score, id=rows[-1].id)
+    return _load(db, [row.id for row in rows]), next_cursor
+
+
+def browse(db, limit=10, cursor=None, offset=0, filters=(), sort=None):
+    """Catalog listing with keyset pagination.
+
+    In id order by default; `sort` is a (nutrient, descending) pair from
+    nutrition_index.parse_sort, which lists only products with a value for
+    that nutrient. `filters` are parsed nutrient filters.
+    """
+    query = (
+        db.query(models.Product)
+        .filter(models.Product.ean.isnot(None))
+        .filter(models.Product.ean != '')
+    )
+    if filters or sort:
+        facts = models.NutritionFacts
+        query = query.join(facts, facts.product_id == models.Product.id).filter(
+            *nutrition_index.filter_clauses(filters)
+        )
+    if sort:
+        nutrient, descending = sort
+        column = getattr(models.NutritionFacts, nutrient)
+        query = query.filter(column.isnot(None)).order_by(
+            column.desc() if descending else column, models.Product.id
+        )
+        if cursor:
+            after = decode_cursor(cursor, ("value", "id"))
+            beyond = column < after["value"] if descending else column > after["value"]
+            query = query.filter(beyond | ((column == after["value"]) & (models.Product.id > after["id"])))
+        elif offset:
+            query = query.offset(offset)
+        rows = query.add_columns(column).limit(limit).all()
+        products = [product for product, _ in rows]
+        next_cursor = encode_cursor(value=rows[-1][1], id=rows[-1][0].id) if rows and len(rows) == limit else None
+        return products, next_cursor
+
+    query = query.order_by(models.Product.id)
+    if cursor:
+        query = query.filter(models.Product.id > decode_cursor(cursor)["id"])
+    elif offset:
+        query = query.offset(offset)
+    products = query.limit(limit).all()
+    next_cursor = encode_cursor(id=products[-1].id) if products and len(products) == limit else None
+    return products, next_cursor
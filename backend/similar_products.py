@@ -0,0 +1,338 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+
+from database import SessionLocal, batched, engine
+import models
+from embeddings import create_embeddings, embed_array, embedding_name
+from nutrition import NUTRIENTS, nutrition_score
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "products.faiss"
+META_FILE = "meta.json"
+# Characters of the ingredient list embedded; long lists would otherwise drown out the name
+INGREDIENT_CHARS = 600
+# HNSW graph degree and search breadth: higher is more accurate and slower
+HNSW_M = int(os.getenv("SIMILAR_HNSW_M", "32"))
+EF_SEARCH = int(os.getenv("SIMILAR_EF_SEARCH", "64"))
+# Most similar products considered when re-ranking by nutrition score
+RERANK_POOL = int(os.getenv("SIMILAR_RERANK_POOL", "50"))
+# Share of dead vectors at which `update` compacts the index
+MAX_DEAD_SHARE = float(os.getenv("SIMILAR_MAX_DEAD_SHARE", "0.2"))
+
+
+def product_text(name, category, ingredients):
+    # The name goes in twice so a short name still counts next to a long ingredient list
+    return "\n".join(filter(None, (name, category, name, (ingredients or "")[:INGREDIENT_CHARS])))
+
+
+class SimilarProductIndex:
+    """HNSW index over product embeddings, persisted on disk.
+
+    Embeddings live in the product_vectors table, written by the ingest
+    stage in the transaction that imports the products, so the index file
+    is only a cache of them: `catch_up()` adds rows newer than the file,
+    and a missing file is rebuilt from the table, neither re-embedding
+    anything. HNSW cannot delete, so a re-embedded product leaves its old
+    vector behind as a tombstone: its id is gone from the table and search
+    skips it. `compact()` drops tombstones by rebuilding from the table.
+    The server adds new rows with `refresh()`, off the event loop, and
+    requests only search.
+    """
+
+    def __init__(self, path, embeddings=None):
+        self.path = path
+        self._embeddings = embeddings
+        self.index = None
+        # Highest product_vectors id in the index, and rows in that table when last counted
+        self.covered = 0
+        self.live = 0
+        self.dirty = False
+        # FAISS cannot search while vectors are added; both happen under this lock
+        self._lock = threading.Lock()
+        self._refreshing = asyncio.Lock()
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            self._embeddings = create_embeddings(os.getenv("SIMILAR_EMBEDDING_BACKEND", "local"))
+        return self._embeddings
+
+    @property
+    def embedder(self):
+        return embedding_name(self.embeddings)
+
+    @property
+    def loaded(self) -> bool:
+        return self.index is not None
+
+    def text_hash(self, text):
+        return hashlib.blake2b(f"{self.embedder}\n{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+    def embed_products(self, db, product_ids):
+        """Embed the products whose text changed into product_vectors.
+
+        Runs inside the caller's transaction. A changed product gets a new
+        row, and so a new FAISS label, rather than an update in place.
+        """
+        vectors = models.ProductVector.__table__
+        for batch in batched(product_ids):
+            stored = dict(db.execute(
+                select(vectors.c.product_id, vectors.c.text_hash).where(vectors.c.product_id.in_(batch))
+            ).all())
+            changed = []
+            for product_id, name, category, ingredients in db.execute(
+                select(models.Product.id, models.Product.name, models.Product.category, models.Product.ingredients)
+                .where(models.Product.id.in_(batch))
+            ):
+                text = product_text(name, category, ingredients)
+                text_hash = self.text_hash(text)
+                if stored.get(product_id) != text_hash:
+                    changed.append((product_id, text, text_hash))
+            if not changed:
+                continue
+            embedded = embed_array(self.embeddings, [text for _, text, _ in changed])
+            db.execute(vectors.delete().where(vectors.c.product_id.in_([product_id for product_id, _, _ in changed])))
+            db.execute(vectors.insert(), [
+                {"product_id": product_id, "text_hash": text_hash, "embedding": vector.tobytes()}
+                for (product_id, _, text_hash), vector in zip(changed, embedded)
+            ])
+
+    def _new_index(self, dim):
+        index = faiss.IndexIDMap(faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT))
+        faiss.downcast_index(index.index).hnsw.efSearch = EF_SEARCH
+        return index
+
+    def _add_rows(self, rows):
+        with self._lock:
+            ids, embeddings = [], []
+            for vector_id, embedding in rows:
+                # A concurrent catch-up may have added the row since it was read
+                if vector_id > self.covered:
+                    ids.append(vector_id)
+                    embeddings.append(np.frombuffer(embedding, dtype=np.float32))
+            if not ids:
+                return 0
+            matrix = np.vstack(embeddings)
+            if self.index is None:
+                self.index = self._new_index(matrix.shape[1])
+            self.index.add_with_ids(matrix, np.asarray(ids, dtype=np.int64))
+            self.covered = ids[-1]
+            self.dirty = True
+            return len(ids)
+
+    def _newer_rows(self, batch_size):
+        vectors = models.ProductVector.__table__
+        return (
+            select(vectors.c.id, vectors.c.embedding).where(vectors.c.id > self.covered)
+            .order_by(vectors.c.id).limit(batch_size)
+        )
+
+    def _live_count(self):
+        return select(func.count(models.ProductVector.id))
+
+    def catch_up(self, db, batch_size=5000):
+        """Add vectors written since the index was saved; returns how many"""
+        added = 0
+        while True:
+            rows = db.execute(self._newer_rows(batch_size)).all()
+            added += self._add_rows(rows)
+            if len(rows) < batch_size:
+                break
+        if added:
+            # New rows may replace older ones, which turns those into tombstones
+            self.live = db.scalar(self._live_count())
+        return added
+
+    async def refresh(self, session_factory, batch_size=1000):
+        """`catch_up` for the server: reads through an async session and adds
+        in a worker thread. Returns at once while another refresh runs."""
+        if self._refreshing.locked():
+            return 0
+        async with self._refreshing:
+            added = 0
+            async with session_factory() as db:
+                while True:
+                    rows = (await db.execute(self._newer_rows(batch_size))).all()
+                    added += await asyncio.to_thread(self._add_rows, rows)
+                    if len(rows) < batch_size:
+                        break
+                if added:
+                    self.live = await db.scalar(self._live_count())
+            return added
+
+    def compact(self, db):
+        """Rebuild the index from product_vectors, dropping tombstones"""
+        self.index, self.covered, self.live = None, 0, 0
+        added = self.catch_up(db)
+        self.dirty = True
+        return added
+
+    def load(self, db) -> bool:
+        """Open the saved index and add what was imported since; False if nothing is indexed"""
+        index_path = os.path.join(self.path, INDEX_FILE)
+        meta_path = os.path.join(self.path, META_FILE)
+        if os.path.exists(index_path) and os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["embedder"] != self.embedder:
+                logger.warning(f"Similar-products index was built with {meta['embedder']}; "
+                               f"run `python similar_products.py rebuild`")
+                return False
+            newest = db.scalar(select(func.max(models.ProductVector.id))) or 0
+            # A file ahead of the table belongs to another database
+            if meta["covered"] <= newest:
+                self.index = faiss.read_index(index_path)
+                self.covered = meta["covered"]
+                self.live = db.scalar(self._live_count())
+                self.dirty = False
+                self.catch_up(db)
+                return True
+        # No usable file: the vectors are in the database, so this embeds nothing
+        self.compact(db)
+        return self.loaded
+
+    def save(self):
+        if self.index is None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        index_path = os.path.join(self.path, INDEX_FILE)
+        faiss.write_index(self.index, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+        with open(os.path.join(self.path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"embedder": self.embedder, "covered": self.covered}, f)
+        self.dirty = False
+
+    def _query_vector(self, db, product):
+        embedding = db.scalar(
+            select(models.ProductVector.embedding).where(models.ProductVector.product_id == product.id)
+        )
+        if embedding is not None:
+            return np.frombuffer(embedding, dtype=np.float32)[None, :]
+        return embed_array(self.embeddings, [product_text(product.name, product.category, product.ingredients)])
+
+    def _near_duplicates(self, db, product_id):
+        """The product and its near-duplicate cluster, which are no alternative to it"""
+        fingerprints = models.ProductFingerprint
+        cluster = select(fingerprints.cluster_id).where(fingerprints.product_id == product_id).scalar_subquery()
+        return {product_id, *db.scalars(select(fingerprints.product_id).where(fingerprints.cluster_id == cluster))}
+
+    def similar(self, db, product, k=10, rerank=None):
+        """Up to k products most like `product`, as dicts with their cosine
+        similarity and nutrition score. With rerank="nutrition" the
+        RERANK_POOL most similar are ordered healthiest first instead."""
+        if not self.loaded or self.index.ntotal == 0:
+            return []
+        excluded = self._near_duplicates(db, product.id)
+        wanted = max(k, RERANK_POOL) if rerank == "nutrition" else k
+        # Tombstones and near-duplicates take places in the raw results
+        fetch = min(int(self.index.ntotal), int((wanted + len(excluded)) * self.index.ntotal / max(self.live, 1)) + 10)
+        query = self._query_vector(db, product)
+        with self._lock:
+            scores, ids = self.index.search(query, fetch)
+        similarity = {int(vector_id): float(score) for score, vector_id in zip(scores[0], ids[0]) if vector_id >= 0}
+
+        # Plain columns rather than ORM objects: this is the endpoint's hot path
+        facts = models.NutritionFacts.__table__
+        columns = (models.Product.ean, models.Product.name, models.Product.brand, models.Product.category,
+                   models.Product.image_url)
+        rows = []
+        for batch in batched(similarity):
+            rows.extend(db.execute(
+                select(models.ProductVector.id, models.Product.id, *columns, *(facts.c[name] for name in NUTRIENTS))
+                .join(models.Product, models.Product.id == models.ProductVector.product_id)
+                .outerjoin(facts, facts.c.product_id == models.Product.id)
+                .where(models.ProductVector.id.in_(batch))
+            ).all())
+        rows = sorted((row for row in rows if row[1] not in excluded), key=lambda row: -similarity[row[0]])[:wanted]
+
+        results = []
+        for row in rows:
+            values = dict(zip(NUTRIENTS, row[2 + len(columns):]))
+            results.append({
+                **{column.key: value for column, value in zip(columns, row[2:2 + len(columns)])},
+                "similarity": round(similarity[row[0]], 4),
+                "nutrition_score": nutrition_score(values),
+            })
+        if rerank == "nutrition":
+            # Products without a score go last, in similarity order
+            results.sort(key=lambda r: (r["nutrition_score"] is None, r["nutrition_score"] or 0, -r["similarity"]))
+        return results[:k]
+
+    def stats(self):
+        if not self.loaded:
+            return {"loaded": False}
+        return {
+            "loaded": True,
+            "vectors": int(self.index.ntotal),
+            "products": self.live,
+            "tombstones": max(int(self.index.ntotal) - self.live, 0),
+            "embedder": self.embedder,
+        }
+
+
+similar = SimilarProductIndex(os.getenv("SIMILAR_INDEX_DIR", "./similar_index"))
+
+
+def index_products(db, product_ids):
+    """Ingest stage: embed new and changed products; the server's index picks them up"""
+    similar.embed_products(db, product_ids)
+
+
+def update(rebuild=False, batch_size=2000):
+    """Embed every product that changed, or all of them with `rebuild`,
+    then bring the index file up to date, compacting it when tombstones
+    pile up"""
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        if rebuild:
+            db.execute(models.ProductVector.__table__.delete())
+            db.commit()
+        last_id, done = 0, 0
+        while True:
+            ids = db.execute(
+                select(models.Product.id).where(models.Product.id > last_id)
+                .order_by(models.Product.id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            similar.embed_products(db, ids)
+            db.commit()
+            last_id = ids[-1]
+            done += len(ids)
+            logger.info(f"Embedded {done} products")
+
+        if rebuild:
+            similar.compact(db)
+        else:
+            similar.load(db)
+            stats = similar.stats()
+            if stats["loaded"] and stats["tombstones"] / stats["vectors"] > MAX_DEAD_SHARE:
+                similar.compact(db)
+        similar.save()
+        return similar.stats()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build or update the similar-products index")
+    parser.add_argument("command", choices=["update", "rebuild"])
+    parser.add_argument("--batch-size", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(update(args.command == "rebuild", args.batch_size))
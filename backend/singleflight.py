@@ -0,0 +1,42 @@
+import asyncio
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one in-flight task.
+
+    The first caller for a key starts the work; every caller that arrives
+    while it is still running awaits the same task instead of starting its
+    own. The task is shielded, so a disconnecting caller does not cancel
+    the work for everyone else.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.started = 0
+        self.shared = 0
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def in_flight(self, key) -> bool:
+        return key in self._inflight
+
+    async def do(self, key, fn):
+        """Run `fn()` (a coroutine function) once per key at a time"""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.shared += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        self.started += 1
+        task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved; the callers re-raise it themselves
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,49 @@
+import asyncio
+import contextlib
+import json
+
+from fastapi.responses import StreamingResponse
+
+
+def sse_event(data, event=None) -> str:
+    """One Server-Sent Event with a JSON payload"""
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def single_chunk(text):
+    """A stored text as a one-chunk stream, for serving cached results through the same interface"""
+    yield text
+
+
+async def _events(request, chunks, on_complete):
+    parts = []
+    async with contextlib.aclosing(chunks):
+        try:
+            async for chunk in chunks:
+                if await request.is_disconnected():
+                    # Leaving the block closes the chunk stream and the model call behind it
+                    return
+                parts.append(chunk)
+                yield sse_event({"text": chunk})
+            done = await on_complete("".join(parts)) if on_complete else None
+            yield sse_event(done or {}, event="done")
+        except asyncio.TimeoutError:
+            yield sse_event({"detail": "The model did not respond in time"}, event="error")
+        except Exception as e:
+            yield sse_event({"detail": str(e)}, event="error")
+
+
+def sse_response(request, chunks, on_complete=None):
+    """Stream text chunks as SSE: a "message" event per chunk, then "done" or "error".
+
+    `on_complete(full_text)` runs once the stream finishes and its result is
+    the payload of the "done" event. If the client disconnects, the chunk
+    stream is closed without calling it.
+    """
+    return StreamingResponse(
+        _events(request, chunks, on_complete),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,206 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import and_, func, or_, select
+
+from database import AsyncSessionLocal, SessionLocal, engine
+import models
+from analysis_engine import ANALYSIS_MAX_AGE, analysis_version, is_error, store_analysis_async
+from analysis_store import ensure_schema
+from llm_client import RateLimiter
+from vector_store import analyze_product, llm
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT = "warm-analyses.checkpoint.json"
+PAGE_SIZE = 200
+PROGRESS_INTERVAL = 10.0
+
+
+class WarmCheckpoint:
+    """Progress file that lets an interrupted warm-up resume after its last finished page"""
+
+    def __init__(self, path, filters):
+        self.path = path
+        self.filters = filters
+        self.state = {"last_id": 0, "generated": 0, "failed": 0}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            saved = json.load(f)
+        # A checkpoint only applies to a run with the same filters
+        if saved.get("filters") == self.filters:
+            self.state = saved["state"]
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({"filters": self.filters, "state": self.state}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def stale_products(db, category=None, brand=None, expiring_within=timedelta(0)):
+    """Query for ids of products needing an analysis, in id order.
+
+    A product is stale when it has no analysis, when it changed after its
+    latest analysis, when that analysis came from another model or prompt
+    version, or when it expires under the freshness policy within
+    `expiring_within`. Members of a near-duplicate cluster are left out:
+    they share their canonical product's analysis.
+    """
+    latest = (
+        select(models.Analysis.product_id, func.max(models.Analysis.created_at).label("analyzed_at"))
+        .group_by(models.Analysis.product_id)
+        .subquery()
+    )
+    model_version, prompt_version = analysis_version()
+    cutoff = datetime.utcnow() - ANALYSIS_MAX_AGE + expiring_within
+    query = (
+        db.query(models.Product.id)
+        .outerjoin(latest, latest.c.product_id == models.Product.id)
+        .outerjoin(models.Analysis, and_(
+            models.Analysis.product_id == latest.c.product_id,
+            models.Analysis.created_at == latest.c.analyzed_at,
+        ))
+        .outerjoin(models.ProductFingerprint, models.ProductFingerprint.product_id == models.Product.id)
+        .filter(or_(
+            models.ProductFingerprint.cluster_id.is_(None),
+            models.ProductFingerprint.cluster_id == models.Product.id,
+        ))
+        .filter(or_(
+            latest.c.analyzed_at.is_(None),
+            latest.c.analyzed_at < cutoff,
+            models.Product.updated_at > latest.c.analyzed_at,
+            models.Analysis.model_version.is_distinct_from(model_version),
+            models.Analysis.prompt_version.is_distinct_from(prompt_version),
+        ))
+        # Two analyses stored in the same instant would otherwise list the product twice
+        .distinct()
+    )
+    if category:
+        query = query.filter(models.Product.category.ilike(f"%{category}%"))
+    if brand:
+        query = query.filter(models.Product.brand.ilike(f"%{brand}%"))
+    return query
+
+
+async def _warm_product(product_id):
+    """Generate and store one analysis; False if the model reported an error"""
+    # No connection is held while the model runs, so concurrency is not bounded by the pool
+    async with AsyncSessionLocal() as db:
+        product = await db.get(models.Product, product_id)
+    text = await analyze_product(product.name, product.ingredients, route="warm")
+    if is_error(text):
+        logger.warning(f"{product.ean}: {text}")
+        return False
+    async with AsyncSessionLocal() as db:
+        await store_analysis_async(db, product, product.name, text)
+    return True
+
+
+def _progress(done, total, started):
+    elapsed = time.monotonic() - started
+    rate = done / elapsed * 60 if elapsed else 0.0
+    eta = timedelta(seconds=int((total - done) / rate * 60)) if rate else "unknown"
+    percent = done / total * 100 if total else 100.0
+    return f"{done}/{total} products ({percent:.1f}%), {rate:.1f}/min, ETA {eta}"
+
+
+async def warm(category=None, brand=None, concurrency=4, rate=None, expiring_within_hours=0.0,
+               limit=None, checkpoint_path=DEFAULT_CHECKPOINT, resume=True):
+    """(Re)generate analyses for every stale product matching the filters"""
+    if rate:
+        llm.rate_limiter = RateLimiter(requests_per_minute=rate)
+    expiring_within = timedelta(hours=expiring_within_hours)
+    checkpoint = WarmCheckpoint(checkpoint_path, {
+        "category": category, "brand": brand, "expiring_within_hours": expiring_within_hours
+    })
+    if resume:
+        checkpoint.load()
+        if checkpoint.state["last_id"]:
+            logger.info(f"Resuming after product id {checkpoint.state['last_id']}")
+    state = checkpoint.state
+
+    db = SessionLocal()
+    try:
+        total = stale_products(db, category, brand, expiring_within).filter(
+            models.Product.id > state["last_id"]
+        ).count()
+    finally:
+        db.close()
+    if limit is not None:
+        total = min(total, limit)
+    logger.info(f"{total} products to warm")
+
+    slots = asyncio.Semaphore(concurrency)
+    done = 0
+    started = last_report = time.monotonic()
+
+    async def run(product_id):
+        nonlocal done, last_report
+        async with slots:
+            ok = await _warm_product(product_id)
+        state["generated" if ok else "failed"] += 1
+        done += 1
+        if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            logger.info(_progress(done, total, started))
+
+    while done < total:
+        db = SessionLocal()
+        try:
+            # Ids after the checkpoint, so products that keep failing are not retried in a loop
+            page = [
+                product_id for (product_id,) in
+                stale_products(db, category, brand, expiring_within)
+                .filter(models.Product.id > state["last_id"])
+                .order_by(models.Product.id)
+                .limit(min(PAGE_SIZE, total - done))
+            ]
+        finally:
+            db.close()
+        if not page:
+            break
+        await asyncio.gather(*(run(product_id) for product_id in page))
+        state["last_id"] = page[-1]
+        checkpoint.save()
+
+    logger.info(_progress(done, total, started))
+    logger.info(f"Warm-up finished: {state['generated']} generated, {state['failed']} failed")
+    checkpoint.clear()
+    return state
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Pre-generate product analyses so requests are served from the database")
+    parser.add_argument("--category", help="Only products whose category contains this text")
+    parser.add_argument("--brand", help="Only products whose brand contains this text")
+    parser.add_argument("--concurrency", type=int, default=4, help="Analyses generated at the same time")
+    parser.add_argument("--rate", type=int, default=None, help="Model requests per minute (default: LLM_REQUESTS_PER_MINUTE)")
+    parser.add_argument("--expiring-within", type=float, default=0.0, metavar="HOURS",
+                        help="Also refresh analyses that will go stale within this many hours")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many products")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--restart", action="store_true", help="Ignore any checkpoint and start from the first product")
+    args = parser.parse_args()
+
+    ensure_schema(engine)
+    asyncio.run(warm(
+        args.category, args.brand, args.concurrency, args.rate, args.expiring_within,
+        args.limit, args.checkpoint, resume=not args.restart
+    ))
@@ -0,0 +1,82 @@
+import sqlite3
+import time
+import zlib
+
+
+class HtmlArchive:
+    """Raw pages as fetched, zlib-compressed in a SQLite file.
+
+    Every fetch is kept, keyed by URL and fetch time, so a parser fix is
+    applied by re-parsing the archive instead of re-crawling the site.
+    Several processes can read the archive at once while the crawl writes.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            return
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                html BLOB NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_pages_url_fetched ON pages (url, fetched_at)")
+        self.conn.commit()
+
+    @staticmethod
+    def compress(html):
+        return zlib.compress(html.encode("utf-8"), 6)
+
+    @staticmethod
+    def decompress(blob):
+        return zlib.decompress(blob).decode("utf-8")
+
+    def put(self, url, kind, compressed_html, fetched_at=None):
+        """Store a page compressed with `compress()`, typically by the worker that fetched it"""
+        self.conn.execute(
+            "INSERT INTO pages (url, kind, fetched_at, html) VALUES (?, ?, ?, ?)",
+            (url, kind, fetched_at or time.time(), compressed_html)
+        )
+        self.conn.commit()
+
+    def latest(self, url):
+        """(fetched_at, html) of the newest fetch of the URL, or None"""
+        row = self.conn.execute(
+            "SELECT fetched_at, html FROM pages WHERE url = ? ORDER BY fetched_at DESC LIMIT 1", (url,)
+        ).fetchone()
+        return None if row is None else (row[0], self.decompress(row[1]))
+
+    def latest_ids(self, kind="product", before=None):
+        """Ids of the newest fetch of every URL of a kind, optionally as of a point in time"""
+        return [row[0] for row in self.conn.execute(
+            """
+            SELECT MAX(id) FROM pages
+            WHERE kind = ? AND fetched_at <= ?
+            GROUP BY url ORDER BY MAX(id)
+            """,
+            (kind, before or float("inf"))
+        )]
+
+    def pages(self, ids):
+        """(url, fetched_at, html) for the given ids, decompressed"""
+        placeholders = ", ".join("?" * len(ids))
+        for url, fetched_at, blob in self.conn.execute(
+            f"SELECT url, fetched_at, html FROM pages WHERE id IN ({placeholders}) ORDER BY id", ids
+        ):
+            yield url, fetched_at, self.decompress(blob)
+
+    def stats(self):
+        pages, urls, stored = self.conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT url), COALESCE(SUM(LENGTH(html)), 0) FROM pages"
+        ).fetchone()
+        return {"pages": pages, "urls": urls, "compressed_bytes": stored}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from archive import HtmlArchive
+from fixture_server import FIXTURES, product_fields
+from parse import parse_product, parse_product_bs4
+from reparse import reparse
+
+# Product pages in a full crawl: 193 listing pages of 40 products
+CATALOG_PAGES = 193 * 40
+
+
+def build_fixture_archive(path, pages):
+    """An archive of `pages` product pages rendered from the fixtures"""
+    with open(os.path.join(FIXTURES, "product.html"), encoding="utf-8") as f:
+        template = f.read()
+    archive = HtmlArchive(path)
+    try:
+        for product_id in range(1, pages + 1):
+            html = template.format(**product_fields(product_id))
+            archive.put(f"http://fixtures/pd/{product_id}/", "product", HtmlArchive.compress(html))
+    finally:
+        archive.close()
+
+
+def _time_parser(parser, pages):
+    started = time.perf_counter()
+    records = [parser(html, url) for url, html in pages]
+    return records, time.perf_counter() - started
+
+
+def benchmark(archive_path, sample, workers):
+    archive = HtmlArchive(archive_path, readonly=True)
+    try:
+        ids = archive.latest_ids("product")
+        pages = [(url, html) for url, _, html in archive.pages(ids[:sample])]
+    finally:
+        archive.close()
+
+    bs4_records, bs4_seconds = _time_parser(parse_product_bs4, pages)
+    fast_records, fast_seconds = _time_parser(parse_product, pages)
+    # The fast parser must extract exactly what the original one did
+    mismatches = sum(a != b for a, b in zip(bs4_records, fast_records))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        total, pool_seconds = reparse(archive_path, os.path.join(tmp, "reparsed.csv"), workers)
+
+    pool_rate = total / pool_seconds if pool_seconds else 0.0
+    return {
+        "sample_pages": len(pages),
+        "mismatches": mismatches,
+        "bs4_pages_per_second": round(len(pages) / bs4_seconds, 1),
+        "selectolax_pages_per_second": round(len(pages) / fast_seconds, 1),
+        "speedup": round(bs4_seconds / fast_seconds, 1),
+        "pool_workers": workers or os.cpu_count(),
+        "pool_pages": total,
+        "pool_pages_per_second": round(pool_rate, 1),
+        "full_catalog_seconds": round(CATALOG_PAGES / pool_rate, 1) if pool_rate else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the BeautifulSoup and selectolax product parsers on archived pages")
+    parser.add_argument("--archive", help="Archive to benchmark on (default: one built from the fixtures)")
+    parser.add_argument("--pages", type=int, default=2000, help="Fixture pages to archive when no --archive is given")
+    parser.add_argument("--sample", type=int, default=500, help="Pages parsed by each parser in a single process")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        archive_path = args.archive
+        if archive_path is None:
+            archive_path = os.path.join(tmp, "fixtures.db")
+            build_fixture_archive(archive_path, args.pages)
+        results = benchmark(archive_path, args.sample, args.workers)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -1,11 +1,83 @@
+import argparse
+import hashlib
+import os
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from snapshots import COLUMNS, SnapshotStore, StageReport
+
+SCHEMA = pa.schema([(column, pa.string()) for column in COLUMNS] + [("row_hash", pa.uint64())])
+
+
+def clean_chunk(df):
+    """Tidy one chunk of scraped records; rows without a numeric EAN are dropped"""
+    df = df.reindex(columns=COLUMNS)
+    df["EAN"] = df["EAN"].str.strip()
+    df = df[df["EAN"].str.isdigit().fillna(False).astype(bool)]
+    # Keep only the part of "product_name" before the comma (drops the pack size)
+    return df.assign(product_name=df["product_name"].str.split(",").str[0])
+
+
+def clean(csv_path, store, chunksize=5000, report=None):
+    """Stream the scraper's CSV into a new snapshot version.
+
+    Duplicates are detected on a 64-bit hash of the EAN, so only one
+    integer per product is held in memory however large the catalog; the
+    first record of an EAN wins. Each row also gets a hash of its contents,
+    which the importer uses to diff snapshots.
+    """
+    report = report or StageReport()
+    version, file = store.next_file()
+    path = os.path.join(store.directory, file)
+    seen = set()
+    content = hashlib.sha256()
+    counts = {"read": 0, "rows": 0, "duplicates": 0, "rejected": 0}
+
+    with pq.ParquetWriter(path, SCHEMA, compression="zstd") as writer:
+        reader = pd.read_csv(csv_path, chunksize=chunksize, dtype=str)
+        while True:
+            with report.stage("read"):
+                chunk = next(reader, None)
+            if chunk is None:
+                break
+            counts["read"] += len(chunk)
+            with report.stage("clean"):
+                cleaned = clean_chunk(chunk)
+                counts["rejected"] += len(chunk) - len(cleaned)
+            with report.stage("dedup"):
+                first = []
+                for ean_hash in pd.util.hash_array(cleaned["EAN"].to_numpy(dtype=object)).tolist():
+                    first.append(ean_hash not in seen)
+                    seen.add(ean_hash)
+                counts["duplicates"] += first.count(False)
+                cleaned = cleaned[first]
+            with report.stage("write"):
+                row_hash = pd.util.hash_pandas_object(cleaned[COLUMNS].fillna(""), index=False)
+                table = pa.Table.from_pandas(cleaned.assign(row_hash=row_hash.to_numpy()), schema=SCHEMA,
+                                             preserve_index=False)
+                writer.write_table(table)
+                content.update(row_hash.to_numpy().tobytes())
+                counts["rows"] += len(cleaned)
+
+    with report.stage("publish"):
+        entry, created = store.publish(version, file, source=os.path.abspath(csv_path),
+                                       content_hash=content.hexdigest(), **counts)
+    return entry, created, report
+
 
-# Load the CSV file into a DataFrame
-df = pd.read_csv('data.csv')
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clean the scraped CSV into a versioned Parquet snapshot")
+    parser.add_argument("csv_path", nargs="?", default="data.csv")
+    parser.add_argument("--snapshots", default="snapshots", help="Directory holding the snapshot versions")
+    parser.add_argument("--chunksize", type=int, default=5000)
+    args = parser.parse_args()
 
-# Drop duplicate rows
-df.drop_duplicates(inplace=True)
-# Split the "product_name" column by comma and keep only the part before the comma
-df["product_name"] = df["product_name"].str.split(",").str[0]
-# Save the DataFrame back to the same CSV file, without the index
-df.to_csv('clean_data.csv', index=False)
\ No newline at end of file
+    entry, created, report = clean(args.csv_path, SnapshotStore(args.snapshots), args.chunksize)
+    if created:
+        print(f"Snapshot v{entry['version']}: {entry['rows']} products "
+              f"({entry['duplicates']} duplicates, {entry['rejected']} without an EAN dropped)")
+    else:
+        print(f"Catalog unchanged since snapshot v{entry['version']}; no new version written")
+    report.print()
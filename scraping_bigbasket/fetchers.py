@@ -0,0 +1,60 @@
+import requests
+
+
+class SeleniumFetcher:
+    """Page source through a Chrome WebDriver, for pages rendered by JavaScript"""
+
+    def __init__(self, headless=True):
+        # Imported here so the requests fetcher works without selenium installed
+        from selenium import webdriver
+        from selenium.common.exceptions import WebDriverException
+
+        self._webdriver = webdriver
+        self.errors = (WebDriverException,)
+        self.headless = headless
+        self.driver = None
+        self._start()
+
+    def _start(self):
+        options = self._webdriver.ChromeOptions()
+        if self.headless:
+            options.add_argument("--headless=new")
+        self.driver = self._webdriver.Chrome(options=options)
+
+    def fetch(self, url):
+        try:
+            self.driver.get(url)
+            return self.driver.page_source
+        except self.errors:
+            # A crashed or hung browser is replaced; the URL is retried by the frontier
+            self.close()
+            self._start()
+            raise
+
+    def close(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+            self.driver = None
+
+
+class RequestsFetcher:
+    """Plain HTTP GET, for server-rendered pages and the local fixture server"""
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = "Mozilla/5.0 (X11; Linux x86_64) LabelInsight scraper"
+
+    def fetch(self, url):
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
+
+    def close(self):
+        self.session.close()
+
+
+FETCHERS = {"selenium": SeleniumFetcher, "requests": RequestsFetcher}
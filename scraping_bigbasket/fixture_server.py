@@ -0,0 +1,114 @@
+import argparse
+import os
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Serves BigBasket-shaped pages built from the HTML in fixtures/, so the
+# scraper can be run end to end without touching the real site:
+#
+#   python fixture_server.py --port 8765 &
+#   python main.py --fetcher requests --pages 20 \
+#       --listing-url "http://127.0.0.1:8765/cl/snacks-branded-foods/?nc=nb&page={page}" \
+#       --base-url http://127.0.0.1:8765
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+BRANDS = ["Haldiram's", "Lay's", "Bingo", "Britannia", "Parle", "Too Yumm"]
+SNACKS = ["Aloo Bhujia", "Masala Chips", "Salted Peanuts", "Cream Biscuits", "Multigrain Puffs", "Moong Dal"]
+INGREDIENTS = [
+    "Edible Vegetable Oil (Palmolein Oil)", "Potato", "Gram Flour", "Salt", "Sugar", "Spices and Condiments",
+    "Wheat Flour", "Milk Solids", "Flavour Enhancer (INS 627, INS 631)", "Acidity Regulator (INS 330)",
+    "Antioxidant (INS 319)", "Peanuts", "Rice Flour", "Corn Meal", "Emulsifier (INS 322)",
+]
+
+
+def _template(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def product_fields(product_id):
+    """Deterministic fake product data for an id"""
+    rng = random.Random(product_id)
+    brand = rng.choice(BRANDS)
+    name = f"{brand} {rng.choice(SNACKS)}"
+    return {
+        "product_id": product_id,
+        "name": name,
+        "slug": re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-"),
+        "brand": brand,
+        "brand_slug": re.sub(r"[^a-z0-9]+", "-", brand.lower()).strip("-"),
+        "weight": rng.choice([40, 150, 200, 400]),
+        "about": f"{name} is a crunchy, ready-to-eat snack. " * rng.randint(1, 4),
+        "ingredients": ", ".join(rng.sample(INGREDIENTS, rng.randint(4, 9))),
+        "nutritional": (
+            f"Energy - {rng.randint(350, 600)} kcal, Protein - {rng.randint(2, 20)} g, "
+            f"Carbohydrate - {rng.randint(30, 70)} g, Sugar - {rng.randint(0, 30)} g, "
+            f"Total Fat - {rng.randint(5, 40)} g, Sodium - {rng.randint(100, 1200)} mg"
+        ),
+        "ean": f"890{product_id:010d}",
+    }
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    pages = 193
+    per_page = 40
+    delay = 0.0
+    error_rate = 0.0
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+        if random.random() < self.error_rate:
+            return self._send(503, "Service Unavailable")
+        url = urlparse(self.path)
+        if url.path.startswith("/cl/"):
+            page = int(parse_qs(url.query).get("page", ["1"])[0])
+            if not 1 <= page <= self.pages:
+                return self._send(404, "Not Found")
+            item = _template("listing_item.html")
+            first = (page - 1) * self.per_page + 1
+            items = "".join(
+                item.format(**product_fields(product_id)) for product_id in range(first, first + self.per_page)
+            )
+            return self._send(200, _template("listing.html").format(items=items))
+        match = re.match(r"^/pd/(\d+)/", url.path)
+        if match:
+            return self._send(200, _template("product.html").format(**product_fields(int(match.group(1)))))
+        return self._send(404, "Not Found")
+
+    def _send(self, status, body):
+        payload = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=8765, pages=193, per_page=40, delay=0.0, error_rate=0.0):
+    FixtureHandler.pages = pages
+    FixtureHandler.per_page = per_page
+    FixtureHandler.delay = delay
+    FixtureHandler.error_rate = error_rate
+    server = ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler)
+    print(f"Serving {pages} listing pages of {per_page} products on http://127.0.0.1:{port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local BigBasket-shaped site for running the scraper against")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pages", type=int, default=193)
+    parser.add_argument("--per-page", type=int, default=40)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds added to every response, like a slow site")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    args = parser.parse_args()
+
+    serve(args.port, args.pages, args.per_page, args.delay, args.error_rate)
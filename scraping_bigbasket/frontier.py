@@ -0,0 +1,107 @@
+import sqlite3
+import time
+
+
+class Frontier:
+    """Persistent queue of listing and product URLs in a SQLite file.
+
+    Every URL is stored once with its status, so a crawl that stops for any
+    reason resumes where it left off: URLs that were in flight go back to
+    pending when the frontier is reopened. A failed URL is retried after an
+    exponential backoff until it has used up `max_attempts`, then kept as
+    failed with its last error.
+    """
+
+    def __init__(self, path, max_attempts=3, backoff=5.0):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                not_before REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_urls_status ON urls (status, not_before)")
+        # Whatever was in flight when the last run stopped is fetched again
+        self.conn.execute("UPDATE urls SET status = 'pending' WHERE status = 'in_progress'")
+        self.conn.commit()
+
+    def add(self, urls, kind):
+        """Queue URLs that have not been seen before; returns how many were new"""
+        before = self.conn.total_changes
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO urls (url, kind, updated_at) VALUES (?, ?, ?)",
+            [(url, kind, time.time()) for url in urls]
+        )
+        self.conn.commit()
+        return self.conn.total_changes - before
+
+    def claim(self, limit):
+        """Up to `limit` (url, kind) pairs that are due, listing pages first"""
+        now = time.time()
+        rows = self.conn.execute(
+            "SELECT url, kind FROM urls WHERE status = 'pending' AND not_before <= ? "
+            "ORDER BY kind = 'product', attempts, rowid LIMIT ?",
+            (now, limit)
+        ).fetchall()
+        self.conn.executemany(
+            "UPDATE urls SET status = 'in_progress', updated_at = ? WHERE url = ?",
+            [(now, url) for url, _ in rows]
+        )
+        self.conn.commit()
+        return rows
+
+    def done(self, url):
+        self.conn.execute(
+            "UPDATE urls SET status = 'done', last_error = NULL, updated_at = ? WHERE url = ?",
+            (time.time(), url)
+        )
+        self.conn.commit()
+
+    def failed(self, url, error):
+        """Schedule a retry, or give up once the URL has used all its attempts"""
+        attempts = self.conn.execute("SELECT attempts FROM urls WHERE url = ?", (url,)).fetchone()[0] + 1
+        now = time.time()
+        if attempts >= self.max_attempts:
+            status, not_before = "failed", now
+        else:
+            status, not_before = "pending", now + self.backoff * 2 ** (attempts - 1)
+        self.conn.execute(
+            "UPDATE urls SET status = ?, attempts = ?, not_before = ?, last_error = ?, updated_at = ? WHERE url = ?",
+            (status, attempts, not_before, str(error)[:500], now, url)
+        )
+        self.conn.commit()
+        return status == "pending"
+
+    def retry_failed(self):
+        """Give every permanently failed URL a fresh set of attempts"""
+        count = self.conn.execute(
+            "UPDATE urls SET status = 'pending', attempts = 0, not_before = 0 WHERE status = 'failed'"
+        ).rowcount
+        self.conn.commit()
+        return count
+
+    def next_due(self):
+        """Seconds until the next pending URL is due, or None if nothing is pending"""
+        row = self.conn.execute("SELECT MIN(not_before) FROM urls WHERE status = 'pending'").fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def counts(self):
+        counts = {"pending": 0, "in_progress": 0, "done": 0, "failed": 0}
+        counts.update(self.conn.execute("SELECT status, COUNT(*) FROM urls GROUP BY status").fetchall())
+        return counts
+
+    def failures(self, limit=50):
+        return self.conn.execute(
+            "SELECT url, last_error FROM urls WHERE status = 'failed' ORDER BY rowid LIMIT ?", (limit,)
+        ).fetchall()
+
+    def close(self):
+        self.conn.close()
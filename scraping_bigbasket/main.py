@@ -1,131 +1,161 @@
+import argparse
+import csv
 import logging
-import re
+import os
 import time
-from bs4 import BeautifulSoup
-import pandas as pd
-from selenium import webdriver
-from selenium.common.exceptions import WebDriverException
-
-def scrape_url_data(driver, url):
-    print(f"Scraping data for URL: {url}")
-    try:
-        driver.get(url)
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-        data = {}
-
-        product_name_element = soup.find('h1', class_='Description___StyledH-sc-82a36a-2 bofYPK')
-        if product_name_element:
-            data["product_name"] = product_name_element.text
-            print("Product name found")
-        else:
-            logging.warning(f"Product name not found for URL: {url}")
-            data["product_name"] = "Not Found"
-
-        details = soup.findAll('div', class_="MoreDetails___StyledDiv-sc-1h9rbjh-0")
-        for detail in details:
-            title_element = detail.find("span", class_="Label-sc-15v1nk5-0")
-            title = title_element.text if title_element else None
-
-            if title == "Ingredients":
-                ingredients_element = detail.find("div", style="font-family: 'ProximaNova-Regular';font-size:13px;line-height: 18px;color:8f8f8f;")
-                data["Ingredients"] = ingredients_element.text.replace('\n', '').strip() if ingredients_element else "Not Found"
-                print("Ingredients found")
-            elif title == "Nutritional Facts":
-                nutritional_element = detail.find("div", style="font-family: 'ProximaNova-Regular';font-size:13px;line-height: 18px;color:8f8f8f;")
-                data["Nutritional"] = nutritional_element.text.replace('\n', '').strip() if nutritional_element else "Not Found"
-                print("Nutritional Facts found")
-            elif title == "About the Product":
-                about_element = detail.find("div", style="font-family: 'ProximaNova-Regular';font-size:13px;line-height: 18px;color:8f8f8f;")
-                data["About"] = about_element.text.replace('\n', '').strip() if about_element else "Not Found"
-                print("About the Product found")
-            elif title == "Other Product Info":
-                txt_element = detail.find("div", style="font-family: 'ProximaNova-Regular';font-size:13px;line-height: 18px;color:8f8f8f;")
-                txt = txt_element.text.strip() if txt_element else ""
-                match = re.search(r'EAN Code: ?(\d+)', txt)
-                if match:
-                    data["EAN"] = match.group(1)
-                    print("EAN Code found")
-                else:
-                    data["EAN"] = "Not Found"
-
-        return data
-
-    except Exception as e:
-        logging.error(f"Error scraping URL {url}: {e}")
-        return {}
- 
-def main():
-    final_data = []
-    products_url = []
-    missed_url = []
-
-    try:
-        print("Initializing WebDriver")
-        driver = webdriver.Chrome()
-    except WebDriverException as e:
-        logging.error(f"Error initializing WebDriver: {e}")
-        return
-
-    try:
-        for i in range(1, 194):
-            base_url = f"https://www.bigbasket.com/cl/snacks-branded-foods/?nc=nb&page={i}"
-            print(f"Accessing base URL: {base_url}")
-
-            try:
-                driver.get(base_url)
-                soup = BeautifulSoup(driver.page_source, 'html.parser')
-                ul_element = soup.find('ul', class_='mt-5 grid gap-6 grid-cols-9')
-                links = ul_element.find_all('a', attrs={"target": "_blank"})
-
-                if links:
-                    for link in links:
-                        href = link.get('href')
-                        products_url.append("https://www.bigbasket.com/" + href)
-                else:
-                    print("Links not found for: ", base_url)
-                    missed_url.append(base_url)
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import util
+
+from archive import HtmlArchive
+from fetchers import FETCHERS
+from frontier import Frontier
+from parse import BASE_URL, FIELDS, parse_listing, parse_product
+
+LISTING_URL = BASE_URL + "/cl/snacks-branded-foods/?nc=nb&page={page}"
+LISTING_PAGES = 193
+PROGRESS_INTERVAL = 30.0
+
+# One fetcher (and so one browser) per worker process
+_fetcher = None
+
+
+def init_worker(fetcher_name, headless):
+    global _fetcher
+    if fetcher_name == "selenium":
+        _fetcher = FETCHERS[fetcher_name](headless=headless)
+    else:
+        _fetcher = FETCHERS[fetcher_name]()
+    # Quit the browser when the pool shuts the process down
+    util.Finalize(None, _fetcher.close, exitpriority=10)
+
+
+def scrape(url, kind, base_url):
+    """Fetch, compress and parse one URL in a worker process.
+
+    Returns (fetched_at, compressed html, product links or product record).
+    """
+    html = _fetcher.fetch(url)
+    fetched_at = time.time()
+    parsed = parse_listing(html, base_url) if kind == "listing" else parse_product(html, url)
+    return fetched_at, HtmlArchive.compress(html), parsed
+
+
+class RecordWriter:
+    """Appends product records to the CSV as they arrive, so a crash loses nothing already scraped"""
+
+    def __init__(self, path):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.file, fieldnames=FIELDS, extrasaction="ignore")
+        if new_file:
+            self.writer.writeheader()
+        self.written = 0
+
+    def write(self, record):
+        self.writer.writerow(record)
+        self.file.flush()
+        self.written += 1
+
+    def close(self):
+        self.file.close()
+
+
+def crawl(frontier, writer, archive, workers=4, fetcher="selenium", headless=True, base_url=BASE_URL):
+    """Scrape every pending URL in the frontier with a pool of worker processes.
+
+    Every fetched page is archived, so records can be re-extracted later
+    with reparse.py without fetching the site again.
+    """
+    started = last_report = time.monotonic()
+    pages = 0
+    in_flight = {}
+
+    def report():
+        elapsed = time.monotonic() - started
+        rate = pages / elapsed * 60 if elapsed else 0.0
+        counts = frontier.counts()
+        print(f"{pages} pages in {elapsed:.0f}s ({rate:.1f} pages/min), {writer.written} products written, "
+              f"{counts['pending'] + counts['in_progress']} queued, {counts['failed']} failed")
+        return rate
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(fetcher, headless)) as pool:
+        while True:
+            # Keep every worker busy, with one URL waiting behind each
+            free = workers * 2 - len(in_flight)
+            if free > 0:
+                for url, kind in frontier.claim(free):
+                    in_flight[pool.submit(scrape, url, kind, base_url)] = (url, kind)
+            if not in_flight:
+                due = frontier.next_due()
+                if due is None:
+                    break
+                # Only retries waiting out their backoff are left
+                time.sleep(min(due, 5.0))
+                continue
+
+            finished, _ = wait(in_flight, timeout=5.0, return_when=FIRST_COMPLETED)
+            for future in finished:
+                url, kind = in_flight.pop(future)
+                pages += 1
+                try:
+                    fetched_at, compressed, result = future.result()
+                    archive.put(url, kind, compressed, fetched_at)
+                    if kind == "listing" and not result:
+                        raise ValueError("Links not found")
+                except Exception as e:
+                    if frontier.failed(url, e):
+                        logging.warning(f"Error scraping {url}, will retry: {e}")
+                    else:
+                        logging.error(f"Giving up on {url}: {e}")
                     continue
-
-            except WebDriverException as e:
-                print(f"Error processing {base_url}: {e}")
-                driver.close()
-                print("Initializing new WebDriver")
-                driver = webdriver.Chrome()
-                time.sleep(1)
-                driver.get(base_url)
-                soup = BeautifulSoup(driver.page_source, 'html.parser')
-                ul_element = soup.find('ul', class_='mt-5 grid gap-6 grid-cols-9')
-                links = ul_element.find_all('a', attrs={"target": "_blank"})
-
-                if links:
-                    for link in links:
-                        href = link.get('href')
-                        products_url.append("https://www.bigbasket.com/" + href)
+                if kind == "listing":
+                    added = frontier.add(result, "product")
+                    print(f"Found {added} new product URLs on {url}")
                 else:
-                    print("Links not found for: ", base_url)
-                    missed_url.append(base_url)
-                    continue
+                    writer.write(result)
+                frontier.done(url)
 
-            print(f"Found {len(products_url)} product URLs")
+            if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                report()
 
-        for product in products_url:
-            product_data = scrape_url_data(driver, product)
-            final_data.append(product_data)
+    return report()
 
-    except Exception as e:
-        logging.error(f"Error during main processing: {e}")
-
-    finally:
-        driver.close()
-        print("WebDriver closed")
-        print("Missed URLs: ", missed_url)
 
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Scrape BigBasket listing and product pages into a CSV")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes, each with its own browser")
+    parser.add_argument("--fetcher", choices=sorted(FETCHERS), default="selenium",
+                        help="selenium renders pages in Chrome; requests fetches raw HTML")
+    parser.add_argument("--show-browser", action="store_true", help="Run Chrome with a window")
+    parser.add_argument("--pages", type=int, default=LISTING_PAGES, help="Listing pages to walk")
+    parser.add_argument("--listing-url", default=LISTING_URL, help="Listing page URL with a {page} placeholder")
+    parser.add_argument("--base-url", default=BASE_URL, help="Prefix for product links found on listing pages")
+    parser.add_argument("--frontier", default="frontier.db", help="Crawl state, reused to resume")
+    parser.add_argument("--output", default="data.csv", help="CSV the records are appended to")
+    parser.add_argument("--archive", default="archive.db", help="Compressed store of every fetched page")
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--retry-failed", action="store_true", help="Retry URLs that failed in earlier runs")
+    args = parser.parse_args()
+
+    frontier = Frontier(args.frontier, max_attempts=args.max_attempts)
+    writer = RecordWriter(args.output)
+    archive = HtmlArchive(args.archive)
     try:
-        df = pd.DataFrame(final_data)
-        df.to_csv('data.csv', index=False)
-        print("Data written to CSV")
-    except Exception as e:
-        logging.error(f"Error writing to CSV: {e}")
+        frontier.add([args.listing_url.format(page=page) for page in range(1, args.pages + 1)], "listing")
+        if args.retry_failed:
+            print(f"Retrying {frontier.retry_failed()} failed URLs")
+        crawl(frontier, writer, archive, args.workers, args.fetcher, not args.show_browser, args.base_url)
+        failures = frontier.failures()
+        if failures:
+            print("Missed URLs:")
+            for url, error in failures:
+                print(f"  {url}: {error}")
+    finally:
+        writer.close()
+        archive.close()
+        frontier.close()
 
 
 if __name__ == "__main__":
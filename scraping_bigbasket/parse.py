@@ -0,0 +1,106 @@
+import logging
+import re
+from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
+
+BASE_URL = "https://www.bigbasket.com"
+
+# Inline style BigBasket puts on the body of every "More details" section
+DETAIL_STYLE = "font-family: 'ProximaNova-Regular';font-size:13px;line-height: 18px;color:8f8f8f;"
+
+# Record columns, in the order they are written to the CSV
+FIELDS = ["product_name", "Ingredients", "Nutritional", "About", "EAN", "url"]
+
+# Selectors match the stable prefix of BigBasket's generated class names,
+# not the hash suffix that changes with every site build
+LISTING_LINKS = 'ul.grid a[target="_blank"]'
+PRODUCT_NAME = 'h1[class^="Description___StyledH"]'
+DETAIL_SECTION = 'div[class*="MoreDetails___StyledDiv"]'
+DETAIL_TITLE = 'span[class^="Label-sc"]'
+DETAIL_BODY = 'div[style*="ProximaNova-Regular"]'
+
+# Section titles and the record field each one fills
+SECTIONS = {
+    "Ingredients": "Ingredients",
+    "Nutritional Facts": "Nutritional",
+    "About the Product": "About",
+}
+
+
+def parse_listing(html, base_url=BASE_URL):
+    """Product URLs on a category listing page; empty if the grid is missing"""
+    tree = LexborHTMLParser(html)
+    hrefs = [link.attributes.get("href") for link in tree.css(LISTING_LINKS)]
+    return [base_url.rstrip("/") + "/" + href.lstrip("/") for href in hrefs if href]
+
+
+def parse_product(html, url=None):
+    """Name, ingredients, nutrition, about text and EAN from a product page"""
+    tree = LexborHTMLParser(html)
+    data = {}
+
+    product_name_element = tree.css_first(PRODUCT_NAME)
+    if product_name_element:
+        data["product_name"] = product_name_element.text()
+    else:
+        logging.warning(f"Product name not found for URL: {url}")
+        data["product_name"] = "Not Found"
+
+    for detail in tree.css(DETAIL_SECTION):
+        title_element = detail.css_first(DETAIL_TITLE)
+        title = title_element.text() if title_element else None
+        body = detail.css_first(DETAIL_BODY)
+
+        if title in SECTIONS:
+            data[SECTIONS[title]] = body.text().replace('\n', '').strip() if body else "Not Found"
+        elif title == "Other Product Info":
+            txt = body.text().strip() if body else ""
+            match = re.search(r'EAN Code: ?(\d+)', txt)
+            data["EAN"] = match.group(1) if match else "Not Found"
+
+    data["url"] = url
+    return data
+
+
+# The original BeautifulSoup parsers, kept as the reference the fast ones
+# are checked and benchmarked against (see bench_parse.py)
+
+def parse_listing_bs4(html, base_url=BASE_URL):
+    soup = BeautifulSoup(html, 'html.parser')
+    ul_element = soup.find('ul', class_='mt-5 grid gap-6 grid-cols-9')
+    if not ul_element:
+        return []
+    links = ul_element.find_all('a', attrs={"target": "_blank"})
+    return [base_url.rstrip("/") + "/" + link.get('href').lstrip("/") for link in links if link.get('href')]
+
+
+def parse_product_bs4(html, url=None):
+    soup = BeautifulSoup(html, 'html.parser')
+    data = {}
+
+    product_name_element = soup.find('h1', class_='Description___StyledH-sc-82a36a-2 bofYPK')
+    if product_name_element:
+        data["product_name"] = product_name_element.text
+    else:
+        logging.warning(f"Product name not found for URL: {url}")
+        data["product_name"] = "Not Found"
+
+    details = soup.find_all('div', class_="MoreDetails___StyledDiv-sc-1h9rbjh-0")
+    for detail in details:
+        title_element = detail.find("span", class_="Label-sc-15v1nk5-0")
+        title = title_element.text if title_element else None
+        body = detail.find("div", style=DETAIL_STYLE)
+
+        if title == "Ingredients":
+            data["Ingredients"] = body.text.replace('\n', '').strip() if body else "Not Found"
+        elif title == "Nutritional Facts":
+            data["Nutritional"] = body.text.replace('\n', '').strip() if body else "Not Found"
+        elif title == "About the Product":
+            data["About"] = body.text.replace('\n', '').strip() if body else "Not Found"
+        elif title == "Other Product Info":
+            txt = body.text.strip() if body else ""
+            match = re.search(r'EAN Code: ?(\d+)', txt)
+            data["EAN"] = match.group(1) if match else "Not Found"
+
+    data["url"] = url
+    return data
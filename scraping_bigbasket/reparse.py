@@ -0,0 +1,53 @@
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from archive import HtmlArchive
+from parse import FIELDS, parse_product
+
+CHUNK_SIZE = 200
+
+
+def parse_chunk(archive_path, ids, parser=parse_product):
+    """Parse a chunk of archived product pages in a worker process"""
+    archive = HtmlArchive(archive_path, readonly=True)
+    try:
+        return [parser(html, url) for url, _, html in archive.pages(ids)]
+    finally:
+        archive.close()
+
+
+def reparse(archive_path, output, workers=None, before=None, chunk_size=CHUNK_SIZE):
+    """Re-extract a product record from the newest archived copy of every product page"""
+    archive = HtmlArchive(archive_path, readonly=True)
+    try:
+        ids = archive.latest_ids("product", before)
+    finally:
+        archive.close()
+    chunks = [ids[start:start + chunk_size] for start in range(0, len(ids), chunk_size)]
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool, \
+            open(output, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for records in pool.map(parse_chunk, [archive_path] * len(chunks), chunks):
+            writer.writerows(records)
+    elapsed = time.perf_counter() - started
+    print(f"Parsed {len(ids)} pages in {elapsed:.2f}s ({len(ids) / elapsed if elapsed else 0:.0f} pages/s)")
+    return len(ids), elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the product CSV from archived pages, without re-crawling")
+    parser.add_argument("--archive", default="archive.db")
+    parser.add_argument("--output", default="data.csv")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes (default: one per CPU)")
+    parser.add_argument("--as-of", type=datetime.fromisoformat, default=None,
+                        help="Use the pages as they were fetched at this time, e.g. 2024-05-01T12:00")
+    args = parser.parse_args()
+
+    reparse(args.archive, args.output, args.workers, args.as_of.timestamp() if args.as_of else None)
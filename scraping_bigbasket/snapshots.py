@@ -0,0 +1,104 @@
+import json
+import os
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+# Columns of a catalog snapshot; row_hash covers every other column
+COLUMNS = ["EAN", "product_name", "Ingredients", "Nutritional", "About", "url"]
+MANIFEST = "manifest.json"
+
+
+class SnapshotStore:
+    """Versioned Parquet snapshots of the cleaned catalog in one directory.
+
+    manifest.json lists every version with its file, row counts and a
+    content hash, so the importer can load the latest snapshot or diff any
+    two of them.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        if not os.path.exists(path):
+            return {"versions": []}
+        with open(path) as f:
+            return json.load(f)
+
+    def versions(self):
+        return self._manifest()["versions"]
+
+    def path(self, version=None):
+        """File of a version, the latest by default"""
+        versions = self.versions()
+        if not versions:
+            raise FileNotFoundError(f"No snapshots in {self.directory}")
+        entry = versions[-1] if version is None else next(v for v in versions if v["version"] == version)
+        return os.path.join(self.directory, entry["file"])
+
+    def next_file(self):
+        version = len(self.versions()) + 1
+        return version, f"catalog-v{version:04d}.parquet"
+
+    def publish(self, version, file, **details):
+        """Record a written snapshot; an unchanged catalog does not get a new version"""
+        manifest = self._manifest()
+        latest = manifest["versions"][-1] if manifest["versions"] else None
+        if latest and latest["content_hash"] == details["content_hash"]:
+            os.remove(os.path.join(self.directory, file))
+            return latest, False
+        entry = {"version": version, "file": file, "created_at": datetime.utcnow().isoformat(), **details}
+        manifest["versions"].append(entry)
+        tmp_path = os.path.join(self.directory, MANIFEST + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.directory, MANIFEST))
+        return entry, True
+
+
+class StageReport:
+    """Wall time and peak memory of each pipeline stage.
+
+    A stage can be entered many times, e.g. once per chunk; its time adds
+    up and its peak is the largest seen. Peaks are Python-level
+    allocations traced by tracemalloc, including pandas/numpy buffers; the
+    process RSS high-water mark is reported alongside.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            entry = self.stages.setdefault(name, {"seconds": 0.0, "peak_mb": 0.0, "calls": 0})
+            entry["seconds"] += time.perf_counter() - started
+            entry["peak_mb"] = max(entry["peak_mb"], peak / 2 ** 20)
+            entry["calls"] += 1
+
+    def summary(self):
+        return {
+            "stages": {
+                name: {"seconds": round(e["seconds"], 3), "peak_mb": round(e["peak_mb"], 1), "calls": e["calls"]}
+                for name, e in self.stages.items()
+            },
+            # ru_maxrss is in KiB on Linux
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+    def print(self):
+        summary = self.summary()
+        for name, e in summary["stages"].items():
+            print(f"  {name:<10} {e['seconds']:>8.3f}s  peak {e['peak_mb']:>7.1f} MB  ({e['calls']} calls)")
+        print(f"  max RSS {summary['max_rss_mb']} MB")